@@ -0,0 +1,129 @@
+"""Tiered OCR: a cheap first pass, escalating only when the result looks bad"""
+import threading
+import time
+
+import preprocessing
+import regions
+
+FAST_WIDTH = 1600      # First pass works on a modest, unbinarized grayscale image
+UPSCALE_WIDTH = 2000   # Escalation tiers upscale small images to this width
+
+PREPARERS = {
+    'gray': lambda base: preprocessing.fit_width(base, max_width=FAST_WIDTH),
+    'standard': lambda base: preprocessing.binarize(preprocessing.fit_width(base, min_width=preprocessing.TARGET_WIDTH)),
+    'otsu': lambda base: preprocessing.binarize_otsu(preprocessing.fit_width(base, min_width=UPSCALE_WIDTH)),
+    'adaptive': lambda base: preprocessing.binarize_adaptive(preprocessing.fit_width(base, min_width=UPSCALE_WIDTH)),
+}
+
+# (tier name, preparer, tesseract config), cheapest first
+TIERS = [
+    ('fast', 'gray', '--oem 3 --psm 6'),
+    ('standard', 'standard', '--oem 3 --psm 6'),
+    ('otsu', 'otsu', '--oem 3 --psm 6'),
+    ('adaptive_psm4', 'adaptive', '--oem 3 --psm 4'),
+    ('adaptive_sparse', 'adaptive', '--oem 3 --psm 11'),
+]
+
+
+class TierStats:
+    """Per-tier attempt/accept counts and timings"""
+
+    def __init__(self, tier_names):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.total_ms = 0.0
+        self.tiers = {
+            name: {'attempts': 0, 'accepted': 0, 'final': 0, 'total_ms': 0.0}
+            for name in tier_names
+        }
+
+    def record_attempt(self, tier, elapsed_ms, accepted):
+        with self._lock:
+            stats = self.tiers[tier]
+            stats['attempts'] += 1
+            stats['total_ms'] += elapsed_ms
+            if accepted:
+                stats['accepted'] += 1
+
+    def record_result(self, tier, elapsed_ms):
+        with self._lock:
+            self.requests += 1
+            self.total_ms += elapsed_ms
+            self.tiers[tier]['final'] += 1
+
+    def snapshot(self):
+        with self._lock:
+            tiers = {}
+            for name, s in self.tiers.items():
+                tiers[name] = {
+                    'attempts': s['attempts'],
+                    'accepted': s['accepted'],
+                    'accept_rate': round(s['accepted'] / s['attempts'], 3) if s['attempts'] else 0,
+                    'final_share': round(s['final'] / self.requests, 3) if self.requests else 0,
+                    'mean_ms': round(s['total_ms'] / s['attempts'], 1) if s['attempts'] else 0
+                }
+            return {
+                'requests': self.requests,
+                'mean_ms': round(self.total_ms / self.requests, 1) if self.requests else 0,
+                'tiers': tiers
+            }
+
+
+class AdaptiveOCR:
+    """
+    Runs OCR tiers in order and stops at the first acceptable result.
+
+    A result is acceptable when the mean word confidence reaches
+    `min_confidence` and `score(text)` (the number of medicines parsed from
+    it) reaches `min_medicines`. If no tier gets there, the best attempt wins.
+    """
+
+    def __init__(self, min_confidence=70, min_medicines=1, tiers=None):
+        self.min_confidence = min_confidence
+        self.min_medicines = min_medicines
+        self.tiers = tiers or TIERS
+        self.stats = TierStats([name for name, _, _ in self.tiers])
+
+    def params(self):
+        """Settings that change the output (part of the OCR cache key)"""
+        return {
+            'min_confidence': self.min_confidence,
+            'min_medicines': self.min_medicines,
+            'tiers': [[name, prep, config] for name, prep, config in self.tiers],
+            'fast_width': FAST_WIDTH,
+            'upscale_width': UPSCALE_WIDTH
+        }
+
+    def recognize(self, source, backend, score, rx_only=False):
+        """
+        Return {'text', 'confidence', 'medicines', 'tier'} for the chosen attempt.
+        With `rx_only`, every tier sees only the part of the page that can hold
+        the medicine list (as in region OCR).
+        """
+        started = time.perf_counter()
+        base = preprocessing.load_grayscale(source)
+        if rx_only:
+            box = regions.rx_box(preprocessing.binarize(base))
+            if box is not None:
+                base = base.crop(box)
+        prepared = {}
+        best = None
+
+        for name, prep, config in self.tiers:
+            tier_started = time.perf_counter()
+            if prep not in prepared:
+                prepared[prep] = PREPARERS[prep](base)
+            text, confidence = backend.image_to_data(prepared[prep], config)
+            confidence = round(confidence, 1)
+            medicines = score(text)
+            accepted = confidence >= self.min_confidence and medicines >= self.min_medicines
+            self.stats.record_attempt(name, (time.perf_counter() - tier_started) * 1000, accepted)
+
+            attempt = {'text': text, 'confidence': confidence, 'medicines': medicines, 'tier': name}
+            if best is None or (medicines, confidence) > (best['medicines'], best['confidence']):
+                best = attempt
+            if accepted:
+                break
+
+        self.stats.record_result(best['tier'], (time.perf_counter() - started) * 1000)
+        return best
@@ -0,0 +1,142 @@
+"""
+Admission control for the OCR path: per-client token buckets and a
+concurrency gate with a bounded FIFO wait queue.
+
+Uploads that cannot be admitted are refused straight away with a
+Retry-After estimate, so they never tie up the request threads that
+serve the cheap read endpoints.
+"""
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+MAX_CLIENTS = 10_000   # Token buckets kept (least recently used clients are forgotten)
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request is refused; `retry_after` is in whole seconds"""
+
+    def __init__(self, message, reason, retry_after):
+        super().__init__(message)
+        self.reason = reason
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class TokenBuckets:
+    """
+    One token bucket per client: `rate` tokens per second, holding at most
+    `burst`. A forgotten client starts again with a full bucket, so evicting
+    idle clients never makes limits stricter.
+    """
+
+    def __init__(self, rate, burst, max_clients=MAX_CLIENTS):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self.rejected = 0
+        self._buckets = OrderedDict()   # client -> (tokens, updated)
+        self._lock = threading.Lock()
+
+    def take(self, client, cost=1):
+        """Spend `cost` tokens; raises AdmissionRejected if the client has too few"""
+        if self.rate <= 0:
+            return
+        cost = min(cost, self.burst)   # A request bigger than the burst waits for a full bucket
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(client, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens < cost:
+                self._buckets[client] = (tokens, now)
+                self.rejected += 1
+                raise AdmissionRejected(f'Rate limit of {self.rate:g} uploads/s exceeded', 'rate_limited',
+                                        (cost - tokens) / self.rate)
+            self._buckets[client] = (tokens - cost, now)
+            while len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {'clients': len(self._buckets), 'rate': self.rate, 'burst': self.burst, 'rejected': self.rejected}
+
+
+class AdmissionGate:
+    """
+    Lets at most `max_running` callers run at once. Up to `max_waiting` more
+    wait in arrival order for at most `max_wait` seconds; anyone beyond that
+    is rejected immediately. Run times feed a moving average used for the
+    Retry-After estimate.
+    """
+
+    def __init__(self, max_running, max_waiting, max_wait=30.0, typical_seconds=2.0):
+        self.max_running = max_running
+        self.max_waiting = max_waiting
+        self.max_wait = max_wait
+        self.average_seconds = typical_seconds
+        self.running = 0
+        self.admitted = 0
+        self.rejected = {'queue_full': 0, 'wait_timeout': 0}
+        self._waiting = deque()
+        self._cond = threading.Condition()
+
+    def retry_after(self, queued=None):
+        """Seconds until `queued` callers ahead (default: everyone waiting) would have been served"""
+        queued = len(self._waiting) if queued is None else queued
+        return (queued + 1) * self.average_seconds / max(self.max_running, 1)
+
+    def check(self):
+        """Reject early (before reading an upload) if admit() would be refused right now"""
+        with self._cond:
+            if self.running >= self.max_running and len(self._waiting) >= self.max_waiting:
+                self.rejected['queue_full'] += 1
+                raise AdmissionRejected('Too many uploads in progress', 'queue_full', self.retry_after())
+
+    @contextmanager
+    def admit(self):
+        """Run the block once a slot is free; yields the seconds spent waiting"""
+        started = time.monotonic()
+        with self._cond:
+            if self._waiting or self.running >= self.max_running:
+                if len(self._waiting) >= self.max_waiting:
+                    self.rejected['queue_full'] += 1
+                    raise AdmissionRejected('Too many uploads in progress', 'queue_full', self.retry_after())
+                ticket = object()
+                self._waiting.append(ticket)
+                deadline = started + self.max_wait
+                try:
+                    while self._waiting[0] is not ticket or self.running >= self.max_running:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self.rejected['wait_timeout'] += 1
+                            raise AdmissionRejected(f'No upload slot within {self.max_wait:g}s', 'wait_timeout',
+                                                    self.retry_after())
+                        self._cond.wait(remaining)
+                finally:
+                    self._waiting.remove(ticket)
+                    self._cond.notify_all()   # The next waiter may be first in line now
+            self.running += 1
+            self.admitted += 1
+
+        waited = time.monotonic() - started
+        began = time.monotonic()
+        try:
+            yield waited
+        finally:
+            with self._cond:
+                self.running -= 1
+                self.average_seconds += (time.monotonic() - began - self.average_seconds) * 0.2
+                self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                'running': self.running,
+                'waiting': len(self._waiting),
+                'max_running': self.max_running,
+                'max_waiting': self.max_waiting,
+                'admitted': self.admitted,
+                'rejected': dict(self.rejected),
+                'average_seconds': round(self.average_seconds, 3)
+            }
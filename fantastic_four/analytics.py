@@ -0,0 +1,309 @@
+"""
+Population-level adherence analytics over a columnar store of dose events.
+
+Every scheduled dose of every prescription is one row in a set of NumPy
+columns (day, hour, minute, medicine code, taken). A query is two bincounts
+per chunk of events, over (medicine, hour, missed) and (day, missed) keys;
+per-weekday and per-period rates are then summed from the per-day counts.
+Chunking keeps temporary arrays small at tens of millions of events.
+"""
+import threading
+from datetime import date, datetime
+
+try:
+    import numpy as np
+except ImportError:  # /analytics is unavailable without NumPy
+    np = None
+
+from timeline import medicine_key
+
+EPOCH = date(1970, 1, 1).toordinal()   # Days are stored as days since 1970-01-01 (a Thursday)
+CHUNK = 1 << 18                         # Events aggregated per pass (sized to stay in cache)
+INTERVALS = ('day', 'week', 'month')
+WEEKDAYS = ('Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday')
+CACHE_ENTRIES = 64
+COMPACT_MIN = 1 << 20   # Removed events tolerated before compacting
+REMOVED = -1   # Medicine code of events from a replaced schedule (dropped at the next compaction)
+COLUMNS = ('day', 'hour', 'minute', 'medicine', 'taken')
+
+
+def day_number(value):
+    return value.toordinal() - EPOCH
+
+
+def day_date(number):
+    return date.fromordinal(int(number) + EPOCH)
+
+
+def parse_slot(time):
+    """(hour, minute) of a 'HH:MM' time slot"""
+    hours, _, minutes = str(time).partition(':')
+    try:
+        return int(hours) % 24, int(minutes or 0) % 60
+    except ValueError:
+        return 9, 0
+
+
+class AdherenceStore:
+    """
+    Dose events of every prescription in growable NumPy columns, 11 bytes per
+    event, kept in step with Storage by `sync`.
+
+    A prescription's events are one contiguous block, rule by rule, day by
+    day, slot by slot: the same order as its taken bitmaps, so taken flags
+    are copied in with one unpackbits per rule. A schedule that is replaced
+    by a different one has its old block marked REMOVED and a new block
+    appended; blocks are compacted once half the store is removed.
+    """
+
+    def __init__(self):
+        if np is None:
+            raise RuntimeError('NumPy is required for adherence analytics')
+        self.size = 0
+        self.removed = 0
+        self.day = np.empty(0, dtype=np.int32)
+        self.hour = np.empty(0, dtype=np.int8)
+        self.minute = np.empty(0, dtype=np.int8)
+        self.medicine = np.empty(0, dtype=np.int32)
+        self.taken = np.empty(0, dtype=np.bool_)
+        self.medicine_names = []   # Code -> display name (first spelling seen)
+        self._medicine_codes = {}  # medicine_key -> code
+        self._blocks = {}          # Prescription id -> (signature, start, rule offsets, version)
+        self._lock = threading.Lock()
+        self._token = None
+        self._cache = {}
+        self.version = 0           # Bumped on every change, so cached results know they are stale
+
+    # Loading
+
+    def sync(self, storage):
+        """Load prescriptions that are new or changed (doses marked) since the last sync"""
+        token = storage.change_token()
+        if token == self._token:
+            return
+        versions = storage.prescription_versions()
+        with self._lock:
+            changed = [(prescription_id, version) for prescription_id, version in versions.items()
+                       if self._blocks.get(prescription_id, (None,) * 4)[3] != version]
+        for prescription_id, version in changed:
+            prescription = storage.get_prescription(prescription_id)
+            if prescription is not None:
+                self.put(prescription_id, prescription['schedule'], prescription['version'])
+        self._token = token
+
+    def put(self, prescription_id, schedule, version=None):
+        """Add or refresh one prescription's dose events from its schedule"""
+        signature = tuple((medicine_key(rule['medicine']), rule['days'], tuple(rule['times']))
+                          for rule in schedule.rules)
+        with self._lock:
+            block = self._blocks.get(prescription_id)
+            if block is None or block[0] != signature or block[1] != schedule.start:
+                if block is not None:
+                    self._remove(block[2])
+                offsets = self._append(schedule)
+            else:
+                offsets = block[2]
+            self._copy_taken(offsets, schedule)
+            self._blocks[prescription_id] = (signature, schedule.start, offsets, version)
+            self.version += 1
+            if self.removed > max(self.size // 2, COMPACT_MIN):
+                self._compact()
+
+    def _append(self, schedule):
+        """Append a block for `schedule`; returns the offsets where each rule's events start (and the block ends)"""
+        counts = [rule['days'] * len(rule['times']) for rule in schedule.rules]
+        offsets = [self.size]
+        for count in counts:
+            offsets.append(offsets[-1] + count)
+        total = offsets[-1] - self.size
+        self._reserve(self.size + total)
+        start = day_number(schedule.start)
+        for rule, first, count in zip(schedule.rules, offsets, counts):
+            if not count:
+                continue
+            slots = len(rule['times'])
+            block = slice(first, first + count)
+            self.day[block] = np.repeat(np.arange(start, start + rule['days'], dtype=np.int32), slots)
+            hours, minutes = zip(*(parse_slot(t) for t in rule['times']))
+            self.hour[block] = np.tile(np.array(hours, dtype=np.int8), rule['days'])
+            self.minute[block] = np.tile(np.array(minutes, dtype=np.int8), rule['days'])
+            self.medicine[block] = self._medicine_code(rule['medicine'])
+        self.size += total
+        return offsets
+
+    def _copy_taken(self, offsets, schedule):
+        for i, bits in enumerate(schedule.taken):
+            first, last = offsets[i], offsets[i + 1]
+            if last == first:
+                continue
+            if not bits:
+                self.taken[first:last] = False
+                continue
+            packed = np.frombuffer(bits.to_bytes((last - first + 7) // 8, 'little'), dtype=np.uint8)
+            self.taken[first:last] = np.unpackbits(packed, count=last - first, bitorder='little')
+
+    def _remove(self, offsets):
+        self.medicine[offsets[0]:offsets[-1]] = REMOVED
+        self.removed += offsets[-1] - offsets[0]
+
+    def _reserve(self, needed):
+        capacity = len(self.day)
+        if needed <= capacity:
+            return
+        capacity = max(needed, capacity * 2, 1024)
+        for name in COLUMNS:
+            column = getattr(self, name)
+            grown = np.empty(capacity, dtype=column.dtype)
+            grown[:self.size] = column[:self.size]
+            setattr(self, name, grown)
+
+    def _compact(self):
+        keep = self.medicine[:self.size] != REMOVED
+        position = np.cumsum(keep) - 1   # New index of every kept event
+        for name in COLUMNS:
+            setattr(self, name, getattr(self, name)[:self.size][keep].copy())
+        for prescription_id, (signature, start, offsets, version) in self._blocks.items():
+            first = int(position[offsets[0]]) if offsets[-1] > offsets[0] else 0
+            moved = [first + offset - offsets[0] for offset in offsets]
+            self._blocks[prescription_id] = (signature, start, moved, version)
+        self.size = len(self.day)
+        self.removed = 0
+
+    def _medicine_code(self, name):
+        key = medicine_key(name)
+        code = self._medicine_codes.get(key)
+        if code is None:
+            code = self._medicine_codes[key] = len(self.medicine_names)
+            self.medicine_names.append(name)
+        return code
+
+    def stats(self):
+        with self._lock:
+            return {
+                'events': self.size - self.removed,
+                'removed': self.removed,
+                'prescriptions': len(self._blocks),
+                'medicines': len(self.medicine_names),
+                'bytes': sum(getattr(self, name).nbytes for name in COLUMNS)
+            }
+
+    # Queries
+
+    def report(self, first=None, last=None, medicine=None, interval='week', now=None):
+        """
+        Missed-dose rates for doses due by `now` between the dates `first` and
+        `last` (inclusive): overall, by medicine, hour of day, weekday and
+        `interval` ('day', 'week' or 'month'). `medicine` limits every group
+        to one medicine name. Cached until the store changes or the minute
+        `now` falls in moves on.
+        """
+        now = now or datetime.now()
+        key = (first, last, medicine_key(medicine) if medicine else None, interval,
+               now.replace(second=0, microsecond=0))
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None and cached[0] == self.version:
+                return cached[1]
+            version = self.version
+            size = self.size
+            # Views stay valid if the columns are regrown or compacted meanwhile
+            columns = [getattr(self, name)[:size] for name in COLUMNS]
+            names = list(self.medicine_names)
+            code = self._medicine_codes.get(key[2]) if medicine else None
+
+        result = _aggregate(columns, names, first, last, code, medicine, interval, now)
+        with self._lock:
+            if len(self._cache) >= CACHE_ENTRIES:
+                self._cache.clear()
+            self._cache[key] = (version, result)
+        return result
+
+
+def _aggregate(columns, names, first, last, code, medicine, interval, now):
+    day, hour, minute, medicine_codes, taken = columns
+    today = day_number(now.date())
+    first_day = day_number(first) if first else (int(day.min()) if len(day) else today)
+    last_day = min(day_number(last), today) if last else today
+    days = max(0, last_day - first_day + 1)
+    if medicine and code is None:
+        days = 0   # Unknown medicine: nothing is due
+
+    # Bin 0 collects events outside the query; keys are shifted by one past it
+    by_slot = np.zeros(len(names) * 48 + 1, np.int64)   # (medicine, hour, missed)
+    by_day = np.zeros(days * 2 + 1, np.int64)            # (day, missed)
+    for begin in range(0, len(day) if days else 0, CHUNK):
+        end = begin + CHUNK
+        d, m, h, missed = day[begin:end], medicine_codes[begin:end], hour[begin:end], ~taken[begin:end]
+        mask = (d >= first_day) & (d <= last_day) & (m != REMOVED)
+        if last_day == today:
+            mask &= (d < today) | (h < now.hour) | ((h == now.hour) & (minute[begin:end] <= now.minute))
+        if code is not None:
+            mask &= m == code
+        if not mask.any():
+            continue
+        key = m * 48
+        key += h * 2
+        key += missed
+        key += 1
+        key *= mask
+        by_slot += np.bincount(key, minlength=len(by_slot))
+        key = d - first_day
+        key *= 2
+        key += missed
+        key += 1
+        key *= mask
+        by_day += np.bincount(key, minlength=len(by_day))
+
+    slots = by_slot[1:].reshape(len(names), 24, 2)   # [..., 0] taken, [..., 1] missed
+    daily = by_day[1:].reshape(days, 2)
+    day_numbers = np.arange(first_day, first_day + days)
+    if interval == 'month':
+        months = day_numbers.astype('datetime64[D]').astype('datetime64[M]')
+        period = (months - months[0]).astype(np.int64) if days else day_numbers
+        period_start = lambda i: (months[0] + i).astype('datetime64[D]').item()
+    elif interval == 'week':
+        weeks = (day_numbers + 3) // 7   # Weeks start on Monday
+        period = weeks - (first_day + 3) // 7
+        period_start = lambda i: day_date(((first_day + 3) // 7 + i) * 7 - 3)
+    else:
+        period = day_numbers - first_day
+        period_start = lambda i: day_date(first_day + i)
+
+    by_medicine = _rates(slots.sum(axis=1), lambda i: {'medicine': names[i]})
+    by_medicine.sort(key=lambda row: (-row['missed'], row['medicine']))
+    taken_total, missed_total = (int(n) for n in daily.sum(axis=0)) if days else (0, 0)
+    return {
+        'from': day_date(first_day).isoformat(),
+        'to': day_date(last_day).isoformat(),
+        'as_of': now.isoformat(timespec='minutes'),
+        'medicine': medicine,
+        'interval': interval,
+        'overall': _rate(taken_total + missed_total, missed_total),
+        'by_medicine': by_medicine,
+        'by_hour': _rates(slots.sum(axis=0), lambda i: {'hour': i}),
+        'by_weekday': _rates(_group(daily, (day_numbers + 3) % 7, 7), lambda i: {'weekday': WEEKDAYS[i]}),
+        'trend': _rates(_group(daily, period, int(period.max()) + 1 if days else 0),
+                        lambda i: {'start': period_start(i).isoformat()})
+    }
+
+
+def _group(daily, keys, groups):
+    """Per-day (taken, missed) counts summed into `groups` groups by `keys`"""
+    counts = np.zeros((groups, 2), np.int64)
+    np.add.at(counts, keys, daily)
+    return counts
+
+
+def _rates(counts, label):
+    """Rate rows for the groups of (taken, missed) `counts` that had doses due"""
+    return [dict(label(int(i)), **_rate(int(counts[i].sum()), int(counts[i, 1])))
+            for i in np.flatnonzero(counts.sum(axis=1))]
+
+
+def _rate(due, missed):
+    return {
+        'due': due,
+        'taken': due - missed,
+        'missed': missed,
+        'missed_rate': round(missed / due * 100, 1) if due else 0
+    }
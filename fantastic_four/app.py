@@ -1,85 +1,179 @@
-from flask import Flask, render_template, request, jsonify, session
+from flask import Flask, Response, g, render_template, request, jsonify, session, stream_with_context
 from flask_cors import CORS
+import click
 import os
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 import json
+import io
+import queue
+import atexit
 import base64
+import hashlib
+import logging
+import threading
+import time
+from werkzeug.middleware.proxy_fix import ProxyFix
 from werkzeug.utils import secure_filename
 import re
-import pytesseract
-from PIL import Image, ImageEnhance, ImageFilter
+import secrets
+import analytics
+import export
+import metrics
+import ocr_backends
+import reprocess
+import regions
+import timeline
+from adaptive_ocr import AdaptiveOCR
+from admission import AdmissionGate, AdmissionRejected, TokenBuckets
+from drug_lexicon import DrugLexicon
+from ingest import InMemoryRequest, InvalidImageError, UploadArchive, probe_image
+from http_cache import MIN_COMPRESS_BYTES, ResponseCache, compress, negotiate_encoding
+from jobs import OCRJobQueue, QueueFullError, WorkerPoolError
+from ocr_cache import OCRCache
+from prescription_parser import extract_medicines_structured, parse_prescription_text
+from reminders import DEFAULT_OFFSETS, ReminderScheduler
+from schedules import Schedule, parse_window
+from storage import PrescriptionExistsError, Storage, patient_key
+from vitals import VitalsStore, parse_timestamp
+import preprocessing
+from preprocessing import preprocess_image
 
-def preprocess_image(image_path):
-    """Enhanced image preprocessing for better OCR"""
-    img = Image.open(image_path)
-    
-    # Convert to RGB if needed
-    if img.mode != 'RGB':
-        img = img.convert('RGB')
-    
-    # Resize if too small (improves OCR accuracy)
-    width, height = img.size
-    if width < 1000:
-        ratio = 1000 / width
-        img = img.resize((int(width * ratio), int(height * ratio)), Image.LANCZOS)
-    
-    # Convert to grayscale
-    img = img.convert('L')
-    
-    # Enhance contrast
-    enhancer = ImageEnhance.Contrast(img)
-    img = enhancer.enhance(2)
+logging.basicConfig(
+    level=os.environ.get('LOG_LEVEL', 'INFO').upper(),
+    format='%(asctime)s %(levelname)s %(name)s: %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+OCR_CONFIG = r'--oem 3 --psm 6'
+# Bit-compatible preprocessing (same output as the original pipeline, still single-pass)
+PREPROCESS_COMPAT = os.environ.get('PREPROCESS_COMPAT', '0').lower() in ('1', 'true', 'yes')
+# 'single' runs one OCR pass; 'adaptive' starts cheap and escalates on low confidence
+OCR_STRATEGY = os.environ.get('OCR_STRATEGY', 'single')
+# Region OCR: 'off' (default), 'auto' (pages at least REGION_MIN_HEIGHT tall after preprocessing) or 'always'
+OCR_REGIONS = os.environ.get('OCR_REGIONS', 'off')
+REGION_MIN_HEIGHT = int(os.environ.get('OCR_REGION_MIN_HEIGHT', 2000))
+# Threads per request; job and reprocess workers are already one of many OCR processes, so they use one
+REGION_WORKERS = int(os.environ.get('OCR_REGION_WORKERS', os.cpu_count() or 1))
+adaptive_ocr = AdaptiveOCR(
+    min_confidence=float(os.environ.get('OCR_MIN_CONFIDENCE', 70)),
+    min_medicines=int(os.environ.get('OCR_MIN_MEDICINES', 1))
+)
+
+def ocr_params(rx_only=False):
+    """Parameters that change the OCR output for a given image (part of the OCR cache key)"""
+    if OCR_STRATEGY == 'adaptive':
+        return {
+            'strategy': 'adaptive',
+            'engine': ocr_backends.get_backend().engine,
+            'adaptive': adaptive_ocr.params(),
+            'regions': 'rx_only' if rx_only else 'off',
+            'max_width': preprocessing.MAX_WIDTH,
+            'target_width': preprocessing.TARGET_WIDTH,
+            'contrast': preprocessing.CONTRAST_FACTOR,
+            'threshold': preprocessing.THRESHOLD
+        }
+    return {
+        'config': OCR_CONFIG,
+        'engine': ocr_backends.get_backend().engine,
+        'regions': 'rx_only' if rx_only else OCR_REGIONS,
+        'region_min_height': REGION_MIN_HEIGHT,
+        'compat': PREPROCESS_COMPAT,
+        'target_width': preprocessing.TARGET_WIDTH,
+        'max_width': None if PREPROCESS_COMPAT else preprocessing.MAX_WIDTH,
+        'contrast': preprocessing.CONTRAST_FACTOR,
+        'threshold': preprocessing.THRESHOLD
+    }
+
+def init_ocr_worker_process():
+    """Initializer for the OCR job and reprocess pools: regions are OCR'd one at a time in each worker"""
+    global REGION_WORKERS
+    REGION_WORKERS = 1
+    ocr_backends.init_worker_process()
+
+def run_ocr(image_bytes, rx_only=False):
+    """
+    Preprocess and OCR an image with the configured strategy.
+    With `rx_only`, only page regions that can hold the medicine list are OCR'd.
+    """
+    backend = ocr_backends.get_backend()
+    if OCR_STRATEGY == 'adaptive':
+        # Tiers interleave preprocessing and OCR, so they are timed as one stage
+        with metrics.stage('ocr_adaptive'):
+            result = adaptive_ocr.recognize(
+                io.BytesIO(image_bytes), backend,
+                score=lambda text: len(extract_medicines_structured(text)),
+                rx_only=rx_only
+            )
+        return result['text']
     
-    # Apply threshold
-    img = img.point(lambda x: 0 if x < 128 else 255, '1')
+    with metrics.stage('preprocess'):
+        img = preprocess_image(io.BytesIO(image_bytes), compat=PREPROCESS_COMPAT)
     
-    return img
+    with metrics.stage('ocr'):
+        # Tall scans are split into bands/columns that are OCR'd in parallel
+        if rx_only or OCR_REGIONS == 'always' or (OCR_REGIONS == 'auto' and img.height >= REGION_MIN_HEIGHT):
+            return regions.ocr_regions(img, backend, config=OCR_CONFIG, rx_only=rx_only, max_workers=REGION_WORKERS)
+        return backend.image_to_string(img, config=OCR_CONFIG)
 
-def extract_prescription_data(image_path):
+def extract_prescription_data(image_bytes, rx_only=False, name='upload', default_date=None):
     """
-    Extract prescription data from image using advanced OCR.
+    Extract prescription data from an encoded image using advanced OCR.
+    Stage timings ride along in 'stage_timings', since this may run in a job worker process.
+    `default_date` fills in a missing date (default: today).
     """
+    if default_date is None:
+        default_date = datetime.now().strftime('%Y-%m-%d')
+    with metrics.collect() as timings:
+        prescription = _extract_prescription_data(image_bytes, rx_only, name, default_date)
+    prescription['stage_timings'] = timings
+    return prescription
+
+def _extract_prescription_data(image_bytes, rx_only, name, default_date):
     try:
-        # Preprocess image
-        img = preprocess_image(image_path)
-        
-        # Extract text with better config
-        custom_config = r'--oem 3 --psm 6'
-        text = pytesseract.image_to_string(img, config=custom_config)
-        
-        if not text.strip():
-            return create_prescription_data(error='No text could be extracted from the image')
-        
-        print("\n" + "="*80)
-        print("EXTRACTED TEXT FROM PRESCRIPTION")
-        print("="*80)
-        print(text)
-        print("="*80 + "\n")
-        
-        # Parse prescription elements
-        patient_info = extract_patient_info(text)
-        medicines = extract_medicines_structured(text)
-        
-        prescription = {
-            'medicines': medicines,
-            'doctor_name': extract_doctor_name(text),
-            'hospital': extract_hospital_name(text),
-            'date': extract_date(text) or datetime.now().strftime('%Y-%m-%d'),
-            'patient_name': patient_info.get('name', ''),
-            'patient_age': patient_info.get('age', ''),
-            'diagnosis': extract_diagnosis(text),
-            'advice': extract_advice(text),
-            'raw_text': text  # For debugging
-        }
-        
-        return prescription
-        
+        text = extract_text(image_bytes, rx_only)
+        return prescription_from_text(text, name, default_date)
     except Exception as e:
-        print(f"ERROR: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception('Processing %s failed', name)
         return create_prescription_data(error=f'Error processing image: {str(e)}')
 
+def extract_text(image_bytes, rx_only=False):
+    """OCR text of an encoded image"""
+    # Re-uploads of the same image skip preprocessing and OCR entirely
+    with metrics.stage('ocr_cache'):
+        cache_key = OCRCache.make_key(image_bytes, ocr_params(rx_only))
+        text = ocr_cache.get(cache_key)
+    
+    if text is None:
+        text = run_ocr(image_bytes, rx_only)
+        ocr_cache.put(cache_key, text)
+    return text
+
+def extract_page_text(image_bytes, rx_only=False, name='page'):
+    """Job worker for /upload_batch pages: {'text'} or {'error'}, plus 'stage_timings'"""
+    with metrics.collect() as timings:
+        try:
+            result = {'text': extract_text(image_bytes, rx_only)}
+        except Exception as e:
+            logger.exception('Processing %s failed', name)
+            result = {'error': f'Error processing image: {str(e)}'}
+    result['stage_timings'] = timings
+    return result
+
+def prescription_from_text(text, name, default_date):
+    """Parse OCR text into prescription data (with an 'error' if there is no text)"""
+    if not text.strip():
+        return create_prescription_data(error='No text could be extracted from the image')
+    
+    logger.debug('Extracted text from %s:\n%s', name, text)
+    
+    # Parse prescription elements
+    prescription = parse_prescription_text(
+        text, default_date=default_date, lexicon=drug_lexicon
+    )
+    prescription['raw_text'] = text  # For debugging
+    
+    return prescription
+
 def create_prescription_data(error=None, **kwargs):
     """Helper function to create a standardized prescription data structure"""
     data = {
@@ -97,354 +191,251 @@ def create_prescription_data(error=None, **kwargs):
     data.update(kwargs)
     return data
 
-def extract_patient_info(text):
-    """Extract patient name and age from text"""
-    name_match = re.search(r'(?i)(?:patient|name)\s*[:\-]?\s*([A-Za-z\s.]+?)(?:\n|age|$)', text)
-    age_match = re.search(r'(?i)age\s*[:\-]?\s*(\d+)', text)
-    
-    return {
-        'name': name_match.group(1).strip() if name_match else '',
-        'age': age_match.group(1) if age_match else ''
-    }
-
-def extract_medicines_structured(text):
-    """
-    NEW APPROACH: Extract medicines with complete context using block parsing.
-    This groups all lines related to each medicine together.
-    """
-    medicines = []
-    
-    # Exclusion words
-    exclude_words = {
-        'dr', 'doctor', 'patient', 'name', 'age', 'date', 'prescription', 
-        'diagnosis', 'advice', 'signature', 'hospital', 'clinic', 'medical',
-        'tel', 'phone', 'address', 'email', 'reg', 'registration', 'no', 'number',
-        'mbbs', 'md', 'ms', 'dnb', 'mrcp', 'frcs', 'speciality', 'consultant',
-        'follow', 'next', 'visit', 'review', 'tests', 'investigations', 'rxs',
-        'dear', 'sir', 'madam', 'regards', 'sincerely', 'yours', 'faithfully'
-    }
-    
-    lines = text.split('\n')
-    i = 0
-    
-    while i < len(lines):
-        line = lines[i].strip()
-        
-        # Look for numbered medicine items (1. Medicine, 2. Medicine)
-        match = re.match(r'^(\d+)[\.\)]\s*(.+)$', line)
-        
-        if match:
-            med_number = match.group(1)
-            rest_of_first_line = match.group(2).strip()
-            
-            # Extract medicine name from first part
-            med_name_match = re.match(r'^([A-Z][a-zA-Z]+(?:\s+[A-Z]?[a-z]+)?)', rest_of_first_line)
-            
-            if med_name_match:
-                med_name = med_name_match.group(1).strip()
-                
-                # Check if it's a valid medicine name
-                if len(med_name) >= 3 and med_name.lower() not in exclude_words:
-                    print(f"\n{'='*60}")
-                    print(f"Found medicine #{med_number}: {med_name}")
-                    
-                    # Collect all related lines (until next number or empty lines)
-                    medicine_block = [rest_of_first_line]
-                    j = i + 1
-                    
-                    # Gather next 6-8 lines or until we hit another numbered item
-                    while j < len(lines) and j < i + 8:
-                        next_line = lines[j].strip()
-                        
-                        # Stop if we hit another numbered item
-                        if re.match(r'^\d+[\.\)]', next_line):
-                            break
-                        
-                        # Stop if we hit doctor's signature or empty section
-                        if not next_line or 'signature' in next_line.lower():
-                            break
-                            
-                        medicine_block.append(next_line)
-                        j += 1
-                    
-                    # Combine all lines into one text block for this medicine
-                    full_medicine_text = ' '.join(medicine_block)
-                    print(f"Full medicine block: {full_medicine_text}")
-                    
-                    # Extract details from the complete block
-                    dosage = extract_dosage_from_text(full_medicine_text)
-                    frequency = extract_frequency_from_text(full_medicine_text)
-                    duration = extract_duration_from_block(full_medicine_text)
-                    instructions = extract_instructions_from_text(full_medicine_text)
-                    
-                    print(f"Dosage: {dosage}")
-                    print(f"Frequency: {frequency}")
-                    print(f"Duration: {duration}")
-                    print(f"Instructions: {instructions}")
-                    print(f"{'='*60}\n")
-                    
-                    medicines.append({
-                        'name': med_name,
-                        'dosage': dosage,
-                        'frequency': frequency,
-                        'timing': parse_timing_from_frequency(frequency),
-                        'duration': duration,
-                        'instructions': instructions
-                    })
-        
-        i += 1
-    
-    # Remove duplicates
-    seen = set()
-    unique_medicines = []
-    for med in medicines:
-        key = med['name'].lower()
-        if key not in seen:
-            seen.add(key)
-            unique_medicines.append(med)
-    
-    print(f"\nTotal medicines extracted: {len(unique_medicines)}\n")
-    return unique_medicines
-
-def extract_duration_from_block(text):
-    """
-    Extract duration from a complete medicine block.
-    Tries multiple patterns to catch all variations.
-    """
-    print(f"  [Duration Search] Searching in: {text}")
-    
-    # Remove extra spaces and normalize
-    text = ' '.join(text.split())
-    
-    # Pattern 1: "For 3 days" or "For 3 Oays" (OCR sometimes misreads)
-    patterns = [
-        r'[Ff]or\s+(\d+)\s*([Dd]ays?|[Oo]ays?|weeks?|months?)',  # For 3 days, For 3 Oays
-        r'(\d+)\s*([Dd]ays?|[Oo]ays?|weeks?|months?)',  # 3 days, 3 Oays
-        r'[Dd]uration\s*:?\s*(\d+)\s*([Dd]ays?|weeks?|months?)',  # Duration: 3 days
-    ]
-    
-    for pattern in patterns:
-        match = re.search(pattern, text, re.IGNORECASE)
-        if match:
-            number = match.group(1)
-            unit = match.group(2).lower()
-            
-            # Normalize "oays" to "days" (common OCR mistake)
-            if 'oay' in unit:
-                unit = 'days'
-            
-            result = f"{number} {unit}"
-            print(f"  [Duration Found] {result}")
-            return result
-    
-    print(f"  [Duration Not Found] Using default: 7 days")
-    return '7 days'
-
-def extract_dosage_from_text(text):
-    """Extract dosage information"""
-    dosage_match = re.search(r'(\d+\.?\d*\s*(?:mg|ml|g|mcg|tab|tablets?|cap|capsules?))', text, re.IGNORECASE)
-    return dosage_match.group(1) if dosage_match else 'As directed'
-
-def extract_frequency_from_text(text):
-    """Extract frequency (e.g., 1-0-1, twice daily, once at night)"""
-    # Pattern for "once at night", "once in morning", etc
-    specific_time_pattern = re.search(r'([Oo]nce)\s+(?:at|in|before|after)?\s*(night|evening|morning|afternoon|bedtime)', text, re.IGNORECASE)
-    if specific_time_pattern:
-        time_of_day = specific_time_pattern.group(2).lower()
-        return f"Once at {time_of_day}"
-    
-    # Pattern for "twice daily", "once daily", etc
-    freq_pattern = re.search(r'((?:[Oo]nce|[Tt]wice|[Tt]hrice|\d+\s*times?)\s*(?:daily|per day|a day))', text, re.IGNORECASE)
-    if freq_pattern:
-        return freq_pattern.group(1)
-    
-    # Pattern for 1-0-1 style
-    freq_pattern1 = re.search(r'(\d+\s*-\s*\d+\s*-\s*\d+)', text)
-    if freq_pattern1:
-        return freq_pattern1.group(1)
-    
-    # Pattern for "BD", "TDS", "QID", "OD"
-    freq_pattern3 = re.search(r'\b(OD|BD|TDS|QID)\b', text, re.IGNORECASE)
-    if freq_pattern3:
-        return freq_pattern3.group(1).upper()
-    
-    return 'As directed'
-
-def extract_instructions_from_text(text):
-    """Extract special instructions"""
-    instructions = []
-    
-    if re.search(r'[Bb]efore\s+(?:food|meal|breakfast|lunch|dinner)', text, re.IGNORECASE):
-        instructions.append('Before food')
-    elif re.search(r'[Aa]fter\s+(?:food|meal|breakfast|lunch|dinner)', text, re.IGNORECASE):
-        instructions.append('After food')
-    
-    if re.search(r'empty\s+stomach', text, re.IGNORECASE):
-        instructions.append('On empty stomach')
-    
-    return ', '.join(instructions) if instructions else 'Take as prescribed'
-
-def parse_timing_from_frequency(frequency):
-    """Convert frequency to timing array"""
-    freq_lower = frequency.lower()
-    
-    # Check for specific time mentions
-    if 'night' in freq_lower or 'evening' in freq_lower or 'bedtime' in freq_lower:
-        return ['21:00']
-    elif 'morning' in freq_lower:
-        return ['09:00']
-    elif 'afternoon' in freq_lower:
-        return ['14:00']
-    # Once daily or OD (default to morning)
-    elif 'once' in freq_lower or freq_lower == 'od':
-        return ['09:00']
-    # Twice daily or BD
-    elif 'twice' in freq_lower or freq_lower == 'bd' or '1-0-1' in freq_lower:
-        return ['09:00', '21:00']
-    # Three times or TDS
-    elif 'thrice' in freq_lower or 'three times' in freq_lower or freq_lower == 'tds' or '1-1-1' in freq_lower:
-        return ['09:00', '14:00', '21:00']
-    # Four times or QID
-    elif 'four times' in freq_lower or freq_lower == 'qid' or '1-1-1-1' in freq_lower:
-        return ['08:00', '13:00', '18:00', '22:00']
-    else:
-        return ['09:00']  # Default to once daily in morning
-
-def extract_doctor_name(text):
-    """Extract doctor's name"""
-    match = re.search(r'(?i)dr\.?\s+([A-Z][a-z]+(?:\s+[A-Z][a-z]+){1,2})', text)
-    return match.group(0) if match else ''
-
-def extract_hospital_name(text):
-    """Extract hospital/clinic name"""
-    patterns = [
-        r'(?i)([A-Z][a-zA-Z\s]+(?:hospital|clinic|medical center|healthcare))',
-        r'(?i)(?:hospital|clinic|medical center|healthcare)[:\s]+([A-Z][a-zA-Z\s]+)'
-    ]
-    
-    for pattern in patterns:
-        match = re.search(pattern, text)
-        if match:
-            return match.group(1).strip()
-    return ''
-
-def extract_date(text):
-    """Extract date from text"""
-    patterns = [
-        r'\d{1,2}[/-]\d{1,2}[/-]\d{2,4}',
-        r'\d{1,2}\s+(?:Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)[a-z]*\s+\d{4}'
-    ]
-    
-    for pattern in patterns:
-        match = re.search(pattern, text, re.IGNORECASE)
-        if match:
-            return match.group(0)
-    return None
-
-def extract_diagnosis(text):
-    """Extract diagnosis information"""
-    diagnosis_match = re.search(r'(?i)(?:diagnosis|dx|diagnosed with)[:\s]+([^\n.]+)', text)
-    return diagnosis_match.group(1).strip() if diagnosis_match else ''
-
-def extract_advice(text):
-    """Extract doctor's advice"""
-    advice_matches = re.findall(r'(?i)(?:advice|recommendation)[:\s]+([^\n.]+)', text)
-    return [advice.strip() for advice in advice_matches if advice.strip()]
-
 app = Flask(__name__)
+app.request_class = InMemoryRequest
 app.secret_key = 'your-secret-key-change-in-production'
 CORS(app)
 
 # Configure upload folder
 UPLOAD_FOLDER = 'uploads'
+REPROCESS_FOLDER = os.path.join('data', 'reprocess')
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+# Bodies over this are refused with 413 before (or while) they are read
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('MAX_UPLOAD_BYTES', 16 * 1024 * 1024))
+# /upload_batch takes several images per request
+app.config['MAX_BATCH_BYTES'] = int(os.environ.get('MAX_BATCH_BYTES', 128 * 1024 * 1024))
+app.config['MAX_IMAGE_PIXELS'] = int(os.environ.get('MAX_IMAGE_PIXELS', 50_000_000))
+# 'original', 'downscaled' (JPEG no wider than UPLOAD_ARCHIVE_WIDTH) or 'off'
+app.config['UPLOAD_ARCHIVE'] = os.environ.get('UPLOAD_ARCHIVE', 'original')
+app.config['UPLOAD_ARCHIVE_WIDTH'] = int(os.environ.get('UPLOAD_ARCHIVE_WIDTH', 1600))
+app.config['OCR_JOB_WORKERS'] = int(os.environ.get('OCR_JOB_WORKERS', os.cpu_count() or 1))
+app.config['OCR_JOB_QUEUE_SIZE'] = int(os.environ.get('OCR_JOB_QUEUE_SIZE', 32))
+# Every page of a batch is queued at once, so a batch can't have more files than the job queue holds
+app.config['MAX_BATCH_FILES'] = min(int(os.environ.get('MAX_BATCH_FILES', app.config['OCR_JOB_QUEUE_SIZE'])),
+                                    app.config['OCR_JOB_QUEUE_SIZE'])
+# A batch stops waiting (and reports the missing pages as failed) when no page finishes for this long
+app.config['BATCH_PAGE_TIMEOUT'] = float(os.environ.get('BATCH_PAGE_TIMEOUT_SECONDS', 300))
+app.config['OCR_BACKEND'] = os.environ.get('OCR_BACKEND', 'auto')
+app.config['OCR_ENGINE_WORKERS'] = int(os.environ.get('OCR_ENGINE_WORKERS', os.cpu_count() or 1))
+app.config['OCR_LANG'] = os.environ.get('OCR_LANG', 'eng')
+# OCR processes run this many steps below normal CPU priority, so reads stay fast under upload load
+app.config['OCR_NICE'] = int(os.environ.get('OCR_NICE', 10))
+# Synchronous uploads OCR'd at once; more wait (up to OCR_MAX_WAITING of them), the rest get 429
+app.config['OCR_MAX_CONCURRENT'] = int(os.environ.get('OCR_MAX_CONCURRENT', max(1, app.config['OCR_ENGINE_WORKERS'])))
+app.config['OCR_MAX_WAITING'] = int(os.environ.get('OCR_MAX_WAITING', 8))
+app.config['OCR_MAX_WAIT_SECONDS'] = float(os.environ.get('OCR_MAX_WAIT_SECONDS', 30))
+# Per-client token bucket for /upload and /upload_batch (one token per image; 0, the default, disables).
+# Clients are told apart by address, so behind a reverse proxy set TRUSTED_PROXIES as well.
+app.config['UPLOAD_RATE'] = float(os.environ.get('UPLOAD_RATE', 0))
+app.config['UPLOAD_BURST'] = int(os.environ.get('UPLOAD_BURST', 10))
+# Number of reverse proxies in front of the app whose X-Forwarded-For entries are trusted (0 trusts none)
+app.config['TRUSTED_PROXIES'] = int(os.environ.get('TRUSTED_PROXIES', 0))
+# Adds a Server-Timing header with per-stage durations to every response
+app.config['SERVER_TIMING'] = os.environ.get('SERVER_TIMING', '0').lower() in ('1', 'true', 'yes')
+
+if app.config['TRUSTED_PROXIES']:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['TRUSTED_PROXIES'])
+
+ocr_backends.configure(app.config['OCR_BACKEND'], app.config['OCR_ENGINE_WORKERS'], app.config['OCR_LANG'],
+                       app.config['OCR_NICE'])
 
 # Create necessary directories
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs('data', exist_ok=True)
 
-# In-memory database
-prescriptions_db = {}
-medication_logs = {}
-patients_db = {}
+# Copies of uploads, written off the request path
+upload_archive = UploadArchive(
+    UPLOAD_FOLDER, mode=app.config['UPLOAD_ARCHIVE'], max_width=app.config['UPLOAD_ARCHIVE_WIDTH']
+)
+atexit.register(upload_archive.join)
+
+# Raw OCR text cache (memory LRU + files under data/ocr_cache)
+ocr_cache = OCRCache(
+    os.path.join('data', 'ocr_cache'),
+    max_memory_bytes=int(os.environ.get('OCR_CACHE_MEMORY_BYTES', 16 * 1024 * 1024)),
+    max_disk_bytes=int(os.environ.get('OCR_CACHE_DISK_BYTES', 256 * 1024 * 1024))
+)
+
+# Drug-name lexicon for snapping OCR'd medicine names (index pickled under data/lexicon)
+app.config['DRUG_LEXICON_PATH'] = os.environ.get('DRUG_LEXICON_PATH', os.path.join('lexicon', 'drugs.txt'))
+
+def load_drug_lexicon(path):
+    if not path or not os.path.exists(path):
+        logger.warning("Drug lexicon '%s' not found, medicine names will not be corrected", path)
+        return None
+    return DrugLexicon.load(path, cache_dir=os.path.join('data', 'lexicon'))
+
+drug_lexicon = load_drug_lexicon(app.config['DRUG_LEXICON_PATH'])
+
+# Prescriptions, medication logs and patients (SQLite in WAL mode, shared by all workers)
+app.config['DATABASE_PATH'] = os.environ.get('DATABASE_PATH', os.path.join('data', 'prescriptions.db'))
+app.config['MARK_BATCH_MS'] = float(os.environ.get('MARK_BATCH_MS', 2))
+storage = Storage(app.config['DATABASE_PATH'], batch_window=app.config['MARK_BATCH_MS'] / 1000,
+                  cache_entries=int(os.environ.get('PRESCRIPTION_CACHE_ENTRIES', 1024)))
+PRESCRIPTIONS_PAGE_SIZE = 50
+PRESCRIPTION_ID_ATTEMPTS = 5   # Random id suffixes tried before giving up on a save
+MAX_PRESCRIPTIONS_PAGE_SIZE = 500
+
+# Serialized /schedule and /family_dashboard bodies, per prescription version
+response_cache = ResponseCache(max_bytes=int(os.environ.get('RESPONSE_CACHE_BYTES', 32 * 1024 * 1024)))
+
+# Upcoming doses of every prescription with an open /reminders stream
+reminder_scheduler = ReminderScheduler(storage.get_prescription)
+SSE_KEEPALIVE_SECONDS = 15
+
+# Cross-patient adherence analytics (NumPy dose-event columns, synced from storage per worker)
+adherence_store = analytics.AdherenceStore() if analytics.np is not None else None
+
+# Per-patient vitals rings and rollups (in this worker's memory)
+vitals_store = VitalsStore(
+    raw_capacity=int(os.environ.get('VITALS_RAW_CAPACITY', 4096)),
+    minute_capacity=int(os.environ.get('VITALS_MINUTE_CAPACITY', 7 * 24 * 60)),
+    hour_capacity=int(os.environ.get('VITALS_HOUR_CAPACITY', 365 * 24))
+)
+VITALS_MAX_ERRORS = 20   # Rejected lines reported back per /vitals batch
+
+# Background OCR jobs for /upload?async=1
+ocr_jobs = OCRJobQueue(
+    max_workers=app.config['OCR_JOB_WORKERS'],
+    max_pending=app.config['OCR_JOB_QUEUE_SIZE'],
+    initializer=init_ocr_worker_process
+)
+
+# Admission control for uploads: a concurrency gate in front of synchronous OCR and
+# per-client rate limits. Read endpoints never pass through either.
+ocr_gate = AdmissionGate(
+    max_running=app.config['OCR_MAX_CONCURRENT'],
+    max_waiting=app.config['OCR_MAX_WAITING'],
+    max_wait=app.config['OCR_MAX_WAIT_SECONDS']
+)
+upload_limits = TokenBuckets(app.config['UPLOAD_RATE'], app.config['UPLOAD_BURST'])
+
+# Prometheus metrics for /metrics (per worker process)
+REQUESTS_TOTAL = metrics.REGISTRY.counter(
+    'rx_requests_total', 'HTTP requests handled', ['method', 'endpoint', 'status']
+)
+metrics.REGISTRY.gauge('rx_ocr_jobs_pending', 'OCR jobs queued or running',
+                       lambda: ocr_jobs.stats()['pending'])
+metrics.REGISTRY.gauge('rx_ocr_cache_hit_ratio', 'OCR cache hit rate since start',
+                       lambda: ocr_cache.stats()['hit_rate'])
+metrics.REGISTRY.gauge('rx_response_cache_bytes', 'Bytes held by the response cache',
+                       lambda: response_cache.stats()['bytes'])
+metrics.REGISTRY.gauge('rx_upload_archive_pending', 'Upload copies waiting to be written',
+                       lambda: upload_archive.stats()['pending'])
+metrics.REGISTRY.gauge('rx_reminder_subscribers', 'Open reminder streams',
+                       lambda: reminder_scheduler.stats()['subscribers'])
+metrics.REGISTRY.gauge('rx_vitals_readings', 'Vitals readings ingested by this worker',
+                       lambda: vitals_store.stats()['readings'])
+ADMISSION_REJECTED = metrics.REGISTRY.counter(
+    'rx_admission_rejected_total', 'Uploads refused with 429', ['reason']
+)
+metrics.REGISTRY.gauge('rx_admission_running', 'Synchronous uploads being OCR\'d',
+                       lambda: ocr_gate.stats()['running'])
+metrics.REGISTRY.gauge('rx_admission_waiting', 'Synchronous uploads waiting for an OCR slot',
+                       lambda: ocr_gate.stats()['waiting'])
+
+@app.before_request
+def start_stage_timings():
+    g.started = time.perf_counter()
+    g.stage_timings, g.stage_token = metrics.start()
+
+@app.after_request
+def record_request_metrics(response):
+    if 'stage_token' not in g:
+        return response
+    metrics.stop(g.stage_token)
+    for name, seconds in g.stage_timings:
+        metrics.STAGE_SECONDS.observe(seconds, stage=name)
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    labels = {'method': request.method, 'endpoint': endpoint, 'status': response.status_code}
+    metrics.REQUEST_SECONDS.observe(time.perf_counter() - g.started, **labels)
+    REQUESTS_TOTAL.inc(**labels)
+    if app.config['SERVER_TIMING']:
+        timings = g.stage_timings + [('total', time.perf_counter() - g.started)]
+        response.headers['Server-Timing'] = metrics.server_timing(timings)
+    return response
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def parse_duration_to_days(duration_str):
-    """Convert duration string to days"""
-    duration_str = duration_str.lower().strip()
-    match = re.search(r'(\d+)\s*(day|week|month|year)', duration_str)
-    if not match:
-        return 7  # Default to 7 days
-    number = int(match.group(1))
-    unit = match.group(2)
-    if 'day' in unit:
-        return number
-    elif 'week' in unit:
-        return number * 7
-    elif 'month' in unit:
-        return number * 30
-    elif 'year' in unit:
-        return number * 365
-    return 7
+def take_upload_tokens(count=1):
+    """Charge the client's rate limit; raises AdmissionRejected when it is used up"""
+    upload_limits.take(request.remote_addr or 'unknown', count)
+
+def jobs_full(message):
+    """A full job queue is refused like a full OCR gate, retrying once the queued jobs should be done"""
+    stats = ocr_jobs.stats()
+    return AdmissionRejected(message, 'jobs_full', stats['pending'] / max(stats['workers'], 1) * ocr_gate.average_seconds)
 
 def generate_schedule(medicines, start_date=None):
-    """Generate medication schedule based on prescription duration"""
-    if start_date is None:
-        start_date = datetime.now()
-    
+    """Build the compact schedule for a prescription (doses are expanded per request)"""
     if not medicines:
-        return [], 0
-    
-    max_duration_days = max((parse_duration_to_days(m['duration']) for m in medicines), default=7)
-    schedule = []
-    
-    print(f"\n[SCHEDULE GENERATION]")
-    print(f"Medicines to schedule: {len(medicines)}")
-    for med in medicines:
-        days = parse_duration_to_days(med['duration'])
-        print(f"  - {med['name']}: {med['duration']} = {days} days")
-    print(f"Max duration: {max_duration_days} days\n")
-    
-    for day in range(max_duration_days):
-        current_date = start_date + timedelta(days=day)
-        date_str = current_date.strftime('%Y-%m-%d')
-        day_schedule = {
-            'date': date_str,
-            'day': current_date.strftime('%A'),
-            'medications': []
-        }
-        
-        for med in medicines:
-            med_duration_days = parse_duration_to_days(med['duration'])
-            if day < med_duration_days:
-                for time in med.get('timing', ['09:00']):
-                    day_schedule['medications'].append({
-                        'medicine': med['name'],
-                        'dosage': med['dosage'],
-                        'time': time,
-                        'frequency': med.get('frequency', 'As directed'),
-                        'instructions': med.get('instructions', 'As prescribed'),
-                        'duration': med['duration'],
-                        'remaining_days': med_duration_days - day,
-                        'taken': False,
-                        'id': f"{date_str}_{time}_{med['name']}"
-                    })
-        
-        if day_schedule['medications']:
-            day_schedule['medications'].sort(key=lambda x: x['time'])
-            schedule.append(day_schedule)
+        return Schedule.from_medicines([], start_date), 0
+    
+    schedule = Schedule.from_medicines(medicines, start_date)
     
-    return schedule, max_duration_days
+    if logger.isEnabledFor(logging.DEBUG):
+        for rule in schedule.rules:
+            logger.debug('Scheduled %s: %s = %d days', rule['medicine'], rule['duration'], rule['days'])
+        logger.debug('%d medicines, max duration %d days', len(medicines), schedule.duration_days)
+    
+    return schedule, schedule.duration_days
 
 @app.route('/')
 def index():
     return render_template('index.html')
 
+def save_prescription(prescription_data, form, filepath, timestamp):
+    """Attach form data, generate the schedule and store the prescription"""
+    # Add form data (override OCR extracted patient name with user input)
+    prescription_data['patient_name'] = form.get('patient_name', prescription_data.get('patient_name', 'Unknown Patient'))
+    prescription_data['phone_number'] = form.get('phone_number', '')
+    prescription_data['family_contact'] = form.get('family_contact', '')
+    prescription_data['image_path'] = filepath
+    prescription_data['patient_id'] = form.get('patient_id') or patient_key(prescription_data)
+    
+    # Generate schedule
+    with metrics.stage('schedule'):
+        schedule, duration_days = generate_schedule(prescription_data['medicines'])
+    
+    # Store in database under a new id (uploads in the same second get different suffixes)
+    record = {
+        'data': prescription_data,
+        'schedule': schedule,
+        'duration_days': duration_days,
+        'created_at': datetime.now().isoformat()
+    }
+    with metrics.stage('store'):
+        for attempt in range(PRESCRIPTION_ID_ATTEMPTS):
+            prescription_id = f"RX{timestamp}_{secrets.token_hex(4)}"
+            try:
+                storage.insert_prescription(prescription_id, record)
+                break
+            except PrescriptionExistsError:
+                if attempt == PRESCRIPTION_ID_ATTEMPTS - 1:
+                    raise
+        if prescription_data['patient_id']:
+            storage.save_patient(prescription_data['patient_id'], {
+                'name': prescription_data['patient_name'],
+                'phone_number': prescription_data['phone_number'],
+                'family_contact': prescription_data['family_contact']
+            })
+    
+    days, next_from = schedule.expand()
+    return {
+        'success': True,
+        'prescription_id': prescription_id,
+        'data': prescription_data,
+        'schedule': days,
+        'next_from': next_from,
+        'duration_days': duration_days
+    }
+
 @app.route('/upload', methods=['POST'])
 def upload_prescription():
+    # Before request.files, so uploads over the limit are refused without parsing the body
+    take_upload_tokens()
     if 'prescription' not in request.files:
         return jsonify({'error': 'No file uploaded'}), 400
     
@@ -456,112 +447,548 @@ def upload_prescription():
         filename = secure_filename(file.filename)
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         filename = f"{timestamp}_{filename}"
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
         
-        # Process the prescription
-        prescription_data = extract_prescription_data(filepath)
+        # The body is already in memory (InMemoryRequest); only the header is parsed here
+        with metrics.stage('validate_upload'):
+            image_bytes = file.read()
+            try:
+                probe_image(image_bytes, max_pixels=app.config['MAX_IMAGE_PIXELS'])
+            except InvalidImageError as e:
+                return jsonify({'error': str(e)}), e.status
         
-        if 'error' in prescription_data:
-            return jsonify(prescription_data), 400
+        # ?regions=rx skips OCR of letterhead/signature regions (medicines only)
+        rx_only = request.values.get('regions', '') == 'rx'
+        background = request.values.get('async', '').lower() in ('1', 'true', 'yes')
+        if not background:
+            ocr_gate.check()   # Don't archive an upload that would be refused anyway
+        filepath = upload_archive.archive(filename, image_bytes)
         
-        # Add form data (override OCR extracted patient name with user input)
-        prescription_data['patient_name'] = request.form.get('patient_name', prescription_data.get('patient_name', 'Unknown Patient'))
-        prescription_data['phone_number'] = request.form.get('phone_number', '')
-        prescription_data['family_contact'] = request.form.get('family_contact', '')
-        prescription_data['image_path'] = filepath
+        # Job mode: OCR runs in the worker pool, the client polls /jobs/<id>
+        if background:
+            form = request.form.to_dict()
+            
+            def on_done(prescription_data):
+                metrics.record(prescription_data.pop('stage_timings', []))
+                if 'error' in prescription_data:
+                    return prescription_data
+                return save_prescription(prescription_data, form, filepath, timestamp)
+            
+            try:
+                job_id = ocr_jobs.submit(extract_prescription_data, image_bytes, rx_only, filename, on_done=on_done)
+            except QueueFullError as e:
+                raise jobs_full(str(e))
+            except WorkerPoolError as e:
+                return jsonify({'error': str(e)}), 503
+            
+            return jsonify({
+                'success': True,
+                'job_id': job_id,
+                'status': 'queued',
+                'status_url': f"/jobs/{job_id}"
+            }), 202
         
-        # Generate schedule
-        schedule, duration_days = generate_schedule(prescription_data['medicines'])
+        # Process the prescription once an OCR slot is free
+        with ocr_gate.admit() as waited:
+            metrics.record([('admission_wait', waited)])
+            prescription_data = extract_prescription_data(image_bytes, rx_only, filename)
+        metrics.record(prescription_data.pop('stage_timings'))
         
-        # Store in database
-        prescription_id = f"RX{timestamp}"
-        prescriptions_db[prescription_id] = {
-            'data': prescription_data,
-            'schedule': schedule,
-            'duration_days': duration_days,
-            'created_at': datetime.now().isoformat()
-        }
+        if 'error' in prescription_data:
+            return jsonify(prescription_data), 400
         
-        return jsonify({
-            'success': True,
-            'prescription_id': prescription_id,
-            'data': prescription_data,
-            'schedule': schedule,
-            'duration_days': duration_days
-        })
+        return jsonify(save_prescription(prescription_data, request.form, filepath, timestamp))
     
     return jsonify({'error': 'Invalid file type'}), 400
 
+@app.route('/upload_batch', methods=['POST'])
+def upload_batch():
+    """
+    Upload several images as `files`. With `mode=pages` they are the pages of one
+    prescription, with `mode=separate` (default) one prescription each; a `group`
+    value per file (same value, same prescription) mixes both. Pages are OCR'd in
+    parallel in the job worker pool, and one NDJSON line per prescription is
+    streamed as soon as all its pages are done, followed by a summary line.
+    """
+    request.max_content_length = app.config['MAX_BATCH_BYTES']
+    files = [f for f in request.files.getlist('files') if f.filename]
+    if not files:
+        return jsonify({'error': 'No files uploaded'}), 400
+    if len(files) > app.config['MAX_BATCH_FILES']:
+        return jsonify({'error': f"At most {app.config['MAX_BATCH_FILES']} files per batch"}), 400
+    # One charge for the whole batch, so batches larger than the burst wait for a full bucket
+    take_upload_tokens(len(files))
+    
+    mode = request.values.get('mode', 'separate')
+    if mode not in ('pages', 'separate'):
+        return jsonify({'error': "mode must be 'pages' or 'separate'"}), 400
+    groups = request.form.getlist('group')
+    if groups and len(groups) != len(files):
+        return jsonify({'error': 'Expected one group value per file'}), 400
+    if not groups:
+        groups = ['1'] * len(files) if mode == 'pages' else [str(i) for i in range(len(files))]
+    
+    # Every file is checked before any OCR starts, so a bad file rejects the whole batch
+    pages = []
+    # Microseconds keep ids of batches started in the same second apart
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
+    for number, file in enumerate(files, 1):
+        if not allowed_file(file.filename):
+            return jsonify({'error': f'{file.filename}: Invalid file type'}), 400
+        image_bytes = file.read()
+        try:
+            probe_image(image_bytes, max_pixels=app.config['MAX_IMAGE_PIXELS'])
+        except InvalidImageError as e:
+            return jsonify({'error': f'{file.filename}: {e}'}), e.status
+        pages.append({'file': file.filename, 'bytes': image_bytes,
+                      'filename': f"{timestamp}_{number}_{secure_filename(file.filename)}"})
+    
+    stats = ocr_jobs.stats()
+    if stats['max_pending'] - stats['pending'] < len(pages):
+        raise jobs_full(f"OCR queue is full ({stats['pending']} jobs pending)")
+    
+    # Prescriptions in order of their first file; pages in file order
+    prescriptions = {}
+    for index, group in enumerate(groups):
+        prescriptions.setdefault(group, []).append(index)
+    prescriptions = list(prescriptions.values())
+    
+    rx_only = request.values.get('regions', '') == 'rx'
+    finished = queue.Queue()
+    for index, page in enumerate(pages):
+        image_bytes = page.pop('bytes')
+        page['path'] = upload_archive.archive(page['filename'], image_bytes)
+        
+        def on_done(result, index=index):
+            finished.put((index, result))
+            # The job record stays small; the text only goes to the stream
+            summary = {'page': pages[index]['file']}
+            if 'error' in result:
+                summary['error'] = result['error']
+            return summary
+        
+        try:
+            ocr_jobs.submit(extract_page_text, image_bytes, rx_only, page['filename'], on_done=on_done)
+        except (QueueFullError, WorkerPoolError) as e:
+            finished.put((index, {'error': str(e)}))
+    
+    form = request.form.to_dict()
+    
+    def results():
+        texts, failed = {}, 0
+        remaining = [len(indexes) for indexes in prescriptions]
+        owner = {index: number for number, indexes in enumerate(prescriptions) for index in indexes}
+        while len(texts) < len(pages):
+            try:
+                index, result = finished.get(timeout=app.config['BATCH_PAGE_TIMEOUT'])
+            except queue.Empty:
+                # A page whose job never reports back must not hang the stream: give up on the rest
+                for i in range(len(pages)):
+                    if i not in texts:
+                        finished.put((i, {'error': f"No OCR result within {app.config['BATCH_PAGE_TIMEOUT']:g}s"}))
+                continue
+            if index in texts:
+                continue   # Finished after it was given up on
+            metrics.record(result.pop('stage_timings', []))
+            texts[index] = result
+            number = owner[index]
+            remaining[number] -= 1
+            if remaining[number]:
+                continue
+            
+            indexes = prescriptions[number]
+            line = {'index': number, 'files': [pages[i]['file'] for i in indexes]}
+            errors = [f"{pages[i]['file']}: {texts[i]['error']}" for i in indexes if 'error' in texts[i]]
+            if errors:
+                prescription_data = create_prescription_data(error='; '.join(errors))
+            else:
+                # One text for all pages, so medicines listed on several pages are merged by name
+                text = '\n\n'.join(texts[i]['text'] for i in indexes)
+                prescription_data = prescription_from_text(
+                    text, line['files'][0], datetime.now().strftime('%Y-%m-%d')
+                )
+            if 'error' in prescription_data:
+                failed += 1
+                line['error'] = prescription_data['error']
+            else:
+                prescription_data['image_paths'] = [pages[i]['path'] for i in indexes]
+                line.update(save_prescription(
+                    prescription_data, form, pages[indexes[0]]['path'], f"{timestamp}_{number + 1}"
+                ))
+            yield json.dumps(line) + '\n'
+        yield json.dumps({'done': True, 'prescriptions': len(prescriptions), 'failed': failed}) + '\n'
+    
+    return Response(stream_with_context(results()), mimetype='application/x-ndjson')
+
+@app.errorhandler(413)
+def upload_too_large(e):
+    return jsonify({'error': f"Upload exceeds {request.max_content_length} bytes"}), 413
+
+@app.errorhandler(AdmissionRejected)
+def upload_rejected(e):
+    ADMISSION_REJECTED.inc(reason=e.reason)
+    response = jsonify({'error': str(e), 'reason': e.reason, 'retry_after': e.retry_after})
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response, 429
+
+@app.route('/admission/stats')
+def admission_stats():
+    """Get OCR slot usage, wait queue depth and rejection counts"""
+    return jsonify({
+        'ocr': ocr_gate.stats(),
+        'rate_limits': upload_limits.stats(),
+        'jobs': ocr_jobs.stats()
+    })
+
+def export_items(fmt, patient_id=None, patient=None, created_from=None, created_to=None):
+    """Prescriptions (ndjson) or FHIR resources (fhir) matching the filters, one at a time"""
+    rows = storage.iter_prescriptions(patient_id=patient_id, patient=patient,
+                                      created_from=created_from, created_to=created_to)
+    return export.fhir_resources(rows) if fmt == 'fhir' else export.records(rows)
+
+@app.route('/export')
+def export_prescriptions():
+    """
+    Stream every prescription as NDJSON (?format=ndjson|fhir, from=&to= created
+    dates, patient_id=, patient=<name>). Sent chunked, gzip-compressed when the
+    client accepts it.
+    """
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in export.FORMATS:
+        return jsonify({'error': f"format must be one of {', '.join(export.FORMATS)}"}), 400
+    try:
+        created_from = date.fromisoformat(request.args['from']).isoformat() if request.args.get('from') else None
+        created_to = (date.fromisoformat(request.args['to']) + timedelta(days=1)).isoformat() if request.args.get('to') else None
+    except ValueError:
+        return jsonify({'error': 'from/to must be dates (YYYY-MM-DD)'}), 400
+    
+    chunks = export.ndjson(export_items(fmt, request.args.get('patient_id'), request.args.get('patient'),
+                                        created_from, created_to))
+    headers = {'Vary': 'Accept-Encoding', 'X-Accel-Buffering': 'no'}
+    if negotiate_encoding(request.headers.get('Accept-Encoding'), encodings=('gzip',)):
+        chunks = export.gzip_stream(chunks)
+        headers['Content-Encoding'] = 'gzip'
+    mimetype = 'application/fhir+ndjson' if fmt == 'fhir' else 'application/x-ndjson'
+    return Response(stream_with_context(chunks), mimetype=mimetype, headers=headers)
+
+@app.route('/ocr_cache/stats')
+def ocr_cache_stats():
+    """Get OCR cache hit/miss counters"""
+    return jsonify(ocr_cache.stats())
+
+@app.route('/ocr_tiers/stats')
+def ocr_tier_stats():
+    """Get per-tier timings and hit rates of the adaptive OCR strategy"""
+    stats = adaptive_ocr.stats.snapshot()
+    stats['strategy'] = OCR_STRATEGY
+    stats['min_confidence'] = adaptive_ocr.min_confidence
+    stats['min_medicines'] = adaptive_ocr.min_medicines
+    return jsonify(stats)
+
+@app.route('/jobs/<job_id>')
+def get_job(job_id):
+    """Get the status (and result, once finished) of an OCR job"""
+    job = ocr_jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job)
+
 @app.route('/prescriptions')
 def list_prescriptions():
-    """List all prescriptions"""
+    """
+    List prescriptions, newest first.
+    With any of limit/cursor/patient/from/to, returns one page plus next_cursor.
+    """
     try:
-        prescriptions_list = []
-        for rx_id, rx_data in prescriptions_db.items():
-            prescriptions_list.append({
-                'id': rx_id,
-                'patient_name': rx_data['data'].get('patient_name', 'Unknown'),
-                'date': rx_data['data'].get('date', ''),
-                'medicines_count': len(rx_data['data'].get('medicines', [])),
-                'duration_days': rx_data.get('duration_days', 7),
-                'created_at': rx_data.get('created_at', '')
-            })
+        if not any(key in request.args for key in ('limit', 'cursor', 'patient', 'from', 'to')):
+            prescriptions_list, _ = storage.list_prescriptions()
+            return jsonify(prescriptions_list)
+        
+        try:
+            limit = int(request.args.get('limit', PRESCRIPTIONS_PAGE_SIZE))
+            created_from = date.fromisoformat(request.args['from']).isoformat() if request.args.get('from') else None
+            created_to = (date.fromisoformat(request.args['to']) + timedelta(days=1)).isoformat() if request.args.get('to') else None
+        except ValueError:
+            return jsonify({'error': 'limit must be an integer and from/to dates (YYYY-MM-DD)'}), 400
+        if not 1 <= limit <= MAX_PRESCRIPTIONS_PAGE_SIZE:
+            return jsonify({'error': f'limit must be between 1 and {MAX_PRESCRIPTIONS_PAGE_SIZE}'}), 400
         
-        prescriptions_list.sort(key=lambda x: x.get('created_at', ''), reverse=True)
-        return jsonify(prescriptions_list)
+        try:
+            prescriptions_list, next_cursor = storage.list_prescriptions(
+                limit=limit,
+                cursor=request.args.get('cursor'),
+                patient=request.args.get('patient'),
+                created_from=created_from,
+                created_to=created_to
+            )
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        return jsonify({'prescriptions': prescriptions_list, 'next_cursor': next_cursor})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def versioned_json(kind, prescription_id, version, build):
+    """
+    JSON response for one version of a prescription, with a strong ETag.
+
+    A matching If-None-Match gets 304 without building anything; otherwise
+    the serialized (and gzip/brotli compressed) body is reused from
+    response_cache until the version changes.
+    """
+    encoding = negotiate_encoding(request.headers.get('Accept-Encoding'))
+    query = hashlib.sha1(f"{kind}?{request.query_string.decode()}".encode()).hexdigest()[:16]
+    etag = f"{prescription_id}-{version}-{query}" + (f"-{encoding}" if encoding else '')
+    headers = {'ETag': f'"{etag}"', 'Vary': 'Accept-Encoding', 'Cache-Control': 'no-cache'}
+    
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers=headers)
+    
+    cached = response_cache.get(etag)
+    if cached is None:
+        # The uncompressed body is shared by every encoding of this version
+        identity = f"{prescription_id}-{version}-{query}"
+        raw = response_cache.get(identity)
+        if raw is None:
+            raw = (app.json.dumps(build()).encode(), None)
+            response_cache.put(identity, *raw)
+        if encoding and len(raw[0]) >= MIN_COMPRESS_BYTES:
+            cached = (compress(raw[0], encoding), encoding)
+            response_cache.put(etag, *cached)
+        else:
+            cached = raw
+            response_cache.put(etag, *cached)
+    body, content_encoding = cached
+    if content_encoding:
+        headers['Content-Encoding'] = content_encoding
+    return Response(body, mimetype='application/json', headers=headers)
+
 @app.route('/schedule/<prescription_id>')
 def get_schedule(prescription_id):
-    """Get schedule for a specific prescription"""
-    if prescription_id not in prescriptions_db:
+    """Get schedule for a specific prescription (?from=&to=&limit= select the days)"""
+    prescription = storage.get_prescription(prescription_id)
+    if prescription is None:
         return jsonify({'error': 'Prescription not found'}), 404
     
-    prescription = prescriptions_db[prescription_id]
-    return jsonify({
-        'prescription_id': prescription_id,
-        'schedule': prescription.get('schedule', []),
-        'medicines': prescription.get('data', {}).get('medicines', []),
-        'patient_name': prescription.get('data', {}).get('patient_name', ''),
-        'duration_days': prescription.get('duration_days', 7)
-    })
+    try:
+        first, last, limit = parse_window(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    def build():
+        days, next_from = prescription['schedule'].expand(first, last, limit)
+        return {
+            'prescription_id': prescription_id,
+            'schedule': days,
+            'next_from': next_from,
+            'medicines': prescription.get('data', {}).get('medicines', []),
+            'patient_name': prescription.get('data', {}).get('patient_name', ''),
+            'duration_days': prescription.get('duration_days', 7)
+        }
+    
+    return versioned_json('schedule', prescription_id, prescription['version'], build)
 
 @app.route('/family_dashboard/<prescription_id>')
 def family_dashboard(prescription_id):
     """Get family dashboard data for a prescription"""
-    if prescription_id not in prescriptions_db:
+    prescription = storage.get_prescription(prescription_id)
+    if prescription is None:
         return jsonify({'error': 'Prescription not found'}), 404
     
-    prescription = prescriptions_db[prescription_id]
-    schedule = prescription.get('schedule', [])
+    try:
+        first, last, limit = parse_window(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
-    # Calculate statistics
-    total_meds = 0
-    taken_meds = 0
+    def build():
+        schedule, next_from = prescription['schedule'].expand(first, last, limit)
+        return {
+            'prescription_id': prescription_id,
+            'patient_name': prescription.get('data', {}).get('patient_name', ''),
+            'schedule': schedule,
+            'next_from': next_from,
+            'statistics': prescription['schedule'].statistics(),
+            'logs': storage.get_logs(prescription_id)
+        }
     
-    for day in schedule:
-        for med in day.get('medications', []):
-            total_meds += 1
-            if med.get('taken'):
-                taken_meds += 1
+    return versioned_json('family_dashboard', prescription_id, prescription['version'], build)
+
+@app.route('/patient/<patient_id>/timeline')
+def patient_timeline(patient_id):
+    """
+    Doses from all of a patient's prescriptions in (date, time) order
+    (?from=&to=&limit= select the days, starting at the earliest prescription
+    by default). Doses of a medicine that several prescriptions include are
+    flagged, and `overlaps` lists those prescriptions' shared date ranges.
+    """
+    try:
+        first, last, limit = parse_window(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
-    adherence_rate = (taken_meds / total_meds * 100) if total_meds > 0 else 0
+    prescriptions = [(prescription_id, storage.get_prescription(prescription_id))
+                     for prescription_id in storage.patient_prescription_ids(patient_id)]
+    prescriptions = [(prescription_id, rx) for prescription_id, rx in prescriptions if rx is not None]
+    if not prescriptions:
+        return jsonify({'error': 'Patient not found'}), 404
     
-    return jsonify({
-        'prescription_id': prescription_id,
-        'patient_name': prescription.get('data', {}).get('patient_name', ''),
-        'schedule': schedule,
-        'statistics': {
-            'total_medications': total_meds,
-            'taken': taken_meds,
-            'missed': total_meds - taken_meds,
-            'adherence_rate': round(adherence_rate, 1)
-        },
-        'logs': medication_logs.get(prescription_id, {})
+    # Changes whenever any of the prescriptions (or their taken flags) change
+    version = hashlib.sha1(
+        ','.join(f"{prescription_id}:{rx['version']}" for prescription_id, rx in prescriptions).encode()
+    ).hexdigest()[:12]
+    
+    def build():
+        schedules = [(prescription_id, rx['schedule']) for prescription_id, rx in prescriptions]
+        days, next_from = timeline.merge(schedules, first, last, limit)
+        return {
+            'patient_id': patient_id,
+            'patient': storage.get_patient(patient_id),
+            'prescriptions': [{
+                'id': prescription_id,
+                'date': rx['data'].get('date', ''),
+                'start': rx['schedule'].start.isoformat(),
+                'end': rx['schedule'].end.isoformat()
+            } for prescription_id, rx in prescriptions],
+            'schedule': days,
+            'next_from': next_from,
+            'overlaps': timeline.overlapping_rules(schedules)
+        }
+    
+    return versioned_json('timeline', patient_id, version, build)
+
+@app.route('/reminders/<prescription_id>/stream')
+def reminder_stream(prescription_id):
+    """
+    Server-Sent Events with due_soon, due_now and overdue reminders.
+    Offsets (minutes) come from ?reminder1=&reminder2=&voiceAlert=&overdue=,
+    ?custom= is a JSON object of per-dose offsets keyed by medication id, and
+    ?tz_offset= is the client's UTC offset in minutes (default: server time).
+    """
+    if storage.get_prescription(prescription_id) is None:
+        return jsonify({'error': 'Prescription not found'}), 404
+    
+    try:
+        offsets = {key: int(request.args.get(key, default)) for key, default in DEFAULT_OFFSETS.items()}
+        custom = json.loads(request.args.get('custom', '{}'))
+        custom = {
+            dose: {key: int(value) for key, value in dose_offsets.items() if key in DEFAULT_OFFSETS}
+            for dose, dose_offsets in custom.items()
+        }
+    except (ValueError, TypeError, AttributeError):
+        return jsonify({'error': 'Reminder offsets must be whole minutes'}), 400
+    
+    tz_offset = request.args.get('tz_offset')
+    if tz_offset is not None:
+        if not re.fullmatch(r'[+-]?\d{1,3}', tz_offset) or abs(int(tz_offset)) > 14 * 60:
+            return jsonify({'error': 'tz_offset must be minutes east of UTC (-840 to 840)'}), 400
+        tz_offset = int(tz_offset)
+    
+    subscriber = reminder_scheduler.subscribe(prescription_id, offsets, custom, tz_offset)
+    
+    def events():
+        try:
+            yield 'retry: 5000\n\n'
+            while True:
+                try:
+                    event = subscriber.get(timeout=SSE_KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    yield ': keepalive\n\n'
+                    continue
+                yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+        finally:
+            reminder_scheduler.unsubscribe(subscriber)
+    
+    return Response(stream_with_context(events()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
     })
 
+@app.route('/metrics')
+def prometheus_metrics():
+    """Stage and request latency histograms, counters and gauges (Prometheus text format)"""
+    return Response(metrics.REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/reminders/stats')
+def reminder_stats():
+    """Open reminder streams and pending reminder events in this worker"""
+    return jsonify(reminder_scheduler.stats())
+
+@app.route('/analytics')
+def adherence_analytics():
+    """
+    Missed-dose rates across all prescriptions, for doses due so far: overall,
+    by medicine, hour of day, weekday and over time
+    (?from=&to= dates, medicine=<name>, interval=day|week|month).
+    """
+    if adherence_store is None:
+        return jsonify({'error': 'Analytics require NumPy (pip install numpy)'}), 501
+    try:
+        first = date.fromisoformat(request.args['from']) if request.args.get('from') else None
+        last = date.fromisoformat(request.args['to']) if request.args.get('to') else None
+    except ValueError:
+        return jsonify({'error': 'from/to must be dates (YYYY-MM-DD)'}), 400
+    interval = request.args.get('interval', 'week')
+    if interval not in analytics.INTERVALS:
+        return jsonify({'error': f"interval must be one of {', '.join(analytics.INTERVALS)}"}), 400
+    
+    with metrics.stage('analytics_sync'):
+        adherence_store.sync(storage)
+    with metrics.stage('analytics'):
+        result = adherence_store.report(first, last, request.args.get('medicine'), interval)
+    return jsonify(result)
+
+@app.route('/analytics/stats')
+def analytics_stats():
+    """Dose events held by this worker's analytics store"""
+    if adherence_store is None:
+        return jsonify({'error': 'Analytics require NumPy (pip install numpy)'}), 501
+    return jsonify(adherence_store.stats())
+
+@app.route('/vitals', methods=['POST'])
+def ingest_vitals():
+    """
+    Store a batch of vitals readings sent as NDJSON.
+    
+    Each line is one reading ({"patientId", "timestamp", "heartRate",
+    "bloodPressure", "temperature"}) or a patient document as in
+    sample-vitals.json ({"patientId", "vitals": [readings]}). The body is
+    read line by line; bad lines are skipped and reported.
+    """
+    with metrics.stage('vitals_ingest'):
+        accepted, errors = vitals_store.ingest(request.stream)
+    body = {
+        'accepted': accepted,
+        'rejected': len(errors),
+        'errors': [{'line': number, 'error': error} for number, error in errors[:VITALS_MAX_ERRORS]]
+    }
+    if not accepted and errors:
+        return jsonify(body), 400
+    return jsonify(body)
+
+@app.route('/vitals/<patient_id>')
+def get_vitals(patient_id):
+    """
+    Get a patient's vitals between `from` and `to` (ISO 8601, UTC unless an
+    offset is given). `resolution` is raw, minute, hour or auto (default),
+    which picks the finest level that fits the window.
+    """
+    try:
+        start = parse_timestamp(request.args['from']) if request.args.get('from') else None
+        end = parse_timestamp(request.args['to']) if request.args.get('to') else None
+    except ValueError:
+        return jsonify({'error': 'from and to must be ISO 8601 timestamps'}), 400
+    resolution = request.args.get('resolution', 'auto')
+    if resolution not in ('auto', 'raw', 'minute', 'hour'):
+        return jsonify({'error': 'resolution must be auto, raw, minute or hour'}), 400
+    
+    result = vitals_store.query(patient_id, start, end, resolution)
+    if result is None:
+        return jsonify({'error': 'Patient not found'}), 404
+    return jsonify(result)
+
+@app.route('/vitals/stats')
+def vitals_stats():
+    """Patients and readings held by this worker"""
+    return jsonify(vitals_store.stats())
+
 @app.route('/mark_taken', methods=['POST'])
 def mark_medication_taken():
     """Mark a medication as taken/not taken"""
@@ -577,30 +1004,139 @@ def mark_medication_taken():
         if not prescription_id or not medication_id:
             return jsonify({'error': 'Missing required fields'}), 400
             
-        if prescription_id not in prescriptions_db:
+        prescription = storage.get_prescription(prescription_id)
+        if prescription is None:
             return jsonify({'error': 'Prescription not found'}), 404
-            
-        # Update the schedule
-        for day in prescriptions_db[prescription_id]['schedule']:
-            for med in day.get('medications', []):
-                if med.get('id') == medication_id:
-                    med['taken'] = taken
-                    med['taken_at'] = datetime.now().isoformat() if taken else None
-                    
-                    # Log the action
-                    if prescription_id not in medication_logs:
-                        medication_logs[prescription_id] = {}
-                    medication_logs[prescription_id][medication_id] = {
-                        'taken': taken,
-                        'timestamp': datetime.now().isoformat()
-                    }
-                    
-                    return jsonify({'success': True, 'medication': med})
         
-        return jsonify({'error': 'Medication not found'}), 404
+        schedule = prescription['schedule']
+        if schedule.find(medication_id) is None:
+            return jsonify({'error': 'Medication not found'}), 404
+        
+        # Log the action (committed together with other marks arriving within MARK_BATCH_MS)
+        timestamp = datetime.now().isoformat()
+        storage.mark_taken(prescription_id, medication_id, taken, timestamp)
+        
+        # Storage has already marked the cached schedule; this copy may be an older one
+        med = dict(schedule.dose(medication_id), taken=bool(taken))
+        med['taken_at'] = timestamp if taken else None
+        
+        return jsonify({'success': True, 'medication': med})
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.cli.command('check-counters')
+def check_counters():
+    """Compare each prescription's incrementally kept adherence counters with a recount and report mismatches"""
+    mismatched = 0
+    prescription_ids = storage.prescription_ids()
+    for prescription_id in prescription_ids:
+        problems = storage.get_prescription(prescription_id)['schedule'].check_counters()
+        if problems:
+            mismatched += 1
+            click.echo(f"{prescription_id}: " + '; '.join(problems))
+    click.echo(f"Checked {len(prescription_ids)} prescriptions, {mismatched} with mismatched counters")
+    if mismatched:
+        click.get_current_context().exit(1)
+
+def reprocess_image(path):
+    """`flask reprocess` worker: extraction for one archived image, reusing cached OCR text"""
+    started = time.perf_counter()
+    with open(path, 'rb') as f:
+        image_bytes = f.read()
+    # No date fallback, so runs on different days stay comparable
+    prescription = extract_prescription_data(image_bytes, name=os.path.basename(path), default_date='')
+    timings = prescription.pop('stage_timings')
+    prescription.pop('raw_text', None)
+    record = {
+        'image': os.path.basename(path),
+        'ocr': 'run' if any(stage in ('ocr', 'ocr_adaptive') for stage, _ in timings) else 'cached',
+        'ms': round((time.perf_counter() - started) * 1000, 1)
+    }
+    if 'error' in prescription:
+        record['error'] = prescription['error']
+    else:
+        record['result'] = prescription
+    return record
+
+@app.cli.command('reprocess')
+@click.option('--folder', default=UPLOAD_FOLDER, show_default=True, help='Archived uploads to re-run')
+@click.option('--output', help='NDJSON results file; an existing one is resumed [default: new file in data/reprocess]')
+@click.option('--previous', help='Results file to diff against [default: the latest other run]')
+@click.option('--no-diff', is_flag=True, help='Skip the diff')
+@click.option('--workers', type=int, help='Worker processes [default: CPU count]')
+@click.option('--limit', type=int, help='Only the first N images (oldest first)')
+def reprocess_uploads(folder, output, previous, no_diff, workers, limit):
+    """Re-run extraction over archived uploads and diff the results against an earlier run"""
+    output = output or os.path.join(REPROCESS_FOLDER, f"{datetime.now().strftime('%Y%m%d_%H%M%S')}.ndjson")
+    click.echo(f"Writing {output}")
+    progress = reprocess.run(folder, output, reprocess_image, workers=workers, limit=limit,
+                             initializer=init_ocr_worker_process)
+    click.echo(f"Processed {progress.processed} images ({progress.done} of {progress.total} done), "
+               f"{progress.errors} errors")
+    
+    previous = previous or reprocess.previous_run(REPROCESS_FOLDER, exclude=output)
+    if no_diff or previous is None:
+        return
+    diff_path = os.path.splitext(output)[0] + '.diff.ndjson'
+    summary = reprocess.diff_runs(previous, output, diff_path)
+    click.echo(f"Compared with {previous}: {summary['changed']} of {summary['compared']} images changed, "
+               f"{summary['only_in_previous']} only in previous, {summary['only_in_current']} only in this run")
+    for field, count in summary['changed_fields'].items():
+        click.echo(f"  {field}: {count}")
+    if summary['changed']:
+        click.echo(f"Details in {diff_path}")
+
+@app.cli.command('export')
+@click.option('--format', 'fmt', type=click.Choice(export.FORMATS), default='ndjson', show_default=True)
+@click.option('--output', default='-', show_default=True, help='File to write (.gz is gzip-compressed), - for stdout')
+@click.option('--from', 'created_from', type=click.DateTime(['%Y-%m-%d']), help='Created on or after this date')
+@click.option('--to', 'created_to', type=click.DateTime(['%Y-%m-%d']), help='Created on or before this date')
+@click.option('--patient-id', help='Only this patient')
+def export_command(fmt, output, created_from, created_to, patient_id):
+    """Export prescriptions as NDJSON or FHIR resources"""
+    items = export_items(
+        fmt, patient_id=patient_id,
+        created_from=created_from.date().isoformat() if created_from else None,
+        created_to=(created_to.date() + timedelta(days=1)).isoformat() if created_to else None
+    )
+    chunks = export.ndjson(items)
+    if output.endswith('.gz'):
+        chunks = export.gzip_stream(chunks)
+    written = 0
+    with click.open_file(output, 'wb') as out:
+        for chunk in chunks:
+            out.write(chunk)
+            written += len(chunk)
+    if output != '-':
+        click.echo(f"Wrote {written} bytes to {output}")
+
+_warm_up_pid = None
+_warm_up_lock = threading.Lock()
+
+def warm_up_ocr():
+    """Start the OCR engines before the first upload (once per process)"""
+    global _warm_up_pid
+    with _warm_up_lock:
+        if _warm_up_pid == os.getpid():
+            return
+        _warm_up_pid = os.getpid()
+    backend = ocr_backends.get_backend()
+    try:
+        backend.warm_up()
+        logger.info('OCR backend ready: %s', backend.name)
+    except Exception:
+        logger.exception('OCR warm-up failed')
+
+@app.before_request
+def start_ocr_warm_up():
+    # Under flask run or gunicorn the first request of each worker process warms up in the
+    # background (not at import, where a preloading master would start engines it can't share)
+    if _warm_up_pid != os.getpid():
+        threading.Thread(target=warm_up_ocr, name='ocr-warm-up', daemon=True).start()
+
 if __name__ == '__main__':
+    # The debug reloader's parent process never serves requests
+    if not app.debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        warm_up_ocr()
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
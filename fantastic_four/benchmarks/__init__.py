@@ -0,0 +1 @@
+"""Benchmarks for the prescription reader (run from the fantastic_four/ directory)"""
@@ -0,0 +1,349 @@
+"""
+End-to-end benchmark on synthetic prescriptions.
+
+    python -m benchmarks.e2e_bench [--samples 20] [--seed 0] [--concurrency 1,4,8]
+                                   [--stages preprocess,ocr,parse,schedule,flow]
+                                   [--output results.json] [--compare baseline.json]
+
+Times preprocess_image, OCR with the configured backend, every extract_*
+parser, generate_schedule, and the /upload -> /schedule -> /mark_taken flow
+through Flask's test client at each concurrency level. Reports p50/p95/p99
+latency, throughput, peak RSS and extraction accuracy as JSON; `--compare`
+prints the change against an earlier run. The app runs in a temporary
+directory (its own database, uploads and OCR cache) so runs never warm each
+other up. The per-client upload rate limit is switched off (all flows share
+one client), which the results note under meta. Run from the fantastic_four/
+directory.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:  # Not available on Windows; peak RSS is reported as None
+    resource = None
+
+import ocr_backends
+import prescription_parser
+from preprocessing import preprocess_image
+
+from benchmarks.synthetic import generate, score, summarize_scores
+
+STAGES = ('preprocess', 'ocr', 'parse', 'schedule', 'flow')
+PARSERS = (
+    'extract_patient_info', 'extract_medicines_structured', 'extract_doctor_name', 'extract_hospital_name',
+    'extract_date', 'extract_diagnosis', 'extract_advice', 'parse_prescription_text'
+)
+# Keys compared by --compare, and whether a higher value is better
+COMPARED = {'p50_ms': False, 'p95_ms': False, 'p99_ms': False, 'throughput_per_s': True, 'field_accuracy': True}
+
+
+def percentile(ordered, q):
+    """Linearly interpolated percentile (0-100) of an already sorted list"""
+    if not ordered:
+        return None
+    rank = (len(ordered) - 1) * q / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def summarize(samples_ms, elapsed=None):
+    """Latency percentiles of samples in ms; throughput over `elapsed` seconds (default: their sum)"""
+    ordered = sorted(samples_ms)
+    if not ordered:
+        return {'count': 0}
+    elapsed = sum(ordered) / 1000 if elapsed is None else elapsed
+    return {
+        'count': len(ordered),
+        'mean_ms': round(sum(ordered) / len(ordered), 3),
+        'p50_ms': round(percentile(ordered, 50), 3),
+        'p95_ms': round(percentile(ordered, 95), 3),
+        'p99_ms': round(percentile(ordered, 99), 3),
+        'max_ms': round(ordered[-1], 3),
+        'throughput_per_s': round(len(ordered) / elapsed, 2) if elapsed else None
+    }
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process and of its (OCR worker) children so far"""
+    if resource is None:
+        return None
+    unit = 1024 * 1024 if sys.platform == 'darwin' else 1024   # ru_maxrss is bytes on macOS, KB elsewhere
+    return {
+        'self': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / unit, 1),
+        'children': round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / unit, 1)
+    }
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, (time.perf_counter() - start) * 1000
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True)
+        dirty = subprocess.run(['git', 'diff', '--quiet', 'HEAD'], capture_output=True).returncode != 0
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit.stdout.strip() + ('-dirty' if dirty else '')
+
+
+def load_app(workdir):
+    """Import the app with its database, uploads and caches under `workdir`"""
+    os.environ.setdefault('DRUG_LEXICON_PATH', os.path.abspath(os.path.join('lexicon', 'drugs.txt')))
+    os.environ['DATABASE_PATH'] = os.path.join(workdir, 'data', 'prescriptions.db')
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    # Every flow comes from one client; the per-client upload rate limit would turn most into 429s
+    os.environ['UPLOAD_RATE'] = '0'
+    os.chdir(workdir)
+    import app
+    return app
+
+
+# Stages
+
+def bench_preprocess(samples):
+    images, times = [], []
+    for sample in samples:
+        img, ms = timed(preprocess_image, io.BytesIO(sample['image']))
+        images.append(img)
+        times.append(ms)
+    return images, summarize(times)
+
+
+def bench_ocr(images, config):
+    """OCR texts (None if the engine is unavailable) and timings"""
+    backend = ocr_backends.get_backend()
+    try:
+        backend.warm_up()
+        texts, times = [], []
+        for img in images:
+            text, ms = timed(backend.image_to_string, img, config)
+            texts.append(text)
+            times.append(ms)
+    except Exception as e:
+        return None, {'skipped': f"{type(e).__name__}: {e}", 'backend': backend.name}
+    return texts, dict(summarize(times), backend=backend.name)
+
+
+def bench_parse(texts, repeat):
+    results = {}
+    for name in PARSERS:
+        fn = getattr(prescription_parser, name)
+        times = []
+        for _ in range(repeat):
+            for text in texts:
+                times.append(timed(fn, text)[1])
+        results[name] = summarize(times)
+    return results
+
+
+def bench_schedule(generate_schedule, samples, repeat):
+    times = []
+    for _ in range(repeat):
+        for sample in samples:
+            times.append(timed(generate_schedule, sample['truth']['medicines'])[1])
+    return summarize(times)
+
+
+def run_flow(flask_app, sample):
+    """One upload -> schedule -> mark_taken round trip; returns (timings ms, prescription, error)"""
+    client = flask_app.test_client()
+    timings = {}
+    start = time.perf_counter()
+    extension = 'jpg' if sample['format'] == 'JPEG' else 'png'
+    response, timings['upload'] = timed(lambda: client.post('/upload', data={
+        'prescription': (io.BytesIO(sample['image']), f"{sample['id']}.{extension}"),
+        'patient_name': sample['truth']['patient_name']
+    }, content_type='multipart/form-data'))
+    body = response.get_json(silent=True) or {}
+    if response.status_code != 200:
+        return timings, None, f"upload {response.status_code}: {body.get('error', '')}"
+    prescription_id = body['prescription_id']
+
+    response, timings['schedule'] = timed(client.get, f"/schedule/{prescription_id}")
+    if response.status_code != 200:
+        return timings, body, f"schedule {response.status_code}"
+    doses = [med['id'] for day in response.get_json()['schedule'] for med in day['medications']]
+    if doses:
+        response, timings['mark_taken'] = timed(lambda: client.post('/mark_taken', json={
+            'prescription_id': prescription_id, 'medication_id': doses[0], 'taken': True
+        }))
+        if response.status_code != 200:
+            return timings, body, f"mark_taken {response.status_code}"
+    timings['flow'] = (time.perf_counter() - start) * 1000
+    return timings, body, None
+
+
+def bench_flow(flask_app, count, seed, concurrency):
+    """The flow at one concurrency level, on fresh images so the OCR cache stays cold"""
+    samples = list(generate(count, f"{seed}c{concurrency}"))
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda sample: run_flow(flask_app, sample), samples))
+    elapsed = time.perf_counter() - start
+
+    latency = {step: [] for step in ('upload', 'schedule', 'mark_taken', 'flow')}
+    scores, errors, ids = [], Counter(), []
+    for sample, (timings, body, error) in zip(samples, results):
+        for step, ms in timings.items():
+            latency[step].append(ms)
+        if error:
+            errors[error] += 1
+        if body is not None:
+            ids.append(body['prescription_id'])
+            scores.append(score(body['data'], sample['truth']))
+    completed = len(latency['flow'])
+    if len(ids) != len(set(ids)):
+        # Two uploads saved under one id means one overwrote the other
+        raise RuntimeError(f"{len(ids) - len(set(ids))} uploads were saved under an id already in use")
+    return {
+        'flows': len(samples),
+        'completed': completed,
+        'errors': dict(errors),
+        'elapsed_s': round(elapsed, 3),
+        'throughput_per_s': round(completed / elapsed, 2) if elapsed else None,
+        'latency': {step: summarize(times, elapsed) for step, times in latency.items()},
+        'accuracy': summarize_scores(scores),
+        'peak_rss_mb': peak_rss_mb()
+    }
+
+
+def run(args):
+    started = datetime.now().isoformat(timespec='seconds')
+    commit = git_commit()
+    samples = list(generate(args.samples, args.seed))
+    results = {
+        'meta': {
+            'commit': commit,
+            'started_at': started,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'samples': args.samples,
+            'seed': args.seed,
+            'repeat': args.repeat
+        },
+        'dataset': {
+            'images': len(samples),
+            'medicines': sum(len(s['truth']['medicines']) for s in samples),
+            'layouts': dict(Counter(s['params']['layout'] for s in samples)),
+            'mean_megapixels': round(sum(s['params']['size'][0] * s['params']['size'][1]
+                                         for s in samples) / len(samples) / 1e6, 2) if samples else 0
+        },
+        'stages': {},
+        'accuracy': {'text': summarize_scores([score(prescription_parser.parse_prescription_text(s['text']),
+                                                     s['truth']) for s in samples])},
+        'flow': {}
+    }
+
+    workdir = tempfile.mkdtemp(prefix='rx-bench-')
+    cwd = os.getcwd()
+    try:
+        app = load_app(workdir)
+        results['meta']['ocr_strategy'] = app.OCR_STRATEGY
+        results['meta']['upload_rate_limit'] = 'off'
+        results['meta']['admission'] = {key: app.app.config[key] for key in
+                                        ('OCR_MAX_CONCURRENT', 'OCR_MAX_WAITING', 'OCR_MAX_WAIT_SECONDS')}
+        stages = results['stages']
+
+        images, ocr_texts = [], None
+        if 'preprocess' in args.stages or 'ocr' in args.stages:
+            images, stages['preprocess'] = bench_preprocess(samples)
+            stages['preprocess']['peak_rss_mb'] = peak_rss_mb()
+        if 'ocr' in args.stages:
+            ocr_texts, stages['ocr'] = bench_ocr(images, app.OCR_CONFIG)
+            stages['ocr']['peak_rss_mb'] = peak_rss_mb()
+            if ocr_texts is not None:
+                results['accuracy']['ocr'] = summarize_scores([
+                    score(prescription_parser.parse_prescription_text(text), s['truth'])
+                    for text, s in zip(ocr_texts, samples)
+                ])
+        del images
+        if 'parse' in args.stages:
+            stages['parse'] = bench_parse([s['text'] for s in samples], args.repeat)
+        if 'schedule' in args.stages:
+            stages['schedule'] = bench_schedule(app.generate_schedule, samples, args.repeat)
+
+        if 'flow' in args.stages:
+            if 'skipped' in stages.get('ocr', {}):
+                results['flow'] = {'skipped': f"OCR unavailable ({stages['ocr']['skipped']})"}
+            else:
+                for level in args.concurrency:
+                    results['flow'][f"concurrency_{level}"] = bench_flow(app.app, args.samples, args.seed, level)
+    finally:
+        os.chdir(cwd)
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+    results['peak_rss_mb'] = peak_rss_mb()
+    return results
+
+
+def flatten(data, prefix=''):
+    """{'a.b.key': value} for every COMPARED key in nested dicts"""
+    flat = {}
+    for key, value in data.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, path + '.'))
+        elif key in COMPARED and isinstance(value, (int, float)):
+            flat[path] = value
+    return flat
+
+
+def compare(baseline, current):
+    """Print the change of every compared metric present in both runs"""
+    old, new = flatten(baseline), flatten(current)
+    print(f"baseline {baseline['meta'].get('commit')} -> current {current['meta'].get('commit')}")
+    for path in sorted(old.keys() & new.keys()):
+        before, after = old[path], new[path]
+        change = (after - before) / before * 100 if before else 0.0
+        better = change > 0 if COMPARED[path.rsplit('.', 1)[1]] else change < 0
+        flag = '' if abs(change) < 5 else (' better' if better else ' WORSE')
+        print(f"{path:<70} {before:>12} {after:>12} {change:>+8.1f}%{flag}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--samples', type=int, default=20, help='synthetic images per run (and per concurrency level)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=20, help='passes over the texts for the parser/schedule stages')
+    parser.add_argument('--concurrency', default='1,4,8', help='comma-separated thread counts for the flow')
+    parser.add_argument('--stages', default=','.join(STAGES), help='comma-separated subset of ' + ','.join(STAGES))
+    parser.add_argument('--output', help='write the JSON results to this file instead of stdout')
+    parser.add_argument('--compare', help='JSON results of an earlier run to compare against')
+    parser.add_argument('--keep', action='store_true', help="keep the app's temporary working directory")
+    args = parser.parse_args()
+    args.concurrency = [int(c) for c in args.concurrency.split(',') if c]
+    args.stages = [s for s in args.stages.split(',') if s]
+    unknown = set(args.stages) - set(STAGES)
+    if unknown:
+        parser.error(f"unknown stages: {', '.join(sorted(unknown))}")
+
+    results = run(args)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            compare(json.load(f), results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""
+Parser golden check and throughput benchmark.
+
+    python -m benchmarks.parser_bench [--seconds 2] [--json]
+
+Every text in benchmarks/parser_corpus/ must parse to exactly the output
+recorded in golden.json (captured from the original regex cascade).
+Exits non-zero on any difference.
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+
+from prescription_parser import parse_prescription_text
+
+CORPUS_DIR = os.path.join(os.path.dirname(__file__), 'parser_corpus')
+
+
+def load_corpus():
+    with open(os.path.join(CORPUS_DIR, 'golden.json'), encoding='utf-8') as f:
+        golden = json.load(f)
+    texts = {}
+    for path in sorted(glob.glob(os.path.join(CORPUS_DIR, '*.txt'))):
+        with open(path, encoding='utf-8') as f:
+            texts[os.path.basename(path)] = f.read()
+    return texts, golden
+
+
+def check_golden(texts, golden):
+    """Return the names of corpus files whose parse differs from golden.json"""
+    return [name for name, text in texts.items() if parse_prescription_text(text) != golden.get(name)]
+
+
+def throughput(texts, seconds):
+    docs = list(texts.values())
+    parsed = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        for text in docs:
+            parse_prescription_text(text)
+        parsed += len(docs)
+    elapsed = time.perf_counter() - start
+    return parsed / elapsed, elapsed / parsed * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=2.0)
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args()
+
+    texts, golden = load_corpus()
+    mismatches = check_golden(texts, golden)
+    docs_per_second, us_per_doc = throughput(texts, args.seconds)
+    result = {
+        'corpus_size': len(texts),
+        'golden_mismatches': mismatches,
+        'docs_per_second': round(docs_per_second),
+        'us_per_doc': round(us_per_doc, 1)
+    }
+
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print(f"golden: {len(texts) - len(mismatches)}/{len(texts)} identical")
+        for name in mismatches:
+            print(f"  MISMATCH {name}")
+        print(f"throughput: {result['docs_per_second']} docs/s ({result['us_per_doc']} us/doc)")
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == '__main__':
+    main()
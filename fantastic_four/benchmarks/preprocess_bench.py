@@ -0,0 +1,85 @@
+"""
+Micro-benchmark: original preprocessing vs the single-pass pipeline.
+
+    python -m benchmarks.preprocess_bench [--runs 5] [--json]
+"""
+import argparse
+import io
+import json
+import statistics
+import time
+
+from PIL import Image, ImageDraw
+
+import preprocessing
+
+SIZES = {
+    'small_png': ((800, 600), 'PNG'),
+    'scan_png': ((2480, 3508), 'PNG'),
+    'phone_12mp_jpeg': ((4000, 3000), 'JPEG'),
+}
+
+
+def make_image(size, fmt):
+    """Encode a noisy page with a few lines of text"""
+    width, height = size
+    # Light paper texture; pure noise would make JPEG decode unrealistically slow
+    img = Image.eval(Image.effect_noise(size, 40), lambda v: 190 + v // 4).convert('RGB')
+    draw = ImageDraw.Draw(img)
+    for i, y in enumerate(range(height // 10, height, max(1, height // 12))):
+        draw.text((width // 10, y), f"{i + 1}. Paracetamol 500 mg Twice daily For 3 days", fill=(20, 20, 20))
+    buf = io.BytesIO()
+    img.save(buf, fmt, quality=90) if fmt == 'JPEG' else img.save(buf, fmt)
+    return buf.getvalue()
+
+
+def time_it(fn, data, runs):
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn(io.BytesIO(data))
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def run(runs):
+    pipelines = {
+        'legacy': preprocessing.preprocess_image_legacy,
+        'compat': lambda src: preprocessing.preprocess_image(src, compat=True),
+        'fast': preprocessing.preprocess_image,
+    }
+    results = {}
+    for name, (size, fmt) in SIZES.items():
+        data = make_image(size, fmt)
+        legacy = preprocessing.preprocess_image_legacy(io.BytesIO(data))
+        compat = preprocessing.preprocess_image(io.BytesIO(data), compat=True)
+        fast = preprocessing.preprocess_image(io.BytesIO(data))
+        results[name] = {
+            'input': f"{size[0]}x{size[1]} {fmt}",
+            'output_size': {'legacy': list(legacy.size), 'fast': list(fast.size)},
+            'compat_identical': legacy.tobytes() == compat.tobytes(),
+            'median_ms': {p: round(time_it(fn, data, runs), 1) for p, fn in pipelines.items()},
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args()
+
+    results = run(args.runs)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'image':<18} {'input':<16} {'legacy':>9} {'compat':>9} {'fast':>9} {'speedup':>8}  identical")
+    for name, r in results.items():
+        ms = r['median_ms']
+        print(f"{name:<18} {r['input']:<16} {ms['legacy']:>8.1f}m {ms['compat']:>8.1f}m {ms['fast']:>8.1f}m "
+              f"{ms['legacy'] / ms['fast']:>7.1f}x  {r['compat_identical']}")
+
+
+if __name__ == '__main__':
+    main()
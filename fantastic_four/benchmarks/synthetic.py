@@ -0,0 +1,250 @@
+"""
+Synthetic prescription images with ground truth.
+
+    python -m benchmarks.synthetic [--count 20] [--seed 0] [--out DIR]
+
+Each sample varies layout, font, medicine count, resolution, noise and skew,
+all drawn from a seeded RNG, so the same seed always renders the same images.
+`--out` writes the images plus truth.json; without it a summary is printed.
+"""
+import argparse
+import io
+import json
+import os
+import random
+from datetime import date, timedelta
+
+from PIL import Image, ImageDraw, ImageFont
+
+MEDICINES = [
+    ('Paracetamol', ['500 mg', '650 mg']),
+    ('Amoxicillin', ['250 mg', '500 mg']),
+    ('Omeprazole', ['20 mg', '40 mg']),
+    ('Metformin', ['500 mg', '1000 mg']),
+    ('Cetirizine', ['10 mg']),
+    ('Ibuprofen', ['200 mg', '400 mg']),
+    ('Azithromycin', ['250 mg', '500 mg']),
+    ('Pantoprazole', ['40 mg']),
+    ('Atorvastatin', ['10 mg', '20 mg']),
+    ('Amlodipine', ['5 mg', '10 mg']),
+    ('Losartan', ['25 mg', '50 mg']),
+    ('Montelukast', ['10 mg']),
+]
+FREQUENCIES = ['Once daily', 'Twice daily', 'Thrice daily']
+INSTRUCTIONS = ['After food', 'Before food', 'At bedtime']
+FORMS = ['tablet', 'capsule']
+PATIENTS = ['Kiran Rao', 'Ravi Shah', 'Anita Desai', 'John Mathew', 'Meera Iyer', 'Sunil Gupta', 'Fatima Khan']
+DOCTORS = ['Dr. Anil Kumar', 'Dr. S. Raghav', 'Dr. Priya Nair', 'Dr. Rahul Verma']
+CLINICS = ['Green Care Clinic', 'City Hospital', 'Sunrise Medical Centre', 'Lakeview Hospital']
+ADVICE = ['Drink plenty of water.', 'Avoid oily food.', 'Review after one week.']
+
+LAYOUTS = ('clinic', 'hospital')
+FONTS = ('DejaVuSans.ttf', 'DejaVuSerif.ttf', 'DejaVuSansMono.ttf', 'LiberationSans-Regular.ttf')
+BASE_WIDTH = 1240          # A4 at 150 dpi
+SCALES = (0.6, 1.0, 1.5)   # Phone thumbnail to 225 dpi scan
+NOISE_LEVELS = (0, 15, 35)
+MAX_SKEW = 3.0             # Degrees
+MAX_MEDICINES = 6
+
+# Fields scored for extraction accuracy
+HEADER_FIELDS = ('patient_name', 'patient_age', 'doctor_name', 'hospital', 'date')
+MEDICINE_FIELDS = ('name', 'dosage', 'frequency', 'duration')
+
+
+def load_font(name, size):
+    """A TrueType font by file name, falling back to Pillow's bundled font"""
+    try:
+        return ImageFont.truetype(name, size)
+    except OSError:
+        pass
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:  # Pillow < 10.1 has no scalable default font
+        return ImageFont.load_default()
+
+
+def make_truth(rng):
+    """Random prescription fields, in the shape prescription_parser returns"""
+    names = rng.sample(MEDICINES, rng.randint(1, MAX_MEDICINES))
+    medicines = []
+    for name, strengths in names:
+        medicines.append({
+            'name': name,
+            'dosage': rng.choice(strengths),
+            'frequency': rng.choice(FREQUENCIES),
+            'duration': f"{rng.randint(3, 30)} days",
+            'instructions': rng.choice(INSTRUCTIONS) if rng.random() < 0.6 else '',
+            'form': rng.choice(FORMS)
+        })
+    return {
+        'patient_name': rng.choice(PATIENTS),
+        'patient_age': str(rng.randint(4, 90)),
+        'doctor_name': rng.choice(DOCTORS),
+        'hospital': rng.choice(CLINICS),
+        'date': (date(2026, 1, 1) + timedelta(days=rng.randint(0, 364))).strftime('%d/%m/%Y'),
+        'medicines': medicines,
+        'advice': rng.choice(ADVICE)
+    }
+
+
+def render_lines(truth, layout):
+    """Text lines of a prescription in one of LAYOUTS"""
+    lines = []
+    if layout == 'clinic':
+        lines += [f"{truth['doctor_name']} MBBS", truth['hospital'],
+                  f"Patient: {truth['patient_name']} Age: {truth['patient_age']}", f"Date: {truth['date']}", '', 'Rx']
+        for i, med in enumerate(truth['medicines'], 1):
+            lines.append(f"{i}. {med['name']} {med['dosage']}")
+            lines.append(f"1 {med['form']} {med['frequency']}")
+            if med['instructions']:
+                lines.append(med['instructions'])
+            lines.append(f"For {med['duration']}")
+    else:
+        lines += [truth['hospital'], truth['doctor_name'],
+                  f"Patient Name: {truth['patient_name']}  Age: {truth['patient_age']}", f"Date: {truth['date']}", 'Rx']
+        for i, med in enumerate(truth['medicines'], 1):
+            middle = ' '.join(filter(None, [f"1 {med['form']} {med['frequency']}", med['instructions']]))
+            lines.append(f"{i}. {med['name']} {med['dosage']} - {middle} - {med['duration']}")
+    lines += ['', f"Advice: {truth['advice']}", 'Signature']
+    return lines
+
+
+def render_image(lines, rng, font_name, scale, noise, skew):
+    """Draw the lines on a page, then add paper noise and rotate by `skew` degrees"""
+    width = int(BASE_WIDTH * scale)
+    font_size = max(10, int(width / 45))
+    line_height = int(font_size * 1.6)
+    height = max(int(width * 1.3), line_height * (len(lines) + 6))
+    font = load_font(font_name, font_size)
+
+    img = Image.new('L', (width, height), 255)
+    draw = ImageDraw.Draw(img)
+    x, y = int(width * 0.08), line_height * 2
+    for line in lines:
+        draw.text((x + rng.randint(0, 3), y), line, fill=rng.randint(0, 40), font=font)
+        y += line_height
+
+    if noise:
+        # Drawn from rng (Image.effect_noise isn't seedable); uniform bytes have a spread of ~74
+        grain = Image.frombytes('L', (width, height), rng.randbytes(width * height))
+        grain = grain.point(lambda v: round(128 + (v - 128) * noise / 74))
+        img = Image.blend(img, grain, 0.25)
+    if skew:
+        img = img.rotate(skew, resample=Image.BICUBIC, expand=True, fillcolor=255)
+    return img
+
+
+def generate(count, seed=0):
+    """
+    Yield `count` samples: {'id', 'image' (encoded bytes), 'format', 'text', 'truth', 'params'}.
+    Sample i depends only on (seed, i).
+    """
+    for i in range(count):
+        rng = random.Random(f"{seed}:{i}")
+        truth = make_truth(rng)
+        params = {
+            'layout': rng.choice(LAYOUTS),
+            'font': rng.choice(FONTS),
+            'scale': rng.choice(SCALES),
+            'noise': rng.choice(NOISE_LEVELS),
+            'skew': round(rng.uniform(-MAX_SKEW, MAX_SKEW), 2) if rng.random() < 0.5 else 0.0,
+            'format': rng.choice(['PNG', 'JPEG'])
+        }
+        lines = render_lines(truth, params['layout'])
+        img = render_image(lines, rng, params['font'], params['scale'], params['noise'], params['skew'])
+        buf = io.BytesIO()
+        if params['format'] == 'JPEG':
+            img.save(buf, 'JPEG', quality=85)
+        else:
+            img.save(buf, 'PNG')
+        params['size'] = list(img.size)
+        yield {
+            'id': f"synthetic_{seed}_{i:04d}",
+            'image': buf.getvalue(),
+            'format': params['format'],
+            'text': '\n'.join(lines),
+            'truth': truth,
+            'params': params
+        }
+
+
+def _norm(value):
+    return ' '.join(str(value or '').lower().split())
+
+
+def score(parsed, truth):
+    """
+    Field-level extraction accuracy of a parsed prescription against its truth.
+
+    Returns {'fields': {field: [correct, total]}, 'medicines_expected',
+    'medicines_found', 'medicines_extra'}. Medicines are matched by name;
+    a missing medicine counts as wrong in every medicine field.
+    """
+    fields = {field: [int(_norm(parsed.get(field)) == _norm(truth[field])), 1] for field in HEADER_FIELDS}
+    for field in MEDICINE_FIELDS:
+        fields[field] = [0, 0]
+
+    found = {_norm(med.get('name')): med for med in parsed.get('medicines', [])}
+    matched = 0
+    for med in truth['medicines']:
+        candidate = found.get(_norm(med['name']))
+        matched += candidate is not None
+        for field in MEDICINE_FIELDS:
+            fields[field][1] += 1
+            if candidate is not None and _norm(candidate.get(field)) == _norm(med[field]):
+                fields[field][0] += 1
+    return {
+        'fields': fields,
+        'medicines_expected': len(truth['medicines']),
+        'medicines_found': matched,
+        'medicines_extra': len(found) - matched
+    }
+
+
+def summarize_scores(scores):
+    """Overall and per-field accuracy plus medicine recall over several score() results"""
+    totals = {}
+    for result in scores:
+        for field, (correct, total) in result['fields'].items():
+            counts = totals.setdefault(field, [0, 0])
+            counts[0] += correct
+            counts[1] += total
+    correct = sum(c for c, _ in totals.values())
+    total = sum(t for _, t in totals.values())
+    expected = sum(r['medicines_expected'] for r in scores)
+    return {
+        'documents': len(scores),
+        'field_accuracy': round(correct / total, 4) if total else None,
+        'by_field': {field: round(c / t, 4) if t else None for field, (c, t) in totals.items()},
+        'medicine_recall': round(sum(r['medicines_found'] for r in scores) / expected, 4) if expected else None,
+        'extra_medicines': sum(r['medicines_extra'] for r in scores)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--count', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', help='directory for the images and truth.json')
+    args = parser.parse_args()
+
+    truth = {}
+    for sample in generate(args.count, args.seed):
+        name = f"{sample['id']}.{'jpg' if sample['format'] == 'JPEG' else 'png'}"
+        truth[name] = {'truth': sample['truth'], 'params': sample['params'], 'text': sample['text']}
+        if args.out:
+            os.makedirs(args.out, exist_ok=True)
+            with open(os.path.join(args.out, name), 'wb') as f:
+                f.write(sample['image'])
+        else:
+            p = sample['params']
+            print(f"{name:<28} {p['layout']:<9} {p['font']:<26} {p['size'][0]}x{p['size'][1]:<6} "
+                  f"noise={p['noise']:<3} skew={p['skew']:<6} medicines={len(sample['truth']['medicines'])}")
+    if args.out:
+        with open(os.path.join(args.out, 'truth.json'), 'w', encoding='utf-8') as f:
+            json.dump(truth, f, indent=2)
+        print(f"Wrote {len(truth)} images and truth.json to {args.out}")
+
+
+if __name__ == '__main__':
+    main()
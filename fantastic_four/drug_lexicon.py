@@ -0,0 +1,219 @@
+"""Drug-name lexicon with a SymSpell-style deletion index for OCR error correction"""
+import os
+import pickle
+from collections import namedtuple
+
+MAX_DISTANCE = 2
+# Dosage-form words that often lead a parsed name ("Tab Paracetamol"); never matched on their own
+DOSAGE_FORMS = frozenset([
+    'tab', 'tabs', 'tablet', 'tablets', 'cap', 'caps', 'capsule', 'capsules', 'syp', 'syr', 'syrup',
+    'inj', 'injection', 'susp', 'suspension', 'drop', 'drops', 'oint', 'ointment', 'cream', 'gel',
+    'sachet', 'sach', 'lotion', 'inh', 'inhaler', 'spray'
+])
+PREFIX_LENGTH = 7   # Deletes are generated from this prefix only (as in SymSpell)
+INDEX_VERSION = 2
+
+LexiconMatch = namedtuple('LexiconMatch', ['canonical', 'term', 'distance', 'low_confidence'])
+
+
+def _within_one_edit(a, b):
+    """True if a and b differ by one substitution, insertion, deletion or transposition"""
+    if a == b:
+        return True
+    la, lb = len(a), len(b)
+    if abs(la - lb) > 1:
+        return False
+    i = 0
+    while i < min(la, lb) and a[i] == b[i]:
+        i += 1
+    if la == lb:
+        if a[i + 1:] == b[i + 1:]:
+            return True
+        swapped = a[i + 1:i + 2] == b[i:i + 1] and a[i:i + 1] == b[i + 1:i + 2]
+        return swapped and a[i + 2:] == b[i + 2:]
+    return a[i + 1:] == b[i:] if la > lb else a[i:] == b[i + 1:]
+
+
+def edit_distance(a, b, max_distance):
+    """Optimal string alignment distance, or max_distance + 1 once it is exceeded"""
+    if a == b:
+        return 0
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    if _within_one_edit(a, b):
+        return 1
+    if max_distance == 1:
+        return 2
+
+    # Only cells within max_distance of the diagonal can stay under the limit
+    over = max_distance + 1
+    la, lb = len(a), len(b)
+    previous2 = None
+    previous = [j if j <= max_distance else over for j in range(lb + 1)]
+    for i in range(1, la + 1):
+        current = [over] * (lb + 1)
+        if i <= max_distance:
+            current[0] = i
+        row_min = current[0]
+        for j in range(max(1, i - max_distance), min(lb, i + max_distance) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            value = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if (previous2 is not None and j > 1
+                    and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]):
+                value = min(value, previous2[j - 2] + 1)
+            current[j] = min(value, over)
+            row_min = min(row_min, current[j])
+        if row_min > max_distance:
+            return over
+        previous2, previous = previous, current
+    return previous[lb]
+
+
+def _deletes(word, max_distance):
+    """Every string reachable from `word` by deleting up to max_distance characters"""
+    results = {word}
+    frontier = {word}
+    for _ in range(max_distance):
+        frontier = {w[:i] + w[i + 1:] for w in frontier if len(w) > 1 for i in range(len(w))}
+        results |= frontier
+    return results
+
+
+def _ordered_deletes(word, max_distance):
+    """Deletes of `word`, fewest deletions first and in a stable order"""
+    return sorted(_deletes(word, max_distance), key=lambda d: (-len(d), d))
+
+
+def allowed_distance(word, max_distance=MAX_DISTANCE):
+    """Edits tolerated for a word of this length: none up to 4 characters, one up to 7"""
+    if len(word) <= 4:
+        return 0
+    if len(word) <= 7:
+        return min(1, max_distance)
+    return max_distance
+
+
+def is_low_confidence(term, distance):
+    """Two edits, or one edit in a short name, is too risky to trust blindly"""
+    return distance >= 2 or (distance == 1 and len(term) <= 4)
+
+
+class DrugLexicon:
+    """
+    Canonical drug names plus aliases (brands, common misspellings).
+
+    The source file has one entry per line: a name, or `alias<TAB>canonical`.
+    Lines starting with `#` are comments.
+    """
+
+    def __init__(self, max_distance=MAX_DISTANCE, prefix_length=PREFIX_LENGTH):
+        self.max_distance = max_distance
+        self.prefix_length = prefix_length
+        self.terms = {}     # lowercased term -> canonical display name
+        self.index = {}     # delete of a term prefix -> '\n'-joined terms (fast to unpickle)
+
+    def add(self, term, canonical=None):
+        key = ' '.join(term.lower().split())
+        if not key or key in self.terms:
+            return
+        self.terms[key] = canonical or term.strip()
+        for delete in _deletes(key[:self.prefix_length], self.max_distance):
+            bucket = self.index.get(delete)
+            self.index[delete] = key if bucket is None else f"{bucket}\n{key}"
+
+    @classmethod
+    def from_file(cls, path, **kwargs):
+        lexicon = cls(**kwargs)
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                term, _, canonical = line.partition('\t')
+                lexicon.add(term, canonical.strip() or None)
+        return lexicon
+
+    @classmethod
+    def load(cls, path, cache_dir=None, **kwargs):
+        """
+        Load the lexicon at `path`, reusing a pickled index from `cache_dir`
+        as long as the source file hasn't changed.
+        """
+        if cache_dir is None:
+            return cls.from_file(path, **kwargs)
+
+        st = os.stat(path)
+        signature = (INDEX_VERSION, os.path.abspath(path), st.st_size, st.st_mtime_ns, sorted(kwargs.items()))
+        cache_path = os.path.join(cache_dir, f"{os.path.basename(path)}.index.pickle")
+        try:
+            with open(cache_path, 'rb') as f:
+                cached_signature, lexicon = pickle.load(f)
+            if cached_signature == signature:
+                return lexicon
+        except (OSError, EOFError, pickle.UnpicklingError, ValueError):
+            pass
+
+        lexicon = cls.from_file(path, **kwargs)
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump((signature, lexicon), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+        return lexicon
+
+    def __len__(self):
+        return len(self.terms)
+
+    def lookup(self, word):
+        """Closest lexicon entry within max_distance, or None"""
+        key = ' '.join(word.lower().split())
+        if not key:
+            return None
+        if key in self.terms:
+            return LexiconMatch(self.terms[key], key, 0, False)
+        max_distance = allowed_distance(key, self.max_distance)
+        if not max_distance:
+            return None
+
+        best = None
+        checked = set()
+        for delete in _ordered_deletes(key[:self.prefix_length], self.max_distance):
+            bucket = self.index.get(delete)
+            if bucket is None:
+                continue
+            for term in bucket.split('\n'):
+                if term in checked:
+                    continue
+                checked.add(term)
+                limit = max_distance if best is None else best[0]
+                if abs(len(term) - len(key)) > limit:
+                    continue
+                distance = edit_distance(key, term, limit)
+                if distance > limit:
+                    continue
+                # Prefer fewer edits, then the entry closest in length
+                rank = (distance, abs(len(term) - len(key)), term)
+                if best is None or rank < best:
+                    best = rank
+        if best is None:
+            return None
+        distance, _, term = best
+        return LexiconMatch(self.terms[term], term, distance, is_low_confidence(term, distance))
+
+    def match_medicine(self, name):
+        """
+        Match a parsed medicine name. Failing that, dosage forms are dropped
+        ("Tab Paracetamol" -> "Paracetamol") and the remaining words are
+        tried in order ("Vitamin D3" -> "Vitamin").
+        """
+        match = self.lookup(name)
+        words = name.split()
+        if match is not None or len(words) < 2:
+            return match
+        words = [word for word in words if word.lower().strip('.') not in DOSAGE_FORMS]
+        candidates = [' '.join(words)] if 1 < len(words) else []
+        for candidate in candidates + words:
+            match = self.lookup(candidate)
+            if match is not None:
+                return match
+        return None
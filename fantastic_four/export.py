@@ -0,0 +1,130 @@
+"""
+Bulk export of prescriptions and taken-dose records as NDJSON, in this app's
+own shape or as FHIR R4 MedicationRequest / MedicationAdministration
+resources (used by /export and `flask export` in app.py).
+
+Everything is a generator over Storage.iter_prescriptions, so an export
+holds one batch of prescriptions in memory however many it writes.
+"""
+import json
+import re
+import zlib
+from datetime import date, timedelta
+
+from http_cache import GZIP_LEVEL
+from schedules import Schedule
+
+FORMATS = ('ndjson', 'fhir')
+CHUNK_BYTES = 64 * 1024   # Lines are sent in chunks of about this size
+
+# Logged doses map to MedicationAdministration.status
+ADMINISTRATION_STATUS = {True: 'completed', False: 'not-done'}
+
+
+def records(rows):
+    """One dict per prescription: its data, schedule rules, statistics and taken-dose log"""
+    for row, logs in rows:
+        taken_ids = [log['medication_id'] for log in logs if log['taken']]
+        schedule = Schedule.from_dict(json.loads(row['schedule']), taken_ids)
+        yield {
+            'id': row['id'],
+            'patient_id': row['patient_id'],
+            'created_at': row['created_at'],
+            'version': row['version'],
+            'prescription': json.loads(row['data']),
+            'schedule': schedule.to_dict(),
+            'statistics': schedule.statistics(),
+            'doses': [{'id': log['medication_id'], 'taken': bool(log['taken']), 'timestamp': log['timestamp']}
+                      for log in logs]
+        }
+
+
+def fhir_id(value):
+    """A FHIR id ([A-Za-z0-9-.], at most 64 characters) for one of our ids"""
+    return re.sub(r'[^A-Za-z0-9.-]', '-', value)[:64]
+
+
+def fhir_resources(rows):
+    """
+    FHIR R4 resources: a MedicationRequest per medicine of each prescription,
+    then a MedicationAdministration per logged dose (taken or explicitly not).
+    """
+    today = date.today()
+    for row, logs in rows:
+        data = json.loads(row['data'])
+        schedule = Schedule.from_dict(json.loads(row['schedule']))
+        rx_id = fhir_id(row['id'])
+        subject = {'display': data.get('patient_name') or 'Unknown'}
+        if row['patient_id']:
+            subject['reference'] = f"Patient/{fhir_id(row['patient_id'])}"
+
+        for index, rule in enumerate(schedule.rules):
+            yield medication_request(f"{rx_id}-{index}", rx_id, rule, schedule.start, row['created_at'],
+                                     subject, data.get('doctor_name'), today)
+        for log in logs:
+            found = schedule.find(log['medication_id'])
+            if found is None:
+                continue
+            index, offset, slot = found
+            rule = schedule.rules[index]
+            yield {
+                'resourceType': 'MedicationAdministration',
+                'id': f"{rx_id}-{index}-{offset}-{slot}",
+                'status': ADMINISTRATION_STATUS[bool(log['taken'])],
+                'medicationCodeableConcept': {'text': rule['medicine']},
+                'subject': subject,
+                'effectiveDateTime': log['timestamp'],
+                'request': {'reference': f"MedicationRequest/{rx_id}-{index}"},
+                'dosage': {'text': rule['dosage']},
+                'note': [{'text': f"Scheduled {(schedule.start + timedelta(days=offset)).isoformat()} "
+                                  f"{rule['times'][slot]}"}]
+            }
+
+
+def medication_request(resource_id, rx_id, rule, start, created_at, subject, doctor=None, today=None):
+    end = start + timedelta(days=max(rule['days'] - 1, 0))
+    resource = {
+        'resourceType': 'MedicationRequest',
+        'id': resource_id,
+        'status': 'active' if end >= (today or date.today()) else 'completed',
+        'intent': 'order',
+        'groupIdentifier': {'value': rx_id},
+        'medicationCodeableConcept': {'text': rule['medicine']},
+        'subject': subject,
+        'authoredOn': created_at,
+        'dosageInstruction': [{
+            'text': ' '.join(filter(None, [rule['dosage'], rule['frequency']])),
+            'patientInstruction': rule['instructions'],
+            'timing': {'repeat': {
+                'boundsPeriod': {'start': start.isoformat(), 'end': end.isoformat()},
+                'timeOfDay': [f"{time}:00" for time in rule['times']]
+            }}
+        }]
+    }
+    if doctor:
+        resource['requester'] = {'display': doctor}
+    return resource
+
+
+def ndjson(items, chunk_bytes=CHUNK_BYTES):
+    """Encode items as NDJSON, yielding byte chunks of about `chunk_bytes`"""
+    buffer, size = [], 0
+    for item in items:
+        line = (json.dumps(item, separators=(',', ':')) + '\n').encode()
+        buffer.append(line)
+        size += len(line)
+        if size >= chunk_bytes:
+            yield b''.join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+def gzip_stream(chunks, level=GZIP_LEVEL):
+    """Compress a stream of byte chunks into one gzip member, chunk by chunk"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
@@ -0,0 +1,39 @@
+"""Per-process resources for code that runs in forked workers (gunicorn, OCR job pools)"""
+import os
+import threading
+
+
+class PerProcess:
+    """
+    A value created on first use in each process.
+
+    Threads, pools and pipes don't survive fork: a child inherits the parent's
+    objects but none of the threads behind them. `get` notices that it runs in
+    a new process and builds a fresh value with `factory(*args)`.
+    """
+
+    def __init__(self, factory):
+        self.factory = factory
+        self._value = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def get(self, *args):
+        """This process's value, created with `factory(*args)` if there is none yet"""
+        with self._lock:
+            if self._pid != os.getpid():
+                self._value = self.factory(*args)
+                self._pid = os.getpid()
+            return self._value
+
+    def peek(self):
+        """This process's value, or None if it hasn't been created here"""
+        with self._lock:
+            return self._value if self._pid == os.getpid() else None
+
+    def reset(self):
+        """Forget the value, returning it if it belonged to this process; the next `get` creates a new one"""
+        with self._lock:
+            value = self._value if self._pid == os.getpid() else None
+            self._value = self._pid = None
+            return value
@@ -0,0 +1,94 @@
+"""Serialized (and compressed) JSON responses cached per prescription version"""
+import gzip
+import threading
+from collections import OrderedDict
+
+try:
+    import brotli
+except ImportError:  # Optional: gzip is always available
+    brotli = None
+
+MIN_COMPRESS_BYTES = 1024   # Smaller bodies are sent as-is
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+def negotiate_encoding(accept_encoding, encodings=('br', 'gzip')):
+    """The first of `encodings` an Accept-Encoding header accepts (q=0 means refused), or None"""
+    accepted = {}
+    for part in (accept_encoding or '').split(','):
+        name, _, params = part.strip().partition(';')
+        if not name:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name.strip().lower()] = q
+    for encoding in encodings:
+        if encoding == 'br' and brotli is None:
+            continue
+        if accepted.get(encoding, 0) > 0:
+            return encoding
+    return None
+
+
+def compress(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+class ResponseCache:
+    """
+    LRU of (body, content encoding) pairs keyed by ETag.
+
+    Keys include the prescription version, so entries never need explicit
+    invalidation; old versions simply age out.
+    """
+
+    def __init__(self, max_bytes=32 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """(body, content encoding) or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, body, content_encoding=None):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= len(old[0])
+            self._entries[key] = (body, content_encoding)
+            self._size += len(body)
+            while self._size > self.max_bytes:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0
+            }
@@ -0,0 +1,156 @@
+"""Upload validation from image headers and asynchronous archiving of originals"""
+import io
+import logging
+import os
+import queue
+import threading
+
+from PIL import Image, UnidentifiedImageError
+from flask import Request
+
+from forksafe import PerProcess
+
+logger = logging.getLogger(__name__)
+
+ALLOWED_FORMATS = {'PNG': 'png', 'JPEG': 'jpg', 'MPO': 'jpg'}   # MPO: multi-picture JPEGs from phone cameras
+MAX_PIXELS = 50_000_000   # Larger images are rejected before decoding (decompression bombs)
+MIN_SIDE = 100            # Too small to hold readable text
+
+ARCHIVE_MODES = ('original', 'downscaled', 'off')
+ARCHIVE_MAX_WIDTH = 1600
+ARCHIVE_QUALITY = 80
+ARCHIVE_QUEUE_SIZE = 64   # Uploads wait for the archiver once this many copies are pending
+
+
+class InvalidImageError(Exception):
+    """Raised when an upload is not an image we can process; `status` is the HTTP code to answer with"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class InMemoryRequest(Request):
+    """
+    Request whose uploaded files stay in memory.
+
+    Werkzeug spools file parts over 500 KB to temporary files; with
+    MAX_CONTENT_LENGTH bounding the body, keeping them in memory lets the
+    image be decoded straight from the request buffer.
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return io.BytesIO()
+
+
+def probe_image(data, max_pixels=MAX_PIXELS, min_side=MIN_SIDE):
+    """
+    Check format and dimensions from the image header alone (nothing is decoded).
+    Returns (format, width, height); raises InvalidImageError.
+    """
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            fmt, (width, height) = img.format, img.size
+    except Image.DecompressionBombError:
+        raise InvalidImageError('Image dimensions are too large', status=413)
+    except (UnidentifiedImageError, OSError, ValueError):
+        raise InvalidImageError('File is not a readable image')
+    if fmt not in ALLOWED_FORMATS:
+        raise InvalidImageError(f'Unsupported image format: {fmt}')
+    if width * height > max_pixels:
+        raise InvalidImageError(f'Image is {width}x{height}, more than {max_pixels} pixels', status=413)
+    if min(width, height) < min_side:
+        raise InvalidImageError(f'Image is {width}x{height}, too small to read')
+    return fmt, width, height
+
+
+def downscale(data, max_width=ARCHIVE_MAX_WIDTH, quality=ARCHIVE_QUALITY):
+    """Re-encode an image as JPEG no wider than `max_width`"""
+    with Image.open(io.BytesIO(data)) as img:
+        # JPEGs are reduced during decode instead of decoding full size first
+        img.draft('RGB', (max_width, max_width * img.height // max(img.width, 1)))
+        img = img.convert('L' if img.mode in ('1', 'L', 'LA', 'I', 'I;16') else 'RGB')
+        if img.width > max_width:
+            img = img.resize((max_width, max(1, img.height * max_width // img.width)), Image.LANCZOS)
+        buf = io.BytesIO()
+        img.save(buf, 'JPEG', quality=quality, optimize=True)
+        return buf.getvalue()
+
+
+class UploadArchive:
+    """
+    Writes upload originals to `folder` on a background thread.
+
+    Modes: 'original' keeps the uploaded bytes, 'downscaled' keeps a JPEG no
+    wider than `max_width`, 'off' keeps nothing. `archive()` returns the path
+    the copy will have without waiting for the write.
+    """
+
+    def __init__(self, folder, mode='original', max_width=ARCHIVE_MAX_WIDTH, quality=ARCHIVE_QUALITY,
+                 queue_size=ARCHIVE_QUEUE_SIZE):
+        if mode not in ARCHIVE_MODES:
+            raise ValueError(f"archive mode must be one of {', '.join(ARCHIVE_MODES)}")
+        self.folder = folder
+        self.mode = mode
+        self.max_width = max_width
+        self.quality = quality
+        self.queue_size = queue_size
+        self._pending = PerProcess(self._start_writer)
+        self._lock = threading.Lock()
+        self.written = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.failed = 0
+
+    def archive(self, filename, data):
+        """Queue a copy of an upload; returns its path, or '' when archiving is off"""
+        if self.mode == 'off':
+            return ''
+        if self.mode == 'downscaled':
+            filename = os.path.splitext(filename)[0] + '.jpg'
+        path = os.path.join(self.folder, filename)
+        self._pending.get().put((path, data))
+        return path
+
+    def _start_writer(self):
+        pending = queue.Queue(maxsize=self.queue_size)
+        threading.Thread(target=self._write, args=(pending,), name='upload-archive', daemon=True).start()
+        return pending
+
+    def _write(self, pending):
+        while True:
+            path, data = pending.get()
+            try:
+                body = downscale(data, self.max_width, self.quality) if self.mode == 'downscaled' else data
+                tmp_path = path + '.tmp'
+                with open(tmp_path, 'wb') as f:
+                    f.write(body)
+                os.replace(tmp_path, path)
+                with self._lock:
+                    self.written += 1
+                    self.bytes_in += len(data)
+                    self.bytes_out += len(body)
+            except Exception:
+                with self._lock:
+                    self.failed += 1
+                logger.exception('Archiving %s failed', path)
+            finally:
+                pending.task_done()
+
+    def join(self):
+        """Wait until every queued copy is written"""
+        pending = self._pending.peek()
+        if pending is not None:
+            pending.join()
+
+    def stats(self):
+        pending = self._pending.peek()
+        with self._lock:
+            return {
+                'mode': self.mode,
+                'pending': pending.qsize() if pending is not None else 0,
+                'written': self.written,
+                'failed': self.failed,
+                'bytes_in': self.bytes_in,
+                'bytes_out': self.bytes_out
+            }
@@ -0,0 +1,152 @@
+"""Background OCR jobs backed by a process pool"""
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+
+
+class QueueFullError(Exception):
+    """Raised when the job queue cannot accept another job"""
+
+
+class WorkerPoolError(Exception):
+    """Raised when the worker pool cannot be (re)started"""
+
+
+class OCRJobQueue:
+    """
+    Bounded queue of OCR jobs handled by a ProcessPoolExecutor.
+
+    The heavy work (preprocessing + OCR + parsing) runs in a worker process.
+    The `on_done` callback runs back in this process, so it can safely touch
+    the app's stores. It is called for failed jobs too, with {'error': ...}.
+
+    A worker that dies (OOM kill, crash in tesseract) breaks the whole pool;
+    the broken pool is then replaced, so later jobs run in fresh workers.
+    """
+
+    def __init__(self, max_workers=None, max_pending=32, max_finished=1000, initializer=None):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.max_finished = max_finished
+        self.initializer = initializer
+        self._executor = None
+        self._jobs = OrderedDict()
+        self._futures = {}
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        # Created lazily so importing the app never forks worker processes
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers, initializer=self.initializer)
+            return self._executor
+
+    def _replace_executor(self, executor):
+        """Drop a broken pool; the next submit starts a new one"""
+        with self._lock:
+            if self._executor is not executor:
+                return   # Already replaced (every job of a broken pool reports it)
+            self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def submit(self, fn, *args, on_done=None):
+        """Queue `fn(*args)` and return the new job id"""
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise QueueFullError(f'OCR queue is full ({self.max_pending} jobs pending)')
+            self._pending += 1
+            job_id = uuid.uuid4().hex
+            self._jobs[job_id] = {
+                'job_id': job_id,
+                'status': 'queued',
+                'submitted_at': datetime.now().isoformat()
+            }
+
+        try:
+            executor = self._get_executor()
+            try:
+                future = executor.submit(fn, *args)
+            except BrokenProcessPool:
+                self._replace_executor(executor)
+                executor = self._get_executor()
+                future = executor.submit(fn, *args)
+        except Exception as e:
+            with self._lock:
+                self._pending -= 1
+                del self._jobs[job_id]
+            if isinstance(e, (BrokenProcessPool, OSError)):
+                raise WorkerPoolError(f'OCR worker pool is unavailable: {e}') from e
+            raise
+
+        with self._lock:
+            self._futures[job_id] = future
+        future.add_done_callback(lambda f: self._finish(job_id, f, on_done, executor))
+        return job_id
+
+    def _finish(self, job_id, future, on_done, executor=None):
+        try:
+            result = future.result()
+        except BrokenProcessPool:
+            if executor is not None:
+                self._replace_executor(executor)
+            result = {'error': 'OCR worker process died'}
+        except Exception as e:
+            result = {'error': str(e) or type(e).__name__}
+
+        try:
+            if on_done is not None:
+                result = on_done(result)
+            update = {'status': 'done', 'result': result}
+            if isinstance(result, dict) and 'error' in result:
+                update = {'status': 'failed', 'error': result['error']}
+        except Exception as e:
+            update = {'status': 'failed', 'error': str(e)}
+
+        update['finished_at'] = datetime.now().isoformat()
+        with self._lock:
+            self._pending -= 1
+            self._futures.pop(job_id, None)
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job.update(update)
+                self._jobs.move_to_end(job_id)
+            self._evict_finished()
+
+    def _evict_finished(self):
+        finished = [jid for jid, job in self._jobs.items() if job['status'] in ('done', 'failed')]
+        for jid in finished[:max(0, len(finished) - self.max_finished)]:
+            del self._jobs[jid]
+
+    def get(self, job_id):
+        """Return a snapshot of the job, or None if it is unknown"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            job = dict(job)
+            future = self._futures.get(job_id)
+        if job['status'] == 'queued' and future is not None and future.running():
+            job['status'] = 'running'
+        return job
+
+    def stats(self):
+        """Return queue depth and job counts"""
+        with self._lock:
+            counts = {}
+            for job in self._jobs.values():
+                counts[job['status']] = counts.get(job['status'], 0) + 1
+            return {
+                'pending': self._pending,
+                'max_pending': self.max_pending,
+                'workers': self.max_workers,
+                'jobs': counts
+            }
+
+    def shutdown(self, wait=True):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+            self._executor = None
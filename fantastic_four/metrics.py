@@ -0,0 +1,174 @@
+"""Stage timings, latency histograms and counters in Prometheus text format"""
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_collector = contextvars.ContextVar('stage_timings', default=None)
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(f'{n}="{_escape(v)}"' for n, v in zip(names, values))
+    return '{' + pairs + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[n]) for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_labels(self.labelnames, key)} {_number(value)}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}   # label values -> [count per bucket..., count above the last, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[n]) for n in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = {key: list(values) for key, values in self._series.items()}
+        for key, values in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), values[:-1]):
+                cumulative += count
+                labels = _labels(self.labelnames + ('le',), key + (_number(bound),))
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _labels(self.labelnames, key)
+            lines.append(f'{self.name}_sum{labels} {_number(values[-1])}')
+            lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+class Gauge:
+    """A value read from `fn()` at scrape time"""
+
+    def __init__(self, name, help_text, fn):
+        self.name = name
+        self.help = help_text
+        self.fn = fn
+
+    def render(self):
+        return [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} gauge', f'{self.name} {_number(self.fn())}']
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, labelnames=()):
+        return self.register(Counter(name, help_text, labelnames))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help_text, labelnames, buckets))
+
+    def gauge(self, name, help_text, fn):
+        return self.register(Gauge(name, help_text, fn))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+STAGE_SECONDS = REGISTRY.histogram('rx_stage_seconds', 'Time spent in each processing stage', ['stage'])
+REQUEST_SECONDS = REGISTRY.histogram(
+    'rx_request_seconds', 'HTTP request latency', ['method', 'endpoint', 'status']
+)
+
+
+def start():
+    """Begin collecting stage timings in this context; returns (timings, token for stop)"""
+    timings = []
+    return timings, _collector.set(timings)
+
+
+def stop(token):
+    _collector.reset(token)
+
+
+@contextmanager
+def collect():
+    """Gather stage timings inside the block into a list of (stage, seconds)"""
+    timings, token = start()
+    try:
+        yield timings
+    finally:
+        stop(token)
+
+
+def record(timings):
+    """Add timings to the enclosing collector, or straight to STAGE_SECONDS outside one"""
+    collector = _collector.get()
+    if collector is not None:
+        collector.extend(timings)
+        return
+    for name, seconds in timings:
+        STAGE_SECONDS.observe(seconds, stage=name)
+
+
+@contextmanager
+def stage(name):
+    """Time a block as one stage"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record([(name, time.perf_counter() - started)])
+
+
+def server_timing(timings):
+    """Server-Timing header value; repeated stages are summed"""
+    totals = {}
+    for name, seconds in timings:
+        totals[name] = totals.get(name, 0) + seconds
+    return ', '.join(f'{name};dur={seconds * 1000:.1f}' for name, seconds in totals.items())
@@ -0,0 +1,308 @@
+"""OCR engine backends"""
+import logging
+import multiprocessing
+import os
+import queue
+import re
+import threading
+
+import pytesseract
+from PIL import Image
+
+from forksafe import PerProcess
+
+try:
+    import tesserocr
+except ImportError:  # Optional: pytesseract is the fallback backend
+    tesserocr = None
+
+logger = logging.getLogger(__name__)
+
+
+class OCRBackendError(Exception):
+    """Raised when an OCR engine fails to process an image"""
+
+
+def mean_confidence(confidences):
+    """Mean word confidence (0-100), ignoring tesseract's -1 for non-word boxes"""
+    values = [float(c) for c in confidences if float(c) >= 0]
+    return sum(values) / len(values) if values else 0.0
+
+
+def data_to_text(data):
+    """Rebuild line-broken text from pytesseract.image_to_data output"""
+    lines = []
+    current_key, current_words = None, []
+    for i, word in enumerate(data['text']):
+        key = (data['block_num'][i], data['par_num'][i], data['line_num'][i])
+        if key != current_key:
+            if current_words:
+                lines.append(' '.join(current_words))
+            if current_key is not None and key[:2] != current_key[:2]:
+                lines.append('')
+            current_key, current_words = key, []
+        if word and word.strip():
+            current_words.append(word.strip())
+    if current_words:
+        lines.append(' '.join(current_words))
+    return '\n'.join(lines)
+
+
+def parse_tesseract_config(config):
+    """Pull --psm/--oem out of a tesseract CLI config string"""
+    psm = re.search(r'--psm\s+(\d+)', config or '')
+    oem = re.search(r'--oem\s+(\d+)', config or '')
+    return {
+        'psm': int(psm.group(1)) if psm else 3,
+        'oem': int(oem.group(1)) if oem else 3
+    }
+
+
+class PytesseractBackend:
+    """Runs the tesseract binary once per image (the original behaviour)"""
+
+    name = 'pytesseract'
+    engine = 'tesseract-cli'
+
+    def __init__(self, nice=0):
+        self.nice = nice   # Added to the niceness of each tesseract process
+
+    def image_to_string(self, img, config=''):
+        return pytesseract.image_to_string(img, config=config, nice=self.nice)
+
+    def image_to_data(self, img, config=''):
+        """Return (text, mean word confidence)"""
+        data = pytesseract.image_to_data(img, config=config, nice=self.nice, output_type=pytesseract.Output.DICT)
+        words = [c for c, w in zip(data['conf'], data['text']) if w and w.strip()]
+        return data_to_text(data), mean_confidence(words)
+
+    def warm_up(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class TesserocrBackend:
+    """A single in-process engine; meant for processes that OCR one image at a time"""
+
+    name = 'tesserocr'
+    engine = 'libtesseract'
+
+    def __init__(self, lang='eng'):
+        self.lang = lang
+        self._api = None
+        self._lock = threading.Lock()
+
+    def image_to_string(self, img, config=''):
+        return self._run(img, config, False)
+
+    def image_to_data(self, img, config=''):
+        """Return (text, mean word confidence)"""
+        return self._run(img, config, True)
+
+    def _run(self, img, config, with_confidence):
+        options = parse_tesseract_config(config)
+        with self._lock:
+            if self._api is None:
+                self._api = tesserocr.PyTessBaseAPI(lang=self.lang, oem=options['oem'])
+            return _run_engine(self._api, img, options['psm'], with_confidence)
+
+    def warm_up(self):
+        self.image_to_string(Image.new('L', (32, 32), 255))
+
+    def close(self):
+        with self._lock:
+            if self._api is not None:
+                self._api.End()
+                self._api = None
+
+
+def _run_engine(api, img, psm, with_confidence=False):
+    if img.mode == '1':
+        img = img.convert('L')
+    api.SetPageSegMode(psm)
+    api.SetImage(img)
+    text = api.GetUTF8Text()
+    if with_confidence:
+        return text, mean_confidence(api.AllWordConfidences())
+    return text
+
+
+def lower_priority(nice):
+    """Add `nice` to this process's niceness, so OCR yields the CPU to request handling"""
+    if nice and hasattr(os, 'nice'):
+        os.nice(nice)
+
+
+def _engine_worker(conn, lang, oem, nice=0):
+    """Engine process: keeps one initialized API and OCRs images sent over the pipe"""
+    lower_priority(nice)
+    api = tesserocr.PyTessBaseAPI(lang=lang, oem=oem)
+    try:
+        while True:
+            message = conn.recv()
+            if message is None:
+                break
+            mode, size, data, psm, with_confidence = message
+            try:
+                conn.send(('ok', _run_engine(api, Image.frombytes(mode, size, data), psm, with_confidence)))
+            except Exception as e:
+                conn.send(('error', str(e)))
+    except (EOFError, KeyboardInterrupt):
+        pass
+    finally:
+        api.End()
+
+
+class TesserocrPoolBackend:
+    """
+    Pool of long-lived engine processes.
+
+    Each process loads the language model once and then receives raw image
+    bytes over a pipe, so there is no fork/exec, temp file or model reload
+    per image. Any engine failure falls back to pytesseract for that call.
+    """
+
+    name = 'tesserocr-pool'
+    engine = 'libtesseract'
+
+    def __init__(self, size=2, lang='eng', oem=3, timeout=60, nice=0):
+        self.size = size
+        self.lang = lang
+        self.oem = oem
+        self.timeout = timeout
+        self.nice = nice
+        self.fallback = PytesseractBackend(nice)
+        self._idle = queue.Queue()
+        self._workers = []
+        self._lock = threading.Lock()
+
+    def _spawn(self):
+        parent_conn, child_conn = multiprocessing.Pipe()
+        process = multiprocessing.Process(
+            target=_engine_worker, args=(child_conn, self.lang, self.oem, self.nice), daemon=True
+        )
+        process.start()
+        child_conn.close()
+        return process, parent_conn
+
+    def _start(self):
+        with self._lock:
+            while len(self._workers) < self.size:
+                worker = self._spawn()
+                self._workers.append(worker)
+                self._idle.put(worker)
+
+    def image_to_string(self, img, config=''):
+        return self._run(img, config, False)
+
+    def image_to_data(self, img, config=''):
+        """Return (text, mean word confidence)"""
+        return self._run(img, config, True)
+
+    def _run(self, img, config, with_confidence):
+        self._start()
+        psm = parse_tesseract_config(config)['psm']
+        fallback = self.fallback.image_to_data if with_confidence else self.fallback.image_to_string
+        try:
+            worker = self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            return fallback(img, config)
+
+        process, conn = worker
+        try:
+            conn.send((img.mode, img.size, img.tobytes(), psm, with_confidence))
+            if not conn.poll(self.timeout):
+                raise OCRBackendError('OCR engine timed out')
+            status, result = conn.recv()
+            if status != 'ok':
+                raise OCRBackendError(result)
+        except (OSError, EOFError, OCRBackendError):
+            worker = self._replace(worker)
+            return fallback(img, config)
+        finally:
+            self._idle.put(worker)
+        return result
+
+    def _replace(self, worker):
+        process, conn = worker
+        process.kill()
+        conn.close()
+        fresh = self._spawn()
+        with self._lock:
+            self._workers = [w for w in self._workers if w is not worker] + [fresh]
+        return fresh
+
+    def warm_up(self):
+        """Start every engine and push a blank image through each of them"""
+        self._start()
+        blank = Image.new('L', (32, 32), 255)
+        for _ in range(self.size):
+            self.image_to_string(blank)
+
+    def close(self):
+        with self._lock:
+            for process, conn in self._workers:
+                try:
+                    conn.send(None)
+                except OSError:
+                    pass
+                process.join(timeout=1)
+                if process.is_alive():
+                    process.kill()
+                conn.close()
+            self._workers = []
+            self._idle = queue.Queue()
+
+
+_settings = {'backend': 'auto', 'workers': 2, 'lang': 'eng', 'nice': 0}
+# A backend inherited through fork shares pipes with the parent's engines, so each process builds its own
+_backend = PerProcess(lambda: create_backend(_settings['backend'], _settings['workers'], _settings['lang'],
+                                             _settings['nice']))
+
+
+def configure(backend='auto', workers=2, lang='eng', nice=0):
+    """
+    Choose the OCR backend: 'auto', 'tesserocr-pool', 'tesserocr' or 'pytesseract'.
+    OCR processes it starts run `nice` steps below normal CPU priority.
+    """
+    _settings.update(backend=backend, workers=workers, lang=lang, nice=nice)
+    previous = _backend.reset()
+    if previous is not None:
+        previous.close()
+
+
+def create_backend(name, workers=2, lang='eng', nice=0):
+    """Build a backend by name; tesserocr backends need the optional tesserocr package"""
+    if name == 'auto':
+        if tesserocr is None:
+            name = 'pytesseract'
+        else:
+            name = 'tesserocr-pool' if workers > 0 else 'tesserocr'
+    if name in ('tesserocr', 'tesserocr-pool') and tesserocr is None:
+        logger.warning("OCR backend '%s' needs tesserocr, falling back to pytesseract", name)
+        name = 'pytesseract'
+    if name == 'tesserocr-pool':
+        return TesserocrPoolBackend(size=max(1, workers), lang=lang, nice=nice)
+    if name == 'tesserocr':
+        return TesserocrBackend(lang=lang)
+    return PytesseractBackend(nice)
+
+
+def get_backend():
+    """Return this process's OCR backend, creating it on first use"""
+    return _backend.get()
+
+
+def init_worker_process():
+    """
+    ProcessPoolExecutor initializer: one job at a time needs one in-process
+    engine, and the whole process runs at the OCR priority.
+    """
+    lower_priority(_settings['nice'])
+    backend = _settings['backend']
+    if tesserocr is not None and backend in ('auto', 'tesserocr-pool'):
+        backend = 'tesserocr'
+    # Already lowered: tesseract processes started from here inherit it
+    configure(backend, _settings['workers'], _settings['lang'], nice=0)
@@ -0,0 +1,155 @@
+"""Content-addressed cache for raw OCR text"""
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class OCRCache:
+    """
+    Two-tier cache of OCR text keyed on the image bytes and OCR parameters.
+
+    The memory tier is an LRU bounded by total text size. The disk tier keeps
+    one file per key under `directory` and evicts the least recently used
+    files once it grows past `max_disk_bytes`.
+    """
+
+    def __init__(self, directory, max_memory_bytes=16 * 1024 * 1024, max_disk_bytes=256 * 1024 * 1024):
+        self.directory = directory
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._disk_bytes = None
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def make_key(image_bytes, params):
+        """SHA-256 of the image plus the parameters that affect the OCR output"""
+        digest = hashlib.sha256(image_bytes)
+        digest.update(json.dumps(params, sort_keys=True).encode('utf-8'))
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.txt")
+
+    def get(self, key):
+        """Return cached text for `key`, or None on a miss"""
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return self._memory[key]
+
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                text = f.read()
+            os.utime(path)  # Keeps the disk tier in LRU order
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.disk_hits += 1
+            self._remember(key, text)
+        return text
+
+    def put(self, key, text):
+        """Store `text` in both tiers (best effort: disk errors are logged, not raised)"""
+        with self._lock:
+            self._remember(key, text)
+
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(text)
+            try:
+                old_size = os.path.getsize(path)
+            except OSError:
+                old_size = 0
+            os.replace(tmp_path, path)
+
+            with self._lock:
+                if self._disk_bytes is None:
+                    self._disk_bytes = self._scan_disk_bytes()
+                else:
+                    self._disk_bytes += os.path.getsize(path) - old_size
+                if self._disk_bytes > self.max_disk_bytes:
+                    self._evict_disk()
+        except OSError as e:
+            logger.warning('Could not write OCR cache entry %s: %s', key, e)
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+    def _remember(self, key, text):
+        size = len(text)
+        if size > self.max_memory_bytes:
+            return
+        if key in self._memory:
+            self._memory_bytes -= len(self._memory.pop(key))
+        self._memory[key] = text
+        self._memory_bytes += size
+        while self._memory_bytes > self.max_memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+            self.evictions += 1
+
+    def _disk_entries(self):
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith('.txt'):
+                    path = os.path.join(root, name)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    yield path, st.st_size, st.st_mtime
+
+    def _scan_disk_bytes(self):
+        return sum(size for _, size, _ in self._disk_entries())
+
+    def _evict_disk(self):
+        # Trim to 90% so a full cache doesn't rescan the directory on every put
+        target = int(self.max_disk_bytes * 0.9)
+        entries = sorted(self._disk_entries(), key=lambda e: e[2])
+        total = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            self.evictions += 1
+        self._disk_bytes = total
+
+    def stats(self):
+        """Return hit/miss counters and tier sizes"""
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': round((self.memory_hits + self.disk_hits) / lookups, 3) if lookups else 0,
+                'evictions': self.evictions,
+                'memory_entries': len(self._memory),
+                'memory_bytes': self._memory_bytes,
+                'disk_bytes': self._disk_bytes
+            }
@@ -0,0 +1,361 @@
+"""
+Prescription text parser.
+
+All patterns are compiled once at import. The text is tokenized in one pass:
+lines are split and classified once for the medicine scan, and a single
+keyword scan records where header fields (patient, age, doctor, hospital,
+diagnosis, advice) can start, so their patterns are only tried at those
+positions instead of re-scanning the whole text per field. Output is
+identical to the original regex cascade (see benchmarks/parser_corpus).
+"""
+import re
+
+from metrics import stage
+
+# Words that look like medicine names but aren't
+EXCLUDE_WORDS = frozenset({
+    'dr', 'doctor', 'patient', 'name', 'age', 'date', 'prescription',
+    'diagnosis', 'advice', 'signature', 'hospital', 'clinic', 'medical',
+    'tel', 'phone', 'address', 'email', 'reg', 'registration', 'no', 'number',
+    'mbbs', 'md', 'ms', 'dnb', 'mrcp', 'frcs', 'speciality', 'consultant',
+    'follow', 'next', 'visit', 'review', 'tests', 'investigations', 'rxs',
+    'dear', 'sir', 'madam', 'regards', 'sincerely', 'yours', 'faithfully'
+})
+
+# Medicine list
+NUMBER_PREFIX = re.compile(r'^\d+[\.\)]')
+NUMBERED_ITEM = re.compile(r'^(\d+)[\.\)]\s*(.+)$')
+MEDICINE_NAME = re.compile(r'^([A-Z][a-zA-Z]+(?:\s+[A-Z]?[a-z]+)?)')
+MAX_BLOCK_LINES = 8
+
+# Per-medicine details
+DURATION_PATTERNS = [
+    re.compile(r'[Ff]or\s+(\d+)\s*([Dd]ays?|[Oo]ays?|weeks?|months?)', re.IGNORECASE),  # For 3 days, For 3 Oays
+    re.compile(r'(\d+)\s*([Dd]ays?|[Oo]ays?|weeks?|months?)', re.IGNORECASE),  # 3 days, 3 Oays
+    re.compile(r'[Dd]uration\s*:?\s*(\d+)\s*([Dd]ays?|weeks?|months?)', re.IGNORECASE),  # Duration: 3 days
+]
+DOSAGE = re.compile(r'(\d+\.?\d*\s*(?:mg|ml|g|mcg|tab|tablets?|cap|capsules?))', re.IGNORECASE)
+FREQ_TIME_OF_DAY = re.compile(r'([Oo]nce)\s+(?:at|in|before|after)?\s*(night|evening|morning|afternoon|bedtime)', re.IGNORECASE)
+FREQ_PER_DAY = re.compile(r'((?:[Oo]nce|[Tt]wice|[Tt]hrice|\d+\s*times?)\s*(?:daily|per day|a day))', re.IGNORECASE)
+FREQ_DASHED = re.compile(r'(\d+\s*-\s*\d+\s*-\s*\d+)')
+FREQ_ABBREVIATION = re.compile(r'\b(OD|BD|TDS|QID)\b', re.IGNORECASE)
+BEFORE_FOOD = re.compile(r'[Bb]efore\s+(?:food|meal|breakfast|lunch|dinner)', re.IGNORECASE)
+AFTER_FOOD = re.compile(r'[Aa]fter\s+(?:food|meal|breakfast|lunch|dinner)', re.IGNORECASE)
+EMPTY_STOMACH = re.compile(r'empty\s+stomach', re.IGNORECASE)
+
+# Header fields
+PATIENT_NAME = re.compile(r'(?i)(?:patient|name)\s*[:\-]?\s*([A-Za-z\s.]+?)(?:\n|age|$)')
+PATIENT_AGE = re.compile(r'(?i)age\s*[:\-]?\s*(\d+)')
+DOCTOR_NAME = re.compile(r'(?i)dr\.?\s+([A-Z][a-z]+(?:\s+[A-Z][a-z]+){1,2})')
+HOSPITAL_PATTERNS = [
+    re.compile(r'(?i)([A-Z][a-zA-Z\s]+(?:hospital|clinic|medical center|healthcare))'),
+    re.compile(r'(?i)(?:hospital|clinic|medical center|healthcare)[:\s]+([A-Z][a-zA-Z\s]+)')
+]
+DATE_PATTERNS = [
+    re.compile(r'\d{1,2}[/-]\d{1,2}[/-]\d{2,4}', re.IGNORECASE),
+    re.compile(r'\d{1,2}\s+(?:Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)[a-z]*\s+\d{4}', re.IGNORECASE)
+]
+DIAGNOSIS = re.compile(r'(?i)(?:diagnosis|dx|diagnosed with)[:\s]+([^\n.]+)')
+ADVICE = re.compile(r'(?i)(?:advice|recommendation)[:\s]+([^\n.]+)')
+
+# One zero-width scan finds every position where a header keyword starts.
+# No keyword is a prefix of another, so each position belongs to one group.
+# The leading first-letter class lets most positions fail fast.
+HEADER_KEYWORDS = re.compile(
+    r'(?i)(?=[pnadhcmr])(?=(?P<name>patient|name)|(?P<age>age)|(?P<doctor>dr)'
+    r'|(?P<hospital>hospital|clinic|medical center|healthcare)'
+    r'|(?P<diagnosis>diagnosis|dx|diagnosed with)|(?P<advice>advice|recommendation))'
+)
+
+
+def scan_header_keywords(text):
+    """Map each header field to the positions where its keywords start"""
+    positions = {'name': [], 'age': [], 'doctor': [], 'hospital': [], 'diagnosis': [], 'advice': []}
+    for match in HEADER_KEYWORDS.finditer(text):
+        positions[match.lastgroup].append(match.start())
+    return positions
+
+
+def _first_match(pattern, text, candidates):
+    """Same result as pattern.search(text) when every match starts at a candidate"""
+    for pos in candidates:
+        match = pattern.match(text, pos)
+        if match:
+            return match
+    return None
+
+
+def extract_patient_info(text, keywords=None):
+    """Extract patient name and age from text"""
+    keywords = keywords or scan_header_keywords(text)
+    name_match = _first_match(PATIENT_NAME, text, keywords['name'])
+    age_match = _first_match(PATIENT_AGE, text, keywords['age'])
+
+    return {
+        'name': name_match.group(1).strip() if name_match else '',
+        'age': age_match.group(1) if age_match else ''
+    }
+
+
+def extract_medicines_structured(text):
+    """
+    Extract medicines with complete context using block parsing.
+    This groups all lines related to each medicine together.
+    """
+    medicines = []
+    seen = set()
+
+    # Tokenize once: stripped line + whether it starts a numbered item
+    lines = [line.strip() for line in text.split('\n')]
+    numbered = [NUMBER_PREFIX.match(line) is not None for line in lines]
+
+    for i, line in enumerate(lines):
+        # Look for numbered medicine items (1. Medicine, 2. Medicine)
+        if not numbered[i]:
+            continue
+        match = NUMBERED_ITEM.match(line)
+        if not match:
+            continue
+
+        rest_of_first_line = match.group(2).strip()
+        med_name_match = MEDICINE_NAME.match(rest_of_first_line)
+        if not med_name_match:
+            continue
+
+        med_name = med_name_match.group(1).strip()
+        if len(med_name) < 3 or med_name.lower() in EXCLUDE_WORDS:
+            continue
+
+        # Collect related lines until the next numbered item, a blank line or the signature
+        medicine_block = [rest_of_first_line]
+        for j in range(i + 1, min(len(lines), i + MAX_BLOCK_LINES)):
+            next_line = lines[j]
+            if numbered[j] or not next_line or 'signature' in next_line.lower():
+                break
+            medicine_block.append(next_line)
+
+        # Duplicates are dropped by name, keeping the first occurrence
+        key = med_name.lower()
+        if key in seen:
+            continue
+        seen.add(key)
+
+        full_medicine_text = ' '.join(medicine_block)
+        frequency = extract_frequency_from_text(full_medicine_text)
+        medicines.append({
+            'name': med_name,
+            'dosage': extract_dosage_from_text(full_medicine_text),
+            'frequency': frequency,
+            'timing': parse_timing_from_frequency(frequency),
+            'duration': extract_duration_from_block(full_medicine_text),
+            'instructions': extract_instructions_from_text(full_medicine_text)
+        })
+
+    return medicines
+
+
+def snap_medicine_names(medicines, lexicon):
+    """
+    Replace each medicine name with its canonical lexicon entry.
+
+    The match is recorded under `name_match` so corrections can be reviewed.
+    Low-confidence matches are only recorded: the parsed name is kept. Entries
+    are deduplicated on the final name, so OCR variants of one drug that snap
+    to the same entry keep only the first (their dose ids would collide).
+    """
+    snapped = []
+    seen = set()
+    for med in medicines:
+        key = ' '.join(med['name'].lower().split())
+        if key in seen:
+            continue
+        seen.add(key)
+        match = lexicon.match_medicine(med['name'])
+        if match is not None:
+            med['name_match'] = {
+                'raw': med['name'],
+                'canonical': match.canonical,
+                'distance': match.distance,
+                'low_confidence': match.low_confidence
+            }
+            if not match.low_confidence:
+                med['name'] = match.canonical
+                key = match.canonical.lower()
+                if key in seen:
+                    continue
+                seen.add(key)
+        snapped.append(med)
+    return snapped
+
+
+def extract_duration_from_block(text):
+    """
+    Extract duration from a complete medicine block.
+    Tries multiple patterns to catch all variations.
+    """
+    # Remove extra spaces and normalize
+    text = ' '.join(text.split())
+
+    for pattern in DURATION_PATTERNS:
+        match = pattern.search(text)
+        if match:
+            number = match.group(1)
+            unit = match.group(2).lower()
+
+            # Normalize "oays" to "days" (common OCR mistake)
+            if 'oay' in unit:
+                unit = 'days'
+
+            return f"{number} {unit}"
+
+    return '7 days'
+
+
+def extract_dosage_from_text(text):
+    """Extract dosage information"""
+    dosage_match = DOSAGE.search(text)
+    return dosage_match.group(1) if dosage_match else 'As directed'
+
+
+def extract_frequency_from_text(text):
+    """Extract frequency (e.g., 1-0-1, twice daily, once at night)"""
+    # Pattern for "once at night", "once in morning", etc
+    specific_time_pattern = FREQ_TIME_OF_DAY.search(text)
+    if specific_time_pattern:
+        time_of_day = specific_time_pattern.group(2).lower()
+        return f"Once at {time_of_day}"
+
+    # Pattern for "twice daily", "once daily", etc
+    freq_pattern = FREQ_PER_DAY.search(text)
+    if freq_pattern:
+        return freq_pattern.group(1)
+
+    # Pattern for 1-0-1 style
+    freq_pattern1 = FREQ_DASHED.search(text)
+    if freq_pattern1:
+        return freq_pattern1.group(1)
+
+    # Pattern for "BD", "TDS", "QID", "OD"
+    freq_pattern3 = FREQ_ABBREVIATION.search(text)
+    if freq_pattern3:
+        return freq_pattern3.group(1).upper()
+
+    return 'As directed'
+
+
+def extract_instructions_from_text(text):
+    """Extract special instructions"""
+    instructions = []
+
+    if BEFORE_FOOD.search(text):
+        instructions.append('Before food')
+    elif AFTER_FOOD.search(text):
+        instructions.append('After food')
+
+    if EMPTY_STOMACH.search(text):
+        instructions.append('On empty stomach')
+
+    return ', '.join(instructions) if instructions else 'Take as prescribed'
+
+
+def parse_timing_from_frequency(frequency):
+    """Convert frequency to timing array"""
+    freq_lower = frequency.lower()
+
+    # Check for specific time mentions
+    if 'night' in freq_lower or 'evening' in freq_lower or 'bedtime' in freq_lower:
+        return ['21:00']
+    elif 'morning' in freq_lower:
+        return ['09:00']
+    elif 'afternoon' in freq_lower:
+        return ['14:00']
+    # Once daily or OD (default to morning)
+    elif 'once' in freq_lower or freq_lower == 'od':
+        return ['09:00']
+    # Twice daily or BD
+    elif 'twice' in freq_lower or freq_lower == 'bd' or '1-0-1' in freq_lower:
+        return ['09:00', '21:00']
+    # Three times or TDS
+    elif 'thrice' in freq_lower or 'three times' in freq_lower or freq_lower == 'tds' or '1-1-1' in freq_lower:
+        return ['09:00', '14:00', '21:00']
+    # Four times or QID
+    elif 'four times' in freq_lower or freq_lower == 'qid' or '1-1-1-1' in freq_lower:
+        return ['08:00', '13:00', '18:00', '22:00']
+    else:
+        return ['09:00']  # Default to once daily in morning
+
+
+def extract_doctor_name(text, keywords=None):
+    """Extract doctor's name"""
+    keywords = keywords or scan_header_keywords(text)
+    match = _first_match(DOCTOR_NAME, text, keywords['doctor'])
+    return match.group(0) if match else ''
+
+
+def extract_hospital_name(text, keywords=None):
+    """Extract hospital/clinic name"""
+    keywords = keywords or scan_header_keywords(text)
+    # Both patterns need a hospital keyword somewhere in the text
+    if not keywords['hospital']:
+        return ''
+
+    match = HOSPITAL_PATTERNS[0].search(text)
+    if not match:
+        match = _first_match(HOSPITAL_PATTERNS[1], text, keywords['hospital'])
+    return match.group(1).strip() if match else ''
+
+
+def extract_date(text):
+    """Extract date from text"""
+    for pattern in DATE_PATTERNS:
+        match = pattern.search(text)
+        if match:
+            return match.group(0)
+    return None
+
+
+def extract_diagnosis(text, keywords=None):
+    """Extract diagnosis information"""
+    keywords = keywords or scan_header_keywords(text)
+    diagnosis_match = _first_match(DIAGNOSIS, text, keywords['diagnosis'])
+    return diagnosis_match.group(1).strip() if diagnosis_match else ''
+
+
+def extract_advice(text, keywords=None):
+    """Extract doctor's advice"""
+    keywords = keywords or scan_header_keywords(text)
+    advice = []
+    end = 0
+    # Same as ADVICE.findall: non-overlapping matches, left to right
+    for pos in keywords['advice']:
+        if pos < end:
+            continue
+        match = ADVICE.match(text, pos)
+        if match:
+            advice.append(match.group(1))
+            end = match.end()
+    return [a.strip() for a in advice if a.strip()]
+
+
+def parse_prescription_text(text, default_date=None, lexicon=None):
+    """Parse every structured field out of OCR text, snapping medicine names to `lexicon` if given"""
+    with stage('parse_header'):
+        keywords = scan_header_keywords(text)
+        patient_info = extract_patient_info(text, keywords)
+    with stage('parse_medicines'):
+        medicines = extract_medicines_structured(text)
+    if lexicon is not None:
+        with stage('lexicon'):
+            medicines = snap_medicine_names(medicines, lexicon)
+
+    with stage('parse_fields'):
+        return {
+            'medicines': medicines,
+            'doctor_name': extract_doctor_name(text, keywords),
+            'hospital': extract_hospital_name(text, keywords),
+            'date': extract_date(text) or default_date,
+            'patient_name': patient_info.get('name', ''),
+            'patient_age': patient_info.get('age', ''),
+            'diagnosis': extract_diagnosis(text, keywords),
+            'advice': extract_advice(text, keywords)
+        }
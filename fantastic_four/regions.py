@@ -0,0 +1,151 @@
+"""Split a page into text regions and OCR them in parallel"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+from forksafe import PerProcess
+
+MIN_GAP_FRACTION = 0.012     # Blank rows (as a share of page height) that separate bands
+COLUMN_GAP_FRACTION = 0.08   # Blank columns (as a share of width) that separate columns
+MIN_COLUMN_FRACTION = 0.25   # Each side of a column split must be at least this wide
+ROW_INK = 0.004              # A row/column with less ink than this counts as blank
+MAX_REGIONS = 8              # Bands are merged across the smallest gaps down to this count
+PADDING = 6
+HEADER_FRACTION = 0.18       # rx_only: bands entirely above this are letterhead
+FOOTER_FRACTION = 0.88       # rx_only: bands entirely below this are signature/footer
+MAX_INK_DENSITY = 0.35       # rx_only: denser bands are logos, stamps or photos
+
+
+def _new_executor(max_workers):
+    return ThreadPoolExecutor(max_workers=max_workers or os.cpu_count() or 1, thread_name_prefix='region-ocr')
+
+
+_executor = PerProcess(_new_executor)
+
+
+def _ink_profile(gray, axis):
+    """Share of ink (dark pixels) per row (axis=0) or column (axis=1)"""
+    if axis == 0:
+        means = gray.resize((1, gray.height), Image.BOX).tobytes()
+    else:
+        means = gray.resize((gray.width, 1), Image.BOX).tobytes()
+    return [1 - m / 255 for m in means]
+
+
+def _runs(profile, min_gap):
+    """(start, end) of inked runs separated by at least `min_gap` blank entries"""
+    runs = []
+    start = None
+    blank = 0
+    for i, ink in enumerate(profile):
+        if ink > ROW_INK:
+            if start is None:
+                start = i
+            blank = 0
+        elif start is not None:
+            blank += 1
+            if blank >= min_gap:
+                runs.append((start, i - blank + 1))
+                start = None
+                blank = 0
+    if start is not None:
+        runs.append((start, len(profile) - blank))
+    return runs
+
+
+def _merge_smallest_gaps(bands, max_regions):
+    bands = list(bands)
+    while len(bands) > max_regions:
+        gaps = [bands[i + 1][0] - bands[i][1] for i in range(len(bands) - 1)]
+        i = gaps.index(min(gaps))
+        bands[i:i + 2] = [(bands[i][0], bands[i + 1][1])]
+    return bands
+
+
+def _columns(gray, top, bottom):
+    """
+    Split a band at a wide central gutter into left and right columns.
+
+    Both sides must be at least MIN_COLUMN_FRACTION wide, so tabular Rx rows
+    (name | dose | duration) stay together on one line.
+    """
+    band = gray.crop((0, top, gray.width, bottom))
+    runs = _runs(_ink_profile(band, 1), max(2, int(gray.width * COLUMN_GAP_FRACTION)))
+    if not runs:
+        return [(0, gray.width)]
+    gutters = [
+        (runs[i][1], runs[i + 1][0]) for i in range(len(runs) - 1)
+        if runs[i][1] - runs[0][0] >= gray.width * MIN_COLUMN_FRACTION
+        and runs[-1][1] - runs[i + 1][0] >= gray.width * MIN_COLUMN_FRACTION
+    ]
+    if not gutters:
+        return [(runs[0][0], runs[-1][1])]
+    left, right = max(gutters, key=lambda g: g[1] - g[0])
+    return [(runs[0][0], left), (right, runs[-1][1])]
+
+
+def find_regions(img, max_regions=MAX_REGIONS, rx_only=False):
+    """
+    Return crop boxes in reading order: bands top to bottom, columns left to right.
+
+    With `rx_only`, letterhead and signature bands and image-like bands are
+    dropped, since they can't hold the medicine list.
+    """
+    gray = img.convert('L') if img.mode != 'L' else img
+    width, height = gray.size
+    min_gap = max(2, int(height * MIN_GAP_FRACTION))
+    profile = _ink_profile(gray, 0)
+    bands = _merge_smallest_gaps(_runs(profile, min_gap), max_regions)
+
+    if rx_only and len(bands) > 1:
+        kept = []
+        for top, bottom in bands:
+            density = sum(profile[top:bottom]) / max(1, bottom - top)
+            if bottom <= height * HEADER_FRACTION or top >= height * FOOTER_FRACTION:
+                continue
+            if density > MAX_INK_DENSITY:
+                continue
+            kept.append((top, bottom))
+        bands = kept or bands
+
+    boxes = []
+    for top, bottom in bands:
+        top = max(0, top - PADDING)
+        bottom = min(height, bottom + PADDING)
+        for left, right in _columns(gray, top, bottom):
+            boxes.append((max(0, left - PADDING), top, min(width, right + PADDING), bottom))
+    return boxes
+
+
+def rx_box(img):
+    """One box around every region that can hold the medicine list (see find_regions)"""
+    boxes = find_regions(img, rx_only=True)
+    if not boxes:
+        return None
+    return (min(b[0] for b in boxes), min(b[1] for b in boxes),
+            max(b[2] for b in boxes), max(b[3] for b in boxes))
+
+
+def get_executor(max_workers=None):
+    """Shared thread pool for region OCR (one per process, sized by the first caller)"""
+    return _executor.get(max_workers)
+
+
+def ocr_regions(img, backend, config='', rx_only=False, max_workers=None):
+    """
+    OCR each region in parallel and stitch the text back in reading order.
+    With `max_workers=1` the regions are OCR'd one after another in the calling thread.
+    """
+    boxes = find_regions(img, rx_only=rx_only)
+    if len(boxes) <= 1:
+        box = boxes[0] if boxes else None
+        return backend.image_to_string(img.crop(box) if box else img, config=config)
+
+    if max_workers == 1:
+        texts = [backend.image_to_string(img.crop(box), config).strip('\n') for box in boxes]
+    else:
+        executor = get_executor(max_workers)
+        futures = [executor.submit(backend.image_to_string, img.crop(box), config) for box in boxes]
+        texts = [future.result().strip('\n') for future in futures]
+    return '\n'.join(text for text in texts if text.strip()) + '\n'
@@ -0,0 +1,209 @@
+"""Server-side dose reminders, pushed to subscribers (Server-Sent Events in app.py)"""
+import heapq
+import itertools
+import logging
+import queue
+import threading
+from datetime import datetime, time, timedelta, timezone
+
+from forksafe import PerProcess
+
+# Same defaults as the Reminder Controls in the UI (minutes)
+DEFAULT_OFFSETS = {'reminder1': 15, 'reminder2': 5, 'voiceAlert': 1, 'overdue': 15}
+HORIZON_DAYS = 2       # Days of doses kept in the heap per subscription; refilled at midnight
+LATE_TOLERANCE = timedelta(seconds=30)
+
+logger = logging.getLogger(__name__)
+
+
+def reminder_kinds(offsets):
+    """(event type, reminder, minutes relative to the dose) for one set of offsets"""
+    return [
+        ('due_soon', 'reminder1', -offsets['reminder1']),
+        ('due_soon', 'reminder2', -offsets['reminder2']),
+        ('due_soon', 'voice', -offsets['voiceAlert']),
+        ('due_now', None, 0),
+        ('overdue', None, offsets['overdue'])
+    ]
+
+
+def client_timezone(tz_offset=None):
+    """A fixed timezone `tz_offset` minutes east of UTC, or the server's current one for None"""
+    if tz_offset is None:
+        return datetime.now().astimezone().tzinfo
+    return timezone(timedelta(minutes=tz_offset))
+
+
+class _Channel:
+    """Subscribers to one prescription with the same reminder offsets and timezone"""
+
+    def __init__(self, key, prescription_id, offsets, custom, tz):
+        self.key = key
+        self.prescription_id = prescription_id
+        self.offsets = offsets
+        self.custom = custom
+        self.tz = tz
+        self.subscribers = []
+        self.closed = False
+
+
+class ReminderScheduler:
+    """
+    One heap of upcoming reminder events for every subscribed prescription.
+
+    Subscribing loads the next HORIZON_DAYS of doses and pushes one entry per
+    (time, event type) group; a worker thread sleeps until the earliest entry
+    is due, drops doses that were taken meanwhile and hands the event to every
+    subscriber. Work is proportional to the events fired, not to the number of
+    open tabs or the schedule length. `load_prescription(id)` returns a
+    storage record or None; it is never called with the lock held.
+
+    Dose times are wall-clock times in the subscriber's timezone (a fixed UTC
+    offset, the server's local one by default).
+    """
+
+    def __init__(self, load_prescription, horizon_days=HORIZON_DAYS):
+        self.load_prescription = load_prescription
+        self.horizon_days = horizon_days
+        self._heap = []
+        self._seq = itertools.count()
+        self._channels = {}
+        self._cond = threading.Condition()
+        self._thread = PerProcess(self._start_thread)
+
+    def _start_thread(self):
+        thread = threading.Thread(target=self._run, name='reminders', daemon=True)
+        thread.start()
+        return thread
+
+    def subscribe(self, prescription_id, offsets=None, custom=None, tz_offset=None):
+        """
+        Return a queue that receives reminder events for a prescription.
+        `custom` maps dose ids to their own offsets (same keys as DEFAULT_OFFSETS),
+        and `tz_offset` is the subscriber's UTC offset in minutes.
+        """
+        offsets = dict(DEFAULT_OFFSETS, **(offsets or {}))
+        custom = {dose: dict(offsets, **o) for dose, o in (custom or {}).items()}
+        tz = client_timezone(tz_offset)
+        key = (prescription_id, tuple(sorted(offsets.items())),
+               tuple(sorted((dose, tuple(sorted(o.items()))) for dose, o in custom.items())), tz)
+        subscriber = queue.Queue()
+
+        # The horizon is loaded before taking the lock and thrown away if the channel already exists
+        new_channel = _Channel(key, prescription_id, offsets, custom, tz)
+        today = datetime.now(tz).date()
+        record = self.load_prescription(prescription_id)
+        entries = [entry for day in range(self.horizon_days)
+                   for entry in self._day_entries(new_channel, record, today + timedelta(days=day))]
+
+        with self._cond:
+            self._thread.get()
+            channel = self._channels.get(key)
+            if channel is None:
+                channel = self._channels[key] = new_channel
+                self._push_all(channel, entries)
+                midnight = datetime.combine(today + timedelta(days=1), time(), tzinfo=tz)
+                self._push(midnight, channel, 'refill', today + timedelta(days=self.horizon_days))
+            channel.subscribers.append(subscriber)
+            subscriber.channel = channel
+            self._cond.notify()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._cond:
+            channel = subscriber.channel
+            if subscriber in channel.subscribers:
+                channel.subscribers.remove(subscriber)
+            if not channel.subscribers:
+                # Its heap entries are dropped lazily when they come due
+                channel.closed = True
+                self._channels.pop(channel.key, None)
+
+    def _push(self, fire_at, channel, kind, payload):
+        heapq.heappush(self._heap, (fire_at, next(self._seq), channel, kind, payload))
+
+    def _push_all(self, channel, entries):
+        for fire_at, kind, payload in entries:
+            self._push(fire_at, channel, kind, payload)
+
+    def _day_entries(self, channel, record, day):
+        """(fire at, event type, payload) for one day of a channel's doses"""
+        if record is None:
+            return []
+        days, _ = record['schedule'].expand(day, day, 1)
+        groups = {}
+        now = datetime.now(channel.tz)
+        for entry in days:
+            for med in entry['medications']:
+                try:
+                    due = datetime.combine(day, time.fromisoformat(med['time']), tzinfo=channel.tz)
+                except ValueError:
+                    continue
+                offsets = channel.custom.get(med['id'], channel.offsets)
+                for event_type, reminder, minutes in reminder_kinds(offsets):
+                    fire_at = due + timedelta(minutes=minutes)
+                    if fire_at + LATE_TOLERANCE < now:
+                        continue
+                    groups.setdefault((fire_at, event_type, reminder, abs(minutes), med['time']), []).append(med['id'])
+        return [(fire_at, event_type, {
+            'reminder': reminder,
+            'minutes': minutes,
+            'date': day.isoformat(),
+            'time': dose_time,
+            'dose_ids': dose_ids
+        }) for (fire_at, event_type, reminder, minutes, dose_time), dose_ids in groups.items()]
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._heap or self._heap[0][0] > datetime.now(timezone.utc):
+                    timeout = (self._heap[0][0] - datetime.now(timezone.utc)).total_seconds() if self._heap else None
+                    self._cond.wait(timeout)
+                due = []
+                while self._heap and self._heap[0][0] <= datetime.now(timezone.utc):
+                    due.append(heapq.heappop(self._heap))
+
+            for fire_at, _, channel, kind, payload in due:
+                if channel.closed:
+                    continue
+                try:
+                    self._fire(fire_at, channel, kind, payload)
+                except Exception:
+                    logger.exception('Reminder for %s failed', channel.prescription_id)
+
+    def _fire(self, fire_at, channel, kind, payload):
+        if kind == 'refill':
+            entries = self._day_entries(channel, self.load_prescription(channel.prescription_id), payload)
+            with self._cond:
+                self._push_all(channel, entries)
+                self._push(fire_at + timedelta(days=1), channel, 'refill', payload + timedelta(days=1))
+            return
+
+        record = self.load_prescription(channel.prescription_id)
+        if record is None:
+            return
+        medications = [record['schedule'].dose(dose_id) for dose_id in payload['dose_ids']]
+        medications = [med for med in medications if med is not None and not med['taken']]
+        if not medications:
+            return
+        event = {
+            'type': kind,
+            'prescription_id': channel.prescription_id,
+            'reminder': payload['reminder'],
+            'minutes': payload['minutes'],
+            'date': payload['date'],
+            'time': payload['time'],
+            'medications': medications
+        }
+        with self._cond:
+            subscribers = list(channel.subscribers)
+        for subscriber in subscribers:
+            subscriber.put(event)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'channels': len(self._channels),
+                'subscribers': sum(len(c.subscribers) for c in self._channels.values()),
+                'pending_events': len(self._heap)
+            }
@@ -0,0 +1,175 @@
+"""
+Re-run extraction over archived uploads (used by `flask reprocess` in app.py).
+
+Results go to an NDJSON file, one line per image. A run that is interrupted
+picks up where it stopped when started again with the same output file, and
+a finished run can be diffed against an earlier one to see what a parser
+change did.
+"""
+import json
+import multiprocessing
+import os
+import sys
+import time
+from collections import Counter
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+PROGRESS_INTERVAL = 1.0   # Seconds between progress lines
+
+
+def list_images(folder):
+    """Archived upload file names, oldest first"""
+    names = [entry.name for entry in os.scandir(folder)
+             if entry.is_file() and entry.name.lower().endswith(IMAGE_EXTENSIONS)]
+    return sorted(names)
+
+
+def load_results(path):
+    """{image: record} from an NDJSON results file (missing file -> {})"""
+    results = {}
+    if not os.path.exists(path):
+        return results
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            results[record['image']] = record
+    return results
+
+
+def _truncate_partial_line(path):
+    """Drop a half-written last line left by an interrupted run"""
+    with open(path, 'rb+') as f:
+        data = f.read()
+        end = data.rfind(b'\n') + 1
+        if end != len(data):
+            f.truncate(end)
+
+
+class Progress:
+    def __init__(self, total, done, out=sys.stderr):
+        self.total = total
+        self.done = done
+        self.out = out
+        self.processed = 0
+        self.ocr_cached = 0
+        self.errors = 0
+        self.started = time.perf_counter()
+        self._last = 0.0
+
+    def update(self, record, force=False):
+        if record is not None:
+            self.done += 1
+            self.processed += 1
+            self.ocr_cached += record.get('ocr') == 'cached'
+            self.errors += 'error' in record
+        now = time.perf_counter()
+        if not force and now - self._last < PROGRESS_INTERVAL:
+            return
+        self._last = now
+        elapsed = now - self.started
+        rate = self.processed / elapsed if elapsed else 0.0
+        remaining = (self.total - self.done) / rate if rate else 0.0
+        percent = self.done / self.total * 100 if self.total else 100.0
+        print(f"{self.done}/{self.total} ({percent:.1f}%) {rate:.1f} images/s, "
+              f"OCR cached {self.ocr_cached}/{self.processed}, errors {self.errors}, ETA {remaining:.0f}s",
+              file=self.out, flush=True)
+
+
+def run(folder, output, process, workers=None, limit=None, initializer=None, chunksize=4):
+    """
+    Call `process(path)` on every image in `folder` not yet in `output`, in a
+    process pool, appending each returned record (a dict with an 'image' key
+    holding the file name) as one NDJSON line. Returns the Progress of this run.
+    """
+    names = list_images(folder)
+    if limit is not None:
+        names = names[:limit]
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    done = set()
+    if os.path.exists(output):
+        _truncate_partial_line(output)
+        done = set(load_results(output))
+    todo = [os.path.join(folder, name) for name in names if name not in done]
+    progress = Progress(len(names), len(names) - len(todo))
+
+    with open(output, 'a', encoding='utf-8') as out:
+        if todo:
+            with multiprocessing.Pool(workers, initializer=initializer) as pool:
+                for record in pool.imap_unordered(process, todo, chunksize=chunksize):
+                    out.write(json.dumps(record, sort_keys=True) + '\n')
+                    out.flush()
+                    progress.update(record)
+    progress.update(None, force=True)
+    return progress
+
+
+def diff_record(old, new):
+    """{field: [old, new]} for every field that changed; medicines are compared by name"""
+    if 'error' in old or 'error' in new:
+        return {} if old.get('error') == new.get('error') else {'error': [old.get('error'), new.get('error')]}
+    old_result, new_result = old['result'], new['result']
+    changes = {}
+    for field in sorted(set(old_result) | set(new_result)):
+        if field != 'medicines' and old_result.get(field) != new_result.get(field):
+            changes[field] = [old_result.get(field), new_result.get(field)]
+
+    old_meds = {med['name'].lower(): med for med in old_result.get('medicines', [])}
+    new_meds = {med['name'].lower(): med for med in new_result.get('medicines', [])}
+    for name in sorted(old_meds.keys() | new_meds.keys()):
+        before, after = old_meds.get(name), new_meds.get(name)
+        if before is None or after is None:
+            changes[f"medicines[{name}]"] = [before, after]
+            continue
+        for key in sorted(set(before) | set(after)):
+            if before.get(key) != after.get(key):
+                changes[f"medicines[{name}].{key}"] = [before.get(key), after.get(key)]
+    return changes
+
+
+def diff_runs(previous, current, diff_output=None):
+    """
+    Compare two results files. Writes one line per changed image to
+    `diff_output` if given and returns a summary.
+    """
+    old, new = load_results(previous), load_results(current)
+    summary = {'compared': 0, 'unchanged': 0, 'changed': 0,
+               'only_in_previous': len(old.keys() - new.keys()), 'only_in_current': len(new.keys() - old.keys())}
+    fields = Counter()
+    out = open(diff_output, 'w', encoding='utf-8') if diff_output else None
+    try:
+        for image in sorted(old.keys() & new.keys()):
+            summary['compared'] += 1
+            changes = diff_record(old[image], new[image])
+            if not changes:
+                summary['unchanged'] += 1
+                continue
+            summary['changed'] += 1
+            # medicines[name].dosage -> medicines.dosage, so counts group across images
+            fields.update({_field_group(field) for field in changes})
+            if out is not None:
+                out.write(json.dumps({'image': image, 'changes': changes}, sort_keys=True) + '\n')
+    finally:
+        if out is not None:
+            out.close()
+    summary['changed_fields'] = dict(fields.most_common())
+    return summary
+
+
+def _field_group(field):
+    if field.startswith('medicines['):
+        _, _, rest = field.partition(']')
+        return 'medicines' + rest if rest else 'medicines (added/removed)'
+    return field
+
+
+def previous_run(directory, exclude):
+    """Most recent results file in `directory` other than `exclude`, or None"""
+    if not os.path.isdir(directory):
+        return None
+    runs = [os.path.join(directory, name) for name in os.listdir(directory)
+            if name.endswith('.ndjson') and not name.endswith('.diff.ndjson')]
+    runs = [path for path in runs if os.path.abspath(path) != os.path.abspath(exclude)]
+    return max(runs, key=os.path.getmtime) if runs else None
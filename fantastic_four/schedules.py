@@ -0,0 +1,277 @@
+"""Compact medication schedules: one rule per medicine, expanded into doses on demand"""
+import re
+from datetime import date, datetime, timedelta
+
+MAX_PAGE_DAYS = 366       # Largest `limit` a request may ask for
+
+
+def parse_duration_to_days(duration_str):
+    """Convert duration string to days"""
+    duration_str = duration_str.lower().strip()
+    match = re.search(r'(\d+)\s*(day|week|month|year)', duration_str)
+    if not match:
+        return 7  # Default to 7 days
+    number = int(match.group(1))
+    unit = match.group(2)
+    if 'day' in unit:
+        return number
+    elif 'week' in unit:
+        return number * 7
+    elif 'month' in unit:
+        return number * 30
+    elif 'year' in unit:
+        return number * 365
+    return 7
+
+
+def dose_id(date_str, time, medicine):
+    """The medication_id clients send to /mark_taken"""
+    return f"{date_str}_{time}_{medicine}"
+
+
+def parse_dose_id(medication_id):
+    """(date, time, medicine) from a dose id, or None if it isn't one"""
+    parts = medication_id.split('_', 2)
+    if len(parts) != 3:
+        return None
+    try:
+        day = date.fromisoformat(parts[0])
+    except ValueError:
+        return None
+    return day, parts[1], parts[2]
+
+
+class Schedule:
+    """
+    A prescription's doses as rules: start date plus, per medicine, the number
+    of days and the daily time slots.
+
+    Taken doses are a bitmap per rule (bit `day * len(times) + slot`), so a
+    year-long prescription costs a few hundred bytes rather than a dict per dose.
+    Dose ids map straight to a bit (see `find`), and taken counts per
+    prescription, medicine and day are kept up to date by `mark`, so neither
+    depends on the schedule length.
+    """
+
+    def __init__(self, start, rules, taken=None):
+        self.start = start
+        self.rules = rules
+        self.taken = taken or [0] * len(rules)
+        self._by_name = {}
+        for i, rule in enumerate(rules):
+            self._by_name.setdefault(rule['medicine'], []).append(i)
+        self.total_doses = sum(rule['days'] * len(rule['times']) for rule in rules)
+        self.doses_by_medicine = {}
+        for rule in rules:
+            self.doses_by_medicine[rule['medicine']] = (
+                self.doses_by_medicine.get(rule['medicine'], 0) + rule['days'] * len(rule['times'])
+            )
+        self.taken_total, self.taken_by_medicine, self.taken_by_day = self.recount()
+
+    def recount(self):
+        """Taken counters rebuilt from the bitmaps: (total, {medicine: n}, {day offset: n})"""
+        by_medicine = {rule['medicine']: 0 for rule in self.rules}
+        by_day = {}
+        for rule, bits in zip(self.rules, self.taken):
+            slots = len(rule['times'])
+            position = 0
+            while bits:
+                if bits & 1:
+                    by_medicine[rule['medicine']] += 1
+                    by_day[position // slots] = by_day.get(position // slots, 0) + 1
+                bits >>= 1
+                position += 1
+        return sum(by_medicine.values()), by_medicine, by_day
+
+    def check_counters(self):
+        """Compare the running counters against a recount; returns a list of mismatches"""
+        total, by_medicine, by_day = self.recount()
+        problems = []
+        if total != self.taken_total:
+            problems.append(f"taken_total: {self.taken_total} != {total}")
+        for name in sorted(set(by_medicine) | set(self.taken_by_medicine)):
+            if by_medicine.get(name, 0) != self.taken_by_medicine.get(name, 0):
+                problems.append(f"taken_by_medicine[{name}]: {self.taken_by_medicine.get(name, 0)} != {by_medicine.get(name, 0)}")
+        for offset in sorted(set(by_day) | set(self.taken_by_day)):
+            if by_day.get(offset, 0) != self.taken_by_day.get(offset, 0):
+                problems.append(f"taken_by_day[{offset}]: {self.taken_by_day.get(offset, 0)} != {by_day.get(offset, 0)}")
+        return problems
+
+    @classmethod
+    def from_medicines(cls, medicines, start=None):
+        start = start or datetime.now()
+        if isinstance(start, datetime):
+            start = start.date()
+        rules = [{
+            'medicine': med['name'],
+            'dosage': med['dosage'],
+            'frequency': med.get('frequency', 'As directed'),
+            'instructions': med.get('instructions', 'As prescribed'),
+            'duration': med['duration'],
+            'days': parse_duration_to_days(med['duration']),
+            'times': list(med.get('timing', ['09:00']))
+        } for med in medicines]
+        return cls(start, rules)
+
+    def to_dict(self):
+        """The rules as JSON-able data (taken flags are stored separately)"""
+        return {'start': self.start.isoformat(), 'rules': self.rules}
+
+    @classmethod
+    def from_dict(cls, data, taken_ids=()):
+        """Rebuild a schedule; taken doses are applied one by one, through the same counters as `mark`"""
+        schedule = cls(date.fromisoformat(data['start']), data['rules'])
+        for medication_id in taken_ids:
+            found = schedule.find(medication_id)
+            if found is not None:
+                schedule._set(*found, True)
+        return schedule
+
+    @property
+    def duration_days(self):
+        return max((rule['days'] for rule in self.rules), default=0)
+
+    def _dose(self, index, offset, slot, date_str=None):
+        rule = self.rules[index]
+        time = rule['times'][slot]
+        if date_str is None:
+            date_str = (self.start + timedelta(days=offset)).strftime('%Y-%m-%d')
+        return {
+            'medicine': rule['medicine'],
+            'dosage': rule['dosage'],
+            'time': time,
+            'frequency': rule['frequency'],
+            'instructions': rule['instructions'],
+            'duration': rule['duration'],
+            'remaining_days': rule['days'] - offset,
+            'taken': bool(self.taken[index] >> (offset * len(rule['times']) + slot) & 1),
+            'id': dose_id(date_str, time, rule['medicine'])
+        }
+
+    def day(self, offset):
+        """The schedule entry for day `offset` (0 = start date)"""
+        current = self.start + timedelta(days=offset)
+        date_str = current.strftime('%Y-%m-%d')
+        medications = [
+            self._dose(i, offset, slot, date_str)
+            for i, rule in enumerate(self.rules) if offset < rule['days']
+            for slot in range(len(rule['times']))
+        ]
+        medications.sort(key=lambda x: x['time'])
+        return {
+            'date': date_str,
+            'day': current.strftime('%A'),
+            'medications': medications,
+            'taken_doses': self.taken_by_day.get(offset, 0)
+        }
+
+    def expand(self, first=None, last=None, limit=None):
+        """
+        Days with doses between the dates `first` and `last` (inclusive), at
+        most `limit` calendar days (None for no limit). Returns (days,
+        next_from), where next_from is the date to continue from, or None at
+        the end.
+        """
+        begin = 0 if first is None else max(0, (first - self.start).days)
+        end = self.duration_days if last is None else min(self.duration_days, (last - self.start).days + 1)
+        stop = end if limit is None else min(end, begin + limit)
+        days = [entry for entry in (self.day(offset) for offset in range(begin, stop)) if entry['medications']]
+        next_from = (self.start + timedelta(days=stop)).isoformat() if stop < end else None
+        return days, next_from
+
+    def doses(self, first=None, last=None):
+        """
+        Yield (date string, dose) for the doses between the dates `first` and
+        `last` (inclusive) in (date, time) order. Days are expanded one at a
+        time as the caller consumes them.
+        """
+        begin = 0 if first is None else max(0, (first - self.start).days)
+        end = self.duration_days if last is None else min(self.duration_days, (last - self.start).days + 1)
+        for offset in range(begin, end):
+            entry = self.day(offset)
+            for dose in entry['medications']:
+                yield entry['date'], dose
+
+    @property
+    def end(self):
+        """The last date with doses"""
+        return self.start + timedelta(days=max(self.duration_days - 1, 0))
+
+    def find(self, medication_id):
+        """(rule index, day offset, slot) of a dose id, or None"""
+        parsed = parse_dose_id(medication_id)
+        if parsed is None:
+            return None
+        day, time, medicine = parsed
+        offset = (day - self.start).days
+        for i in self._by_name.get(medicine, ()):
+            rule = self.rules[i]
+            if 0 <= offset < rule['days'] and time in rule['times']:
+                return i, offset, rule['times'].index(time)
+        return None
+
+    def dose(self, medication_id):
+        """A single dose (with its current taken flag), or None"""
+        found = self.find(medication_id)
+        return None if found is None else self._dose(*found)
+
+    def mark(self, medication_id, taken=True):
+        """Set a dose's taken flag and return the dose, or None if the id doesn't exist"""
+        found = self.find(medication_id)
+        if found is None:
+            return None
+        self._set(*found, taken)
+        return self._dose(*found)
+
+    def _set(self, index, offset, slot, taken):
+        """Flip one dose's bit if needed and adjust the counters by one"""
+        bit = 1 << (offset * len(self.rules[index]['times']) + slot)
+        if bool(self.taken[index] & bit) != bool(taken):
+            self.taken[index] ^= bit
+            change = 1 if taken else -1
+            self.taken_total += change
+            self.taken_by_medicine[self.rules[index]['medicine']] += change
+            self.taken_by_day[offset] = self.taken_by_day.get(offset, 0) + change
+            if not self.taken_by_day[offset]:
+                del self.taken_by_day[offset]
+
+    def statistics(self):
+        """Adherence totals for the whole prescription and per medicine"""
+        return dict(
+            adherence(self.total_doses, self.taken_total),
+            by_medicine={
+                name: adherence(total, self.taken_by_medicine[name])
+                for name, total in self.doses_by_medicine.items()
+            }
+        )
+
+
+def adherence(total, taken):
+    return {
+        'total_medications': total,
+        'taken': taken,
+        'missed': total - taken,
+        'adherence_rate': round(taken / total * 100, 1) if total > 0 else 0
+    }
+
+
+def parse_window(args):
+    """
+    Read `from`, `to` (YYYY-MM-DD) and `limit` (days) query parameters.
+    Without `limit` there is no cap (None), so a plain request still gets the
+    whole course. Raises ValueError with a message fit for a 400 response.
+    """
+    try:
+        first = date.fromisoformat(args['from']) if args.get('from') else None
+        last = date.fromisoformat(args['to']) if args.get('to') else None
+    except ValueError:
+        raise ValueError('from/to must be dates (YYYY-MM-DD)')
+    if not args.get('limit'):
+        return first, last, None
+    try:
+        limit = int(args['limit'])
+    except ValueError:
+        raise ValueError('limit must be an integer')
+    if not 1 <= limit <= MAX_PAGE_DAYS:
+        raise ValueError(f'limit must be between 1 and {MAX_PAGE_DAYS}')
+    return first, last, limit
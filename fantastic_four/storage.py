@@ -0,0 +1,420 @@
+"""SQLite (WAL) storage for prescriptions, medication logs and patients"""
+import base64
+import hashlib
+import json
+import os
+import queue
+import sqlite3
+import threading
+from collections import OrderedDict
+
+from forksafe import PerProcess
+from schedules import Schedule
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS prescriptions (
+    id TEXT PRIMARY KEY,
+    patient_name TEXT NOT NULL DEFAULT '',
+    created_at TEXT NOT NULL,
+    duration_days INTEGER NOT NULL,
+    version INTEGER NOT NULL DEFAULT 1,
+    data TEXT NOT NULL,
+    schedule TEXT NOT NULL,
+    rx_date TEXT NOT NULL DEFAULT '',
+    medicines_count INTEGER NOT NULL DEFAULT 0,
+    patient_id TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS prescriptions_created_id ON prescriptions (created_at, id);
+CREATE INDEX IF NOT EXISTS prescriptions_patient_created ON prescriptions (patient_name COLLATE NOCASE, created_at, id);
+CREATE INDEX IF NOT EXISTS prescriptions_patient_id ON prescriptions (patient_id, created_at, id);
+
+CREATE TABLE IF NOT EXISTS medication_logs (
+    prescription_id TEXT NOT NULL,
+    medication_id TEXT NOT NULL,
+    taken INTEGER NOT NULL,
+    timestamp TEXT NOT NULL,
+    PRIMARY KEY (prescription_id, medication_id)
+);
+CREATE INDEX IF NOT EXISTS medication_logs_dose ON medication_logs (medication_id);
+
+CREATE TABLE IF NOT EXISTS patients (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL DEFAULT '',
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS patients_name ON patients (name);
+"""
+
+# Listing summaries and the patient index live in their own columns so neither parses `data`
+SUMMARY_COLUMNS = {
+    'rx_date': "TEXT NOT NULL DEFAULT ''",
+    'medicines_count': 'INTEGER NOT NULL DEFAULT 0',
+    'patient_id': "TEXT NOT NULL DEFAULT ''"
+}
+
+BATCH_WINDOW = 0.002   # Seconds the writer waits for more marks before committing
+MAX_BATCH = 256
+EXPORT_BATCH = 500     # Prescriptions read per query by iter_prescriptions
+CACHE_ENTRIES = 1024   # Parsed prescriptions kept per worker (least recently used are dropped)
+
+
+class PrescriptionExistsError(Exception):
+    """Raised when a new prescription's id is already taken"""
+
+
+INSERT_PRESCRIPTION = (
+    'INSERT INTO prescriptions '
+    '(id, patient_name, created_at, duration_days, version, data, schedule, rx_date, medicines_count, patient_id) '
+    'VALUES (?, ?, ?, ?, 1, ?, ?, ?, ?, ?)'
+)
+
+
+def _prescription_values(prescription_id, record):
+    summary = summary_values(record['data'])
+    return (prescription_id, record['data'].get('patient_name', ''), record['created_at'],
+            record['duration_days'], json.dumps(record['data']), json.dumps(record['schedule'].to_dict()),
+            summary['rx_date'], summary['medicines_count'], summary['patient_id'])
+
+
+class Storage:
+    """
+    Prescriptions, medication logs and patients in one SQLite database.
+
+    WAL mode lets every worker process read while one writes. Each thread
+    gets its own connection (reopened after fork). Marks from /mark_taken
+    are handed to a writer thread that commits whatever has queued up
+    within BATCH_WINDOW in a single transaction, and the caller waits for
+    that commit.
+    """
+
+    def __init__(self, path, batch_window=BATCH_WINDOW, cache_entries=CACHE_ENTRIES):
+        self.path = path
+        self.batch_window = batch_window
+        self.cache_entries = cache_entries
+        self._local = threading.local()
+        self._writer = PerProcess(self._start_writer)
+        self._cache = OrderedDict()   # prescription id -> (version, record), per worker LRU
+        self._cache_lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._connect()
+        conn.execute('PRAGMA journal_mode=WAL')
+        self._add_summary_columns(conn)
+        conn.executescript(SCHEMA)
+        conn.close()
+
+    def _add_summary_columns(self, conn):
+        """Databases created before the summary columns get them added and backfilled"""
+        columns = {row['name'] for row in conn.execute('PRAGMA table_info(prescriptions)')}
+        missing = [name for name in SUMMARY_COLUMNS if name not in columns]
+        if not columns or not missing:
+            return
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            for name in missing:
+                conn.execute(f'ALTER TABLE prescriptions ADD COLUMN {name} {SUMMARY_COLUMNS[name]}')
+            for row in conn.execute('SELECT id, data FROM prescriptions').fetchall():
+                summary = summary_values(json.loads(row['data']))
+                conn.execute(
+                    f"UPDATE prescriptions SET {', '.join(f'{name} = ?' for name in summary)} WHERE id = ?",
+                    (*summary.values(), row['id'])
+                )
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA busy_timeout=30000')
+        return conn
+
+    @property
+    def conn(self):
+        """This thread's connection"""
+        if getattr(self._local, 'pid', None) != os.getpid():
+            self._local.conn = self._connect()
+            self._local.pid = os.getpid()
+        return self._local.conn
+
+    # Prescriptions
+
+    def insert_prescription(self, prescription_id, record):
+        """
+        Store a new prescription: {'data', 'schedule', 'duration_days', 'created_at'}.
+        Raises PrescriptionExistsError rather than overwrite one with the same id.
+        """
+        try:
+            self.conn.execute(INSERT_PRESCRIPTION, _prescription_values(prescription_id, record))
+        except sqlite3.IntegrityError:
+            raise PrescriptionExistsError(f'Prescription {prescription_id} already exists')
+        with self._cache_lock:
+            self._cache.pop(prescription_id, None)
+
+    def get_prescription(self, prescription_id):
+        """The prescription record with its schedule and taken flags, or None"""
+        row = self.conn.execute('SELECT version FROM prescriptions WHERE id = ?', (prescription_id,)).fetchone()
+        if row is None:
+            return None
+        with self._cache_lock:
+            cached = self._cache.get(prescription_id)
+            if cached is not None and cached[0] == row['version']:
+                self._cache.move_to_end(prescription_id)
+                return cached[1]
+
+        row = self.conn.execute('SELECT * FROM prescriptions WHERE id = ?', (prescription_id,)).fetchone()
+        if row is None:
+            return None
+        taken_ids = [r['medication_id'] for r in self.conn.execute(
+            'SELECT medication_id FROM medication_logs WHERE prescription_id = ? AND taken = 1',
+            (prescription_id,)
+        )]
+        record = {
+            'data': json.loads(row['data']),
+            'schedule': Schedule.from_dict(json.loads(row['schedule']), taken_ids),
+            'duration_days': row['duration_days'],
+            'created_at': row['created_at'],
+            'version': row['version']
+        }
+        with self._cache_lock:
+            self._cache[prescription_id] = (row['version'], record)
+            self._cache.move_to_end(prescription_id)
+            while len(self._cache) > self.cache_entries:
+                self._cache.popitem(last=False)
+        return record
+
+    def list_prescriptions(self, limit=None, cursor=None, patient=None, created_from=None, created_to=None):
+        """
+        Summary rows, newest first. Returns (rows, next_cursor).
+
+        `cursor` is the opaque next_cursor of the previous page; `patient`
+        matches the patient name case-insensitively; `created_from` and
+        `created_to` bound created_at (ISO strings, `created_to` exclusive).
+        Raises ValueError for a malformed cursor.
+        """
+        clauses, params = _filters(patient=patient, created_from=created_from, created_to=created_to)
+        if cursor:
+            created_at, prescription_id = decode_cursor(cursor)
+            clauses.append('(created_at, id) < (?, ?)')
+            params.extend([created_at, prescription_id])
+
+        sql = ('SELECT id, patient_name, patient_id, created_at, duration_days, rx_date, medicines_count '
+               'FROM prescriptions')
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+        sql += ' ORDER BY created_at DESC, id DESC'
+        if limit is not None:
+            sql += ' LIMIT ?'
+            params.append(limit + 1)
+
+        rows = self.conn.execute(sql, params).fetchall()
+        next_cursor = None
+        if limit is not None and len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1]['created_at'], rows[-1]['id'])
+        summaries = [{
+            'id': row['id'],
+            'patient_name': row['patient_name'] or 'Unknown',
+            'patient_id': row['patient_id'],
+            'date': row['rx_date'],
+            'medicines_count': row['medicines_count'],
+            'duration_days': row['duration_days'],
+            'created_at': row['created_at']
+        } for row in rows]
+        return summaries, next_cursor
+
+    def iter_prescriptions(self, patient_id=None, patient=None, created_from=None, created_to=None,
+                           batch=EXPORT_BATCH):
+        """
+        Yield (row, logs) for every matching prescription, oldest first, where
+        logs are its medication_logs rows. Rows are read `batch` at a time
+        after the last (created_at, id) seen, so memory stays flat and no read
+        transaction is held open between batches. Filters are those of
+        list_prescriptions plus `patient_id`.
+        """
+        clauses, params = _filters(patient_id, patient, created_from, created_to)
+        after = None
+        while True:
+            where = clauses + ['(created_at, id) > (?, ?)'] * (after is not None)
+            sql = 'SELECT id, patient_id, patient_name, created_at, version, data, schedule FROM prescriptions'
+            if where:
+                sql += ' WHERE ' + ' AND '.join(where)
+            sql += ' ORDER BY created_at, id LIMIT ?'
+            rows = self.conn.execute(sql, params + list(after or ()) + [batch]).fetchall()
+            if not rows:
+                return
+            logs = {}
+            for log in self.conn.execute(
+                'SELECT prescription_id, medication_id, taken, timestamp FROM medication_logs '
+                f"WHERE prescription_id IN ({', '.join('?' * len(rows))}) ORDER BY timestamp",
+                [row['id'] for row in rows]
+            ):
+                logs.setdefault(log['prescription_id'], []).append(log)
+            for row in rows:
+                yield row, logs.get(row['id'], [])
+            after = (rows[-1]['created_at'], rows[-1]['id'])
+
+    def patient_prescription_ids(self, patient_id):
+        """Ids of a patient's prescriptions, oldest first (from the patient_id index)"""
+        rows = self.conn.execute(
+            'SELECT id FROM prescriptions WHERE patient_id = ? ORDER BY created_at, id', (patient_id,)
+        )
+        return [row['id'] for row in rows]
+
+    def prescription_versions(self):
+        """{prescription id: version}; a version goes up whenever one of its doses is marked"""
+        return {row['id']: row['version'] for row in self.conn.execute('SELECT id, version FROM prescriptions')}
+
+    def change_token(self):
+        """Changes whenever a prescription is added or any dose is marked"""
+        row = self.conn.execute('SELECT count(*), total(version) FROM prescriptions').fetchone()
+        return row[0], row[1]
+
+    def prescription_ids(self):
+        return [row['id'] for row in self.conn.execute('SELECT id FROM prescriptions ORDER BY created_at')]
+
+    # Medication logs
+
+    def get_logs(self, prescription_id):
+        """{medication_id: {'taken', 'timestamp'}} for a prescription"""
+        rows = self.conn.execute(
+            'SELECT medication_id, taken, timestamp FROM medication_logs WHERE prescription_id = ?',
+            (prescription_id,)
+        )
+        return {row['medication_id']: {'taken': bool(row['taken']), 'timestamp': row['timestamp']} for row in rows}
+
+    def mark_taken(self, prescription_id, medication_id, taken, timestamp):
+        """Record a dose as taken/not taken; returns once the batch holding it is committed"""
+        done = threading.Event()
+        item = {'args': (prescription_id, medication_id, int(bool(taken)), timestamp), 'done': done, 'error': None}
+        self._writer.get().put(item)
+        done.wait()
+        if item['error'] is not None:
+            raise item['error']
+
+    def _start_writer(self):
+        pending = queue.Queue()
+        threading.Thread(target=self._write_batches, args=(pending,), name='storage-writer', daemon=True).start()
+        return pending
+
+    def _write_batches(self, pending):
+        conn = self._connect()
+        while True:
+            batch = [pending.get()]
+            try:
+                while len(batch) < MAX_BATCH:
+                    batch.append(pending.get(timeout=self.batch_window))
+            except queue.Empty:
+                pass
+
+            try:
+                conn.execute('BEGIN IMMEDIATE')
+                conn.executemany(
+                    'INSERT OR REPLACE INTO medication_logs (prescription_id, medication_id, taken, timestamp) '
+                    'VALUES (?, ?, ?, ?)',
+                    [item['args'] for item in batch]
+                )
+                versions = [conn.execute(
+                    'UPDATE prescriptions SET version = version + 1 WHERE id = ? RETURNING version',
+                    (item['args'][0],)
+                ).fetchone() for item in batch]
+                conn.execute('COMMIT')
+            except sqlite3.Error as e:
+                if conn.in_transaction:
+                    conn.execute('ROLLBACK')
+                for item in batch:
+                    item['error'] = e
+            else:
+                self._apply_to_cache(batch, versions)
+            for item in batch:
+                item['done'].set()
+
+    def _apply_to_cache(self, batch, versions):
+        """
+        Mark committed doses on the cached schedules too, so the next read
+        doesn't reload and recount them. A cached record is only updated when
+        it is exactly one version behind; otherwise another worker wrote in
+        between and it is dropped.
+        """
+        with self._cache_lock:
+            for item, row in zip(batch, versions):
+                prescription_id, medication_id, taken, _ = item['args']
+                cached = self._cache.get(prescription_id)
+                if cached is None:
+                    continue
+                if row is None or cached[0] != row['version'] - 1:
+                    del self._cache[prescription_id]
+                    continue
+                record = cached[1]
+                record['schedule'].mark(medication_id, taken)
+                record['version'] = row['version']
+                self._cache[prescription_id] = (row['version'], record)
+
+    # Patients
+
+    def save_patient(self, patient_id, patient):
+        self.conn.execute(
+            'INSERT OR REPLACE INTO patients (id, name, data) VALUES (?, ?, ?)',
+            (patient_id, patient.get('name', ''), json.dumps(patient))
+        )
+
+    def get_patient(self, patient_id):
+        row = self.conn.execute('SELECT data FROM patients WHERE id = ?', (patient_id,)).fetchone()
+        return json.loads(row['data']) if row else None
+
+
+def _filters(patient_id=None, patient=None, created_from=None, created_to=None):
+    """WHERE clauses and parameters for the prescription filters"""
+    clauses, params = [], []
+    if patient_id:
+        clauses.append('patient_id = ?')
+        params.append(patient_id)
+    if patient:
+        clauses.append('patient_name = ? COLLATE NOCASE')
+        params.append(patient)
+    if created_from:
+        clauses.append('created_at >= ?')
+        params.append(created_from)
+    if created_to:
+        clauses.append('created_at < ?')
+        params.append(created_to)
+    return clauses, params
+
+
+def patient_key(data):
+    """
+    The patient a prescription belongs to: its explicit `patient_id`, else an
+    id derived from the patient name and phone number ('' when both are unknown).
+    """
+    if data.get('patient_id'):
+        return str(data['patient_id'])
+    name = ' '.join(str(data.get('patient_name') or '').casefold().split())
+    phone = ''.join(ch for ch in str(data.get('phone_number') or '') if ch.isdigit())
+    if name in ('', 'unknown', 'unknown patient') and not phone:
+        return ''
+    return 'PT' + hashlib.sha1(f"{name}|{phone}".encode()).hexdigest()[:12]
+
+
+def summary_values(data):
+    """SUMMARY_COLUMNS values for a prescription's data"""
+    return {
+        'rx_date': data.get('date', ''),
+        'medicines_count': len(data.get('medicines', [])),
+        'patient_id': patient_key(data)
+    }
+
+
+def encode_cursor(created_at, prescription_id):
+    raw = json.dumps([created_at, prescription_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        created_at, prescription_id = json.loads(raw)
+    except (ValueError, TypeError):
+        raise ValueError('invalid cursor')
+    if not isinstance(created_at, str) or not isinstance(prescription_id, str):
+        raise ValueError('invalid cursor')
+    return created_at, prescription_id
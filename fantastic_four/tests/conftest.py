@@ -0,0 +1,81 @@
+"""
+Shared fixtures. Run from fantastic_four/ (or the repo root):
+
+    python -m pytest -q
+
+Nothing here needs Tesseract: tests that go through the app replace the OCR
+step with canned text.
+"""
+import io
+import os
+import sys
+
+import pytest
+from PIL import Image, ImageDraw
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+OCR_TEXT = """Dr. Asha Rao
+City Clinic
+Patient: Ravi Kumar Age: 42
+Date: 01/02/2025
+Rx
+1. Tab Paracetamol 500mg Twice daily - 5 days
+2. Cap Omeprazole 20mg Once daily - 7 days
+"""
+
+
+def make_image(width=400, height=300, fmt='PNG', lines=3):
+    """Encoded image with a few dark text-like bars"""
+    img = Image.new('L', (width, height), 255)
+    draw = ImageDraw.Draw(img)
+    for i in range(lines):
+        top = 30 + i * 60
+        draw.rectangle((30, top, width - 30, top + 12), fill=0)
+    buf = io.BytesIO()
+    img.convert('RGB').save(buf, fmt)
+    return buf.getvalue()
+
+
+@pytest.fixture(scope='session')
+def app_module(tmp_path_factory):
+    """The app, imported once with its database, uploads and caches in a temporary directory"""
+    workdir = tmp_path_factory.mktemp('app')
+    os.environ.update({
+        'DATABASE_PATH': str(workdir / 'data' / 'prescriptions.db'),
+        'DRUG_LEXICON_PATH': os.path.join(ROOT, 'lexicon', 'drugs.txt'),
+        'UPLOAD_RATE': '0',
+        'OCR_JOB_WORKERS': '1',
+        'LOG_LEVEL': 'WARNING'
+    })
+    # The app keeps relative paths (uploads/, data/), so stay in workdir while it is in use
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    import app
+    app.app.config['TESTING'] = True
+    yield app
+    app.ocr_jobs.shutdown()
+    os.chdir(cwd)
+
+
+@pytest.fixture
+def client(app_module, monkeypatch):
+    """Test client whose OCR step returns OCR_TEXT"""
+    monkeypatch.setattr(app_module, 'run_ocr', lambda image_bytes, rx_only=False: OCR_TEXT)
+    return app_module.app.test_client()
+
+
+@pytest.fixture
+def upload(client):
+    """Upload one image through /upload and return the JSON response"""
+    def upload(data=None, **form):
+        image = data if data is not None else make_image(height=300 + upload.count)
+        upload.count += 1   # A new image each time, so the OCR cache never answers
+        response = client.post('/upload', data=dict(form, prescription=(io.BytesIO(image), 'rx.png')),
+                               content_type='multipart/form-data')
+        assert response.status_code == 200, response.get_json()
+        return response.get_json()
+    upload.count = 0
+    return upload
@@ -0,0 +1,68 @@
+import io
+
+from PIL import Image, ImageDraw
+
+from adaptive_ocr import AdaptiveOCR
+from conftest import make_image
+
+
+class FakeBackend:
+    """Answers each call with the next (text, confidence) and records the image sizes"""
+
+    def __init__(self, answers):
+        self.answers = list(answers)
+        self.sizes = []
+
+    def image_to_data(self, img, config=''):
+        self.sizes.append(img.size)
+        return self.answers.pop(0)
+
+
+def score(text):
+    return text.count('Tab')
+
+
+def test_first_acceptable_tier_wins():
+    ocr = AdaptiveOCR(min_confidence=70)
+    backend = FakeBackend([('Tab A', 91.04), ('unused', 99)])
+    result = ocr.recognize(io.BytesIO(make_image()), backend, score)
+    assert result == {'text': 'Tab A', 'confidence': 91.0, 'medicines': 1, 'tier': 'fast'}
+    assert len(backend.sizes) == 1
+    stats = ocr.stats.snapshot()
+    assert stats['requests'] == 1
+    assert stats['tiers']['fast']['accept_rate'] == 1
+
+
+def test_escalates_and_keeps_the_best_attempt():
+    ocr = AdaptiveOCR(min_confidence=70)
+    answers = [('Tab A', 40), ('Tab A\nTab B', 60), ('garbage', 95), ('Tab A', 65), ('', 0)]
+    backend = FakeBackend(answers)
+    result = ocr.recognize(io.BytesIO(make_image()), backend, score)
+    assert len(backend.sizes) == len(ocr.tiers)   # Nothing was acceptable
+    assert result['tier'] == 'standard'           # Most medicines, then confidence
+    assert ocr.stats.snapshot()['tiers']['standard']['final_share'] == 1
+
+
+def test_rx_only_crops_to_the_medicine_list():
+    # Letterhead at the top, medicine lines in the middle, signature at the bottom
+    img = Image.new('L', (800, 1200), 255)
+    draw = ImageDraw.Draw(img)
+    draw.rectangle((40, 30, 760, 70), fill=0)
+    for top in (400, 460, 520):
+        for left in range(40, 600, 16):   # Glyph-sized marks, not solid (image-like) bars
+            draw.rectangle((left, top, left + 4, top + 14), fill=0)
+    draw.rectangle((500, 1130, 760, 1160), fill=0)
+    buf = io.BytesIO()
+    img.save(buf, 'PNG')
+
+    full, cropped = FakeBackend([('Tab A', 90)]), FakeBackend([('Tab A', 90)])
+    AdaptiveOCR().recognize(io.BytesIO(buf.getvalue()), full, score)
+    AdaptiveOCR().recognize(io.BytesIO(buf.getvalue()), cropped, score, rx_only=True)
+    (full_w, full_h), (crop_w, crop_h) = full.sizes[0], cropped.sizes[0]
+    # Both are scaled to the same width; the crop drops most of the page height
+    assert crop_h / crop_w < 0.5 * full_h / full_w
+
+
+def test_rx_only_is_part_of_the_adaptive_cache_key(app_module, monkeypatch):
+    monkeypatch.setattr(app_module, 'OCR_STRATEGY', 'adaptive')
+    assert app_module.ocr_params(rx_only=True) != app_module.ocr_params()
@@ -0,0 +1,167 @@
+import io
+import threading
+import time
+
+import pytest
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+import admission
+from admission import AdmissionGate, AdmissionRejected, TokenBuckets
+from conftest import make_image
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(admission.time, 'monotonic', clock)
+    return clock
+
+
+def test_token_bucket_refills_at_the_rate(clock):
+    buckets = TokenBuckets(rate=2, burst=3)
+    for _ in range(3):
+        buckets.take('a')
+    with pytest.raises(AdmissionRejected) as error:
+        buckets.take('a')
+    assert (error.value.reason, error.value.retry_after) == ('rate_limited', 1)
+    buckets.take('b')                  # Other clients have their own bucket
+    clock.now += 0.5
+    buckets.take('a')
+    assert buckets.stats() == {'clients': 2, 'rate': 2, 'burst': 3, 'rejected': 1}
+
+
+def test_requests_larger_than_the_burst_take_a_full_bucket(clock):
+    buckets = TokenBuckets(rate=1, burst=3)
+    buckets.take('a', cost=10)
+    with pytest.raises(AdmissionRejected) as error:
+        buckets.take('a', cost=10)
+    assert error.value.retry_after == 3
+    clock.now += 3
+    buckets.take('a', cost=10)
+
+
+def test_idle_clients_are_forgotten_with_a_full_bucket(clock):
+    buckets = TokenBuckets(rate=1, burst=1, max_clients=2)
+    for client in ('a', 'b', 'c'):
+        buckets.take(client)
+    assert buckets.stats()['clients'] == 2
+    buckets.take('a')                  # Evicted, so it starts full again
+    TokenBuckets(rate=0, burst=0).take('a', cost=5)   # Rate 0 disables the limit
+
+
+def hold(gate):
+    """Occupy one slot of `gate` on a thread until the returned event is set"""
+    entered, release = threading.Event(), threading.Event()
+
+    def run():
+        with gate.admit():
+            entered.set()
+            release.wait()
+    threading.Thread(target=run, daemon=True).start()
+    entered.wait()
+    return release
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+
+
+def test_gate_rejects_beyond_the_wait_queue():
+    gate = AdmissionGate(max_running=1, max_waiting=0)
+    release = hold(gate)
+    with pytest.raises(AdmissionRejected) as error:
+        gate.check()
+    assert error.value.reason == 'queue_full'
+    with pytest.raises(AdmissionRejected):
+        with gate.admit():
+            pass
+    release.set()
+    wait_until(lambda: gate.stats()['running'] == 0)
+    assert gate.stats()['rejected'] == {'queue_full': 2, 'wait_timeout': 0}
+
+
+def test_gate_wait_times_out():
+    gate = AdmissionGate(max_running=1, max_waiting=1, max_wait=0.05)
+    release = hold(gate)
+    with pytest.raises(AdmissionRejected) as error:
+        with gate.admit():
+            pass
+    assert error.value.reason == 'wait_timeout'
+    assert gate.stats()['waiting'] == 0
+    release.set()
+
+
+def test_gate_admits_waiters_in_arrival_order():
+    gate = AdmissionGate(max_running=1, max_waiting=3)
+    release = hold(gate)
+    order = []
+
+    def wait(name):
+        with gate.admit():
+            order.append(name)
+
+    threads = []
+    for name in ('first', 'second', 'third'):
+        threads.append(threading.Thread(target=wait, args=(name,)))
+        threads[-1].start()
+        wait_until(lambda: gate.stats()['waiting'] == len(threads))
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert order == ['first', 'second', 'third']
+    assert gate.stats()['admitted'] == 4
+
+
+def test_uploads_over_the_rate_limit_get_429(app_module, client, monkeypatch):
+    monkeypatch.setattr(app_module, 'upload_limits', TokenBuckets(rate=0.001, burst=3))
+
+    def post(url, count, **form):
+        files = [(io.BytesIO(make_image()), f'rx{i}.png') for i in range(count)]
+        field = 'files' if url == '/upload_batch' else 'prescription'
+        return client.post(url, data=dict(form, **{field: files}), content_type='multipart/form-data')
+
+    # A batch is charged once for all of its files (this one is then refused for its mode)
+    assert post('/upload_batch', 2, mode='book').status_code == 400
+    response = post('/upload_batch', 2)
+    assert response.status_code == 429
+    assert response.get_json()['reason'] == 'rate_limited'
+    assert int(response.headers['Retry-After']) >= 1
+    assert post('/upload', 1).status_code == 200
+    assert post('/upload', 1).status_code == 429
+
+
+def test_a_full_gate_refuses_synchronous_uploads(app_module, client, monkeypatch):
+    gate = AdmissionGate(max_running=1, max_waiting=0)
+    monkeypatch.setattr(app_module, 'ocr_gate', gate)
+    release = hold(gate)
+    try:
+        response = client.post('/upload', data={'prescription': (io.BytesIO(make_image()), 'rx.png')},
+                               content_type='multipart/form-data')
+        assert response.status_code == 429
+        assert response.get_json()['reason'] == 'queue_full'
+    finally:
+        release.set()
+
+
+def test_forwarded_clients_get_their_own_bucket(app_module, client, monkeypatch):
+    monkeypatch.setattr(app_module, 'upload_limits', TokenBuckets(rate=0.001, burst=1))
+    monkeypatch.setattr(app_module.app, 'wsgi_app', ProxyFix(app_module.app.wsgi_app, x_for=1))
+
+    def post(forwarded_for):
+        return client.post('/upload', data={'prescription': (io.BytesIO(make_image()), 'rx.png')},
+                           content_type='multipart/form-data', headers={'X-Forwarded-For': forwarded_for})
+
+    assert post('10.0.0.1').status_code == 200
+    assert post('10.0.0.2').status_code == 200
+    assert post('10.0.0.1').status_code == 429
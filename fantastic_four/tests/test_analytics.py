@@ -0,0 +1,124 @@
+import random
+from collections import Counter
+from datetime import date, datetime
+
+import pytest
+
+pytest.importorskip('numpy')
+
+import analytics  # noqa: E402
+from analytics import AdherenceStore  # noqa: E402
+from schedules import Schedule  # noqa: E402
+
+NOW = datetime(2025, 2, 10, 12, 30)
+SHORTER = Schedule.from_medicines([{'name': 'Paracetamol', 'dosage': '1', 'duration': '1 days', 'timing': ['09:00']}],
+                                  start=date(2025, 1, 5))
+
+
+def make_schedules(count=20, seed=3):
+    rng = random.Random(seed)
+    schedules = []
+    for i in range(count):
+        medicines = [{
+            'name': rng.choice(['Paracetamol', 'Omeprazole', 'Metformin']),
+            'dosage': '1',
+            'duration': f'{rng.randint(1, 30)} days',
+            'timing': rng.sample(['08:00', '09:00', '12:30', '14:00', '21:00'], rng.randint(1, 3))
+        } for _ in range(rng.randint(1, 3))]
+        schedule = Schedule.from_medicines(medicines, start=date(2025, 1, rng.randint(1, 31)))
+        for _, dose in list(schedule.doses()):
+            if rng.random() < 0.6:
+                schedule.mark(dose['id'])
+        schedules.append((f'RX{i}', schedule))
+    return schedules
+
+
+def expected(schedules, first=None, last=None, medicine=None):
+    """Brute-force missed counts of doses due by NOW"""
+    due, missed = Counter(), Counter()
+    for _, schedule in schedules:
+        for date_str, dose in schedule.doses():
+            when = datetime.fromisoformat(f"{date_str}T{dose['time']}")
+            day = when.date()
+            if when > NOW or (first and day < first) or (last and day > last):
+                continue
+            if medicine and dose['medicine'] != medicine:
+                continue
+            for key in ('all', ('medicine', dose['medicine']), ('hour', when.hour), ('weekday', day.weekday())):
+                due[key] += 1
+                missed[key] += not dose['taken']
+    return due, missed
+
+
+@pytest.fixture
+def store():
+    store = AdherenceStore()
+    for prescription_id, schedule in make_schedules():
+        store.put(prescription_id, schedule)
+    return store
+
+
+@pytest.mark.parametrize('first, last, medicine', [
+    (None, None, None),
+    (date(2025, 1, 10), date(2025, 1, 20), None),
+    (None, None, 'Metformin'),
+])
+def test_report_matches_a_brute_force_count(store, first, last, medicine):
+    report = store.report(first, last, medicine, now=NOW)
+    due, missed = expected(make_schedules(), first, last, medicine)
+    assert (report['overall']['due'], report['overall']['missed']) == (due['all'], missed['all'])
+    for row in report['by_medicine']:
+        assert (row['due'], row['missed']) == (due[('medicine', row['medicine'])], missed[('medicine', row['medicine'])])
+    for row in report['by_hour']:
+        assert (row['due'], row['missed']) == (due[('hour', row['hour'])], missed[('hour', row['hour'])])
+    for row in report['by_weekday']:
+        key = ('weekday', analytics.WEEKDAYS.index(row['weekday']))
+        assert (row['due'], row['missed']) == (due[key], missed[key])
+    assert sum(row['due'] for row in report['trend']) == due['all']
+
+
+def test_trend_intervals(store):
+    weeks = store.report(date(2025, 1, 1), date(2025, 1, 31), interval='week', now=NOW)['trend']
+    assert weeks[0]['start'] == '2024-12-30'   # Weeks start on Monday
+    months = store.report(interval='month', now=NOW)['trend']
+    assert [row['start'] for row in months] == ['2025-01-01', '2025-02-01']
+    assert store.report(medicine='Aspirin', now=NOW)['overall']['due'] == 0
+
+
+def test_replaced_schedules_are_removed(store):
+    events = store.stats()['events']
+    _, schedule = make_schedules()[0]
+    store.put('RX0', schedule)                   # Same rules: updated in place
+    assert store.stats()['removed'] == 0
+
+    store.put('RX0', SHORTER)
+    assert store.stats()['removed'] == schedule.total_doses
+    assert store.stats()['events'] == events - schedule.total_doses + 1
+    assert store.report(now=NOW)['overall']['due'] == expected([('RX0', SHORTER)] + make_schedules()[1:])[0]['all']
+
+
+def test_compaction_keeps_the_blocks_in_place(monkeypatch):
+    monkeypatch.setattr(analytics, 'COMPACT_MIN', 0)
+    store = AdherenceStore()
+    schedules = make_schedules(count=3)
+    for prescription_id, schedule in schedules:
+        store.put(prescription_id, schedule)
+    store.put('RX0', SHORTER)
+    store.put('RX1', SHORTER)                    # Over half the store removed
+    assert store.stats()['removed'] == 0
+    assert store.stats()['events'] == 2 + schedules[2][1].total_doses
+
+    # Blocks moved by the compaction still take their own taken flags
+    store.put('RX2', schedules[2][1])
+    after = [('RX0', SHORTER), ('RX1', SHORTER), schedules[2]]
+    due, missed = expected(after)
+    assert store.report(now=NOW)['overall'] == analytics._rate(due['all'], missed['all'])
+
+
+def test_analytics_endpoint(client, upload):
+    upload()
+    body = client.get('/analytics?interval=day').get_json()
+    assert body['interval'] == 'day'
+    assert client.get('/analytics/stats').get_json()['events'] > 0
+    assert client.get('/analytics?interval=year').status_code == 400
+    assert client.get('/analytics?from=soon').status_code == 400
@@ -0,0 +1,47 @@
+import pytest
+
+from benchmarks import e2e_bench
+from benchmarks.synthetic import generate, score, summarize_scores
+
+
+def test_samples_depend_only_on_seed_and_index():
+    first = list(generate(3, seed=7))
+    again = list(generate(5, seed=7))[:3]
+    assert [s['image'] for s in first] == [s['image'] for s in again]
+    assert [s['id'] for s in first] == ['synthetic_7_0000', 'synthetic_7_0001', 'synthetic_7_0002']
+    assert next(generate(1, seed=8))['image'] != first[0]['image']
+
+
+def test_score_counts_fields_and_medicines():
+    truth = next(generate(1))['truth']
+    perfect = score(dict(truth), truth)
+    assert all(correct == total for correct, total in perfect['fields'].values())
+    assert perfect['medicines_found'] == perfect['medicines_expected']
+
+    parsed = dict(truth, patient_name='Someone Else', medicines=truth['medicines'][1:] + [{'name': 'Extra'}])
+    result = score(parsed, truth)
+    assert result['fields']['patient_name'] == [0, 1]
+    assert result['medicines_found'] == len(truth['medicines']) - 1
+    assert result['medicines_extra'] == 1
+    summary = summarize_scores([perfect, result])
+    assert summary['documents'] == 2
+    assert summary['by_field']['patient_name'] == 0.5
+
+
+def test_latency_summary():
+    assert e2e_bench.percentile([10, 20, 30, 40], 50) == 25
+    summary = e2e_bench.summarize([30, 10, 20], elapsed=2)
+    assert (summary['p50_ms'], summary['max_ms'], summary['throughput_per_s']) == (20, 30, 1.5)
+    assert e2e_bench.summarize([]) == {'count': 0}
+
+
+def test_flow_completes_without_errors(app_module, client):
+    result = e2e_bench.bench_flow(app_module.app, count=4, seed='test', concurrency=2)
+    assert (result['completed'], result['errors']) == (4, {})
+
+
+def test_flow_fails_on_duplicate_ids(app_module, monkeypatch):
+    sample_body = {'prescription_id': 'RX1', 'data': {'medicines': []}}
+    monkeypatch.setattr(e2e_bench, 'run_flow', lambda flask_app, sample: ({'flow': 1.0}, sample_body, None))
+    with pytest.raises(RuntimeError):
+        e2e_bench.bench_flow(app_module.app, count=2, seed='dup', concurrency=1)
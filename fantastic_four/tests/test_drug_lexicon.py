@@ -0,0 +1,80 @@
+import os
+
+import pytest
+
+from conftest import ROOT
+from drug_lexicon import DrugLexicon, allowed_distance, edit_distance
+from prescription_parser import snap_medicine_names
+
+
+@pytest.fixture(scope='module')
+def lexicon():
+    return DrugLexicon.from_file(os.path.join(ROOT, 'lexicon', 'drugs.txt'))
+
+
+def test_edit_distance():
+    assert edit_distance('omeprazole', 'omeprazole', 2) == 0
+    assert edit_distance('omeprazole', 'omeprazoel', 2) == 1   # Transposition
+    assert edit_distance('omeprazole', 'omprazle', 2) == 2
+    assert edit_distance('omeprazole', 'ibuprofen', 2) == 3
+
+
+def test_allowed_distance_scales_with_length():
+    assert [allowed_distance(w) for w in ('tab', 'dolo', 'augmen', 'paracetamol')] == [0, 0, 1, 2]
+
+
+def test_aliases_and_misspellings(lexicon):
+    assert lexicon.lookup('Acetaminophen').canonical == 'Paracetamol'
+    match = lexicon.lookup('Paracetmol')
+    assert (match.canonical, match.distance, match.low_confidence) == ('Paracetamol', 1, False)
+
+
+@pytest.mark.parametrize('word', ['Tab', 'Cap', 'Tabs', 'Syp'])
+def test_short_words_only_match_exactly(lexicon, word):
+    assert lexicon.lookup(word) is None
+    assert lexicon.match_medicine(word) is None
+
+
+@pytest.mark.parametrize('name, canonical', [
+    ('Tab Paracetamol', 'Paracetamol'),
+    ('Cap Omeprazol', 'Omeprazole'),
+    ('Tab. Pan', 'Pan'),
+    ('Tab Dolo 650', 'Dolo'),
+])
+def test_dosage_forms_are_skipped(lexicon, name, canonical):
+    assert lexicon.match_medicine(name).canonical == canonical
+
+
+def test_snapping_keeps_low_confidence_names_and_distinct_medicines(lexicon):
+    medicines = [
+        {'name': 'Tab Paracetmol'},
+        {'name': 'Tab Omeprazoel'},
+        {'name': 'Tab Paracetmol'},          # Repeated line
+        {'name': 'Cap Pantoprzxle'},       # Two edits: recorded, not applied
+    ]
+    snapped = snap_medicine_names(medicines, lexicon)
+    assert [m['name'] for m in snapped] == ['Paracetamol', 'Omeprazole', 'Cap Pantoprzxle']
+    assert snapped[2]['name_match'] == {
+        'raw': 'Cap Pantoprzxle', 'canonical': 'Pantoprazole', 'distance': 2, 'low_confidence': True
+    }
+
+
+def test_index_cache_round_trip(tmp_path):
+    path = os.path.join(ROOT, 'lexicon', 'drugs.txt')
+    first = DrugLexicon.load(path, cache_dir=str(tmp_path))
+    assert os.listdir(tmp_path) == ['drugs.txt.index.pickle']
+    cached = DrugLexicon.load(path, cache_dir=str(tmp_path))
+    assert len(cached) == len(first)
+    assert cached.lookup('Paracetmol').canonical == 'Paracetamol'
+
+
+def test_dedupe_is_on_the_parsed_name(lexicon):
+    snapped = snap_medicine_names([{'name': 'Tab Pan'}, {'name': 'Tab Pantocid'}, {'name': 'tab  pan'}], lexicon)
+    assert [m['name'] for m in snapped] == ['Pan', 'Pantocid']
+
+
+def test_misspellings_of_one_drug_are_merged(lexicon):
+    snapped = snap_medicine_names([{'name': 'Tab Paracetmol'}, {'name': 'Tab Paracetamal'},
+                                   {'name': 'Tab Paracetamol'}], lexicon)
+    assert [m['name'] for m in snapped] == ['Paracetamol']
+    assert snapped[0]['name_match']['raw'] == 'Tab Paracetmol'
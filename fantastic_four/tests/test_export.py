@@ -0,0 +1,92 @@
+import gzip
+import json
+from datetime import date
+
+import pytest
+
+import export
+from schedules import Schedule
+from storage import Storage
+
+MEDICINES = [
+    {'name': 'Paracetamol', 'dosage': '500mg', 'frequency': 'Twice daily', 'duration': '3 days',
+     'timing': ['09:00', '21:00']},
+    {'name': 'Omeprazole', 'dosage': '20mg', 'duration': '7 days', 'timing': ['08:00']},
+]
+
+
+@pytest.fixture
+def storage(tmp_path):
+    storage = Storage(str(tmp_path / 'rx.db'))
+    for i in range(3):
+        storage.insert_prescription(f'RX_{i}', {
+            'data': {'patient_name': 'Ravi Kumar', 'patient_id': 'p/1', 'doctor_name': 'Asha Rao',
+                     'medicines': MEDICINES},
+            'schedule': Schedule.from_medicines(MEDICINES, start=date(2025, 1, 1)),
+            'duration_days': 7,
+            'created_at': f'2025-01-0{i + 1}T09:00:00'
+        })
+    storage.mark_taken('RX_0', '2025-01-01_09:00_Paracetamol', True, '2025-01-01T09:05:00')
+    storage.mark_taken('RX_0', '2025-01-01_21:00_Paracetamol', False, '2025-01-01T22:00:00')
+    return storage
+
+
+def test_records(storage):
+    rows = list(export.records(storage.iter_prescriptions(batch=2)))
+    assert [row['id'] for row in rows] == ['RX_0', 'RX_1', 'RX_2']
+    first = rows[0]
+    assert first['statistics']['taken'] == 1
+    assert [dose['taken'] for dose in first['doses']] == [True, False]
+    assert first['schedule']['rules'][0]['times'] == ['09:00', '21:00']
+
+
+def test_fhir_resources(storage):
+    resources = list(export.fhir_resources(storage.iter_prescriptions(created_to='2025-01-02')))
+    assert [r['resourceType'] for r in resources] == ['MedicationRequest'] * 2 + ['MedicationAdministration'] * 2
+    paracetamol, omeprazole, taken, not_taken = resources
+    assert paracetamol['id'] == 'RX-0-0'
+    assert paracetamol['subject'] == {'display': 'Ravi Kumar', 'reference': 'Patient/p-1'}
+    assert paracetamol['dosageInstruction'][0]['timing']['repeat'] == {
+        'boundsPeriod': {'start': '2025-01-01', 'end': '2025-01-03'}, 'timeOfDay': ['09:00:00', '21:00:00']
+    }
+    assert omeprazole['medicationCodeableConcept'] == {'text': 'Omeprazole'}
+    assert (taken['status'], not_taken['status']) == ('completed', 'not-done')
+    assert not_taken['id'] == 'RX-0-0-0-1'
+    assert not_taken['request'] == {'reference': 'MedicationRequest/RX-0-0'}
+
+
+def test_request_status_follows_the_end_date():
+    rule = Schedule.from_medicines(MEDICINES).rules[0]
+    statuses = [export.medication_request('r', 'rx', rule, date(2025, 1, 1), '', {}, today=today)['status']
+                for today in (date(2025, 1, 3), date(2025, 1, 4))]
+    assert statuses == ['active', 'completed']
+
+
+def test_ndjson_chunks_and_gzip():
+    items = [{'n': i} for i in range(100)]
+    chunks = list(export.ndjson(items, chunk_bytes=100))
+    assert len(chunks) > 1
+    assert all(len(chunk) < 100 + 10 for chunk in chunks)
+    body = b''.join(chunks)
+    assert [json.loads(line) for line in body.splitlines()] == items
+    assert gzip.decompress(b''.join(export.gzip_stream(iter(chunks)))) == body
+
+
+def test_export_endpoint_and_command(app_module, client, upload, tmp_path):
+    prescription_id = upload(patient_id='export-patient')['prescription_id']
+    response = client.get('/export?patient_id=export-patient')
+    assert response.mimetype == 'application/x-ndjson'
+    assert [json.loads(line)['id'] for line in response.get_data().splitlines()] == [prescription_id]
+
+    response = client.get('/export?format=fhir&patient_id=export-patient', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    lines = gzip.decompress(response.get_data()).splitlines()
+    assert {json.loads(line)['resourceType'] for line in lines} == {'MedicationRequest'}
+    assert client.get('/export?format=csv').status_code == 400
+
+    output = tmp_path / 'export.ndjson.gz'
+    result = app_module.app.test_cli_runner().invoke(
+        args=['export', '--patient-id', 'export-patient', '--output', str(output)]
+    )
+    assert result.exit_code == 0, result.output
+    assert json.loads(gzip.decompress(output.read_bytes()))['id'] == prescription_id
@@ -0,0 +1,24 @@
+import forksafe
+from forksafe import PerProcess
+
+
+def test_value_is_created_once_per_process(monkeypatch):
+    created = []
+    value = PerProcess(lambda size: created.append(size) or len(created))
+    assert value.peek() is None
+    assert (value.get(4), value.get(8)) == (1, 1)
+    assert created == [4]
+
+    # In a forked child the parent's value is not visible and get() builds a new one
+    monkeypatch.setattr(forksafe.os, 'getpid', lambda: -1)
+    assert value.peek() is None
+    assert value.get(8) == 2
+    assert created == [4, 8]
+
+
+def test_reset_returns_this_process_value():
+    value = PerProcess(object)
+    first = value.get()
+    assert value.reset() is first
+    assert value.reset() is None
+    assert value.get() is not first
@@ -0,0 +1,70 @@
+import gzip
+
+import pytest
+
+import http_cache
+from http_cache import ResponseCache, negotiate_encoding
+
+
+@pytest.mark.parametrize('header, encoding', [
+    (None, None),
+    ('gzip, deflate', 'gzip'),
+    ('GZIP;q=0.5', 'gzip'),
+    ('gzip;q=0', None),
+    ('gzip;q=abc', None),
+    ('deflate', None),
+])
+def test_negotiate_encoding(monkeypatch, header, encoding):
+    monkeypatch.setattr(http_cache, 'brotli', None)
+    assert negotiate_encoding(header) == encoding
+
+
+def test_brotli_is_preferred_when_available(monkeypatch):
+    monkeypatch.setattr(http_cache, 'brotli', object())
+    assert negotiate_encoding('gzip, br') == 'br'
+    assert negotiate_encoding('gzip, br', encodings=('gzip',)) == 'gzip'
+
+
+def test_gzip_output_is_stable():
+    body = b'{"a": 1}' * 100
+    assert http_cache.compress(body, 'gzip') == http_cache.compress(body, 'gzip')
+    assert gzip.decompress(http_cache.compress(body, 'gzip')) == body
+
+
+def test_response_cache_is_an_lru_bounded_by_bytes():
+    cache = ResponseCache(max_bytes=10)
+    cache.put('a', b'1234')
+    cache.put('b', b'5678', 'gzip')
+    assert cache.get('a') == (b'1234', None)
+    cache.put('c', b'90ab')                 # Evicts b, the least recently used
+    assert cache.get('b') is None
+    cache.put('huge', b'x' * 11)            # Never cached
+    assert cache.get('huge') is None
+    cache.put('a', b'12')
+    assert cache.stats() == {'entries': 2, 'bytes': 6, 'hits': 1, 'misses': 2, 'hit_rate': 0.333}
+
+
+def test_schedule_etag_and_304(client, upload):
+    prescription_id = upload()['prescription_id']
+    url = f'/schedule/{prescription_id}'
+    first = client.get(url)
+    etag = first.headers['ETag']
+    assert first.headers['Vary'] == 'Accept-Encoding'
+    assert client.get(url, headers={'If-None-Match': etag}).status_code == 304
+    assert client.get(url + '?limit=2').headers['ETag'] != etag
+
+    # Marking a dose makes a new version, so the old ETag no longer matches
+    dose = first.get_json()['schedule'][0]['medications'][0]
+    client.post('/mark_taken', json={'prescription_id': prescription_id, 'medication_id': dose['id']})
+    refreshed = client.get(url, headers={'If-None-Match': etag})
+    assert refreshed.status_code == 200
+    assert refreshed.headers['ETag'] != etag
+
+
+def test_large_bodies_are_gzipped(client, upload):
+    prescription_id = upload()['prescription_id']
+    plain = client.get(f'/family_dashboard/{prescription_id}')
+    zipped = client.get(f'/family_dashboard/{prescription_id}', headers={'Accept-Encoding': 'gzip'})
+    assert zipped.headers['Content-Encoding'] == 'gzip'
+    assert zipped.headers['ETag'] != plain.headers['ETag']
+    assert gzip.decompress(zipped.data) == plain.data
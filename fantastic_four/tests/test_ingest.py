@@ -0,0 +1,73 @@
+import io
+import os
+
+import pytest
+from PIL import Image
+
+from conftest import make_image
+from ingest import InvalidImageError, UploadArchive, probe_image
+
+
+def mpo_image(width=400, height=300):
+    """A two-frame MPO, as phone cameras write"""
+    buf = io.BytesIO()
+    first, second = Image.new('RGB', (width, height), 'white'), Image.new('RGB', (width, height), 'gray')
+    first.save(buf, 'MPO', save_all=True, append_images=[second])
+    return buf.getvalue()
+
+
+@pytest.mark.parametrize('data, fmt', [
+    (make_image(fmt='PNG'), 'PNG'),
+    (make_image(fmt='JPEG'), 'JPEG'),
+    (mpo_image(), 'MPO'),
+])
+def test_probe_accepts_png_jpeg_and_mpo(data, fmt):
+    assert probe_image(data) == (fmt, 400, 300)
+
+
+@pytest.mark.parametrize('data, status', [
+    (b'not an image', 400),
+    (make_image(fmt='GIF'), 400),
+    (make_image(width=80, height=300), 400),
+    (make_image(width=2000, height=2000), 413),
+])
+def test_probe_rejects(data, status):
+    with pytest.raises(InvalidImageError) as error:
+        probe_image(data, max_pixels=1_000_000)
+    assert error.value.status == status
+
+
+def test_archive_modes(tmp_path):
+    original = UploadArchive(str(tmp_path), mode='original')
+    path = original.archive('a.png', make_image())
+    original.join()
+    with open(path, 'rb') as f:
+        assert f.read() == make_image()
+
+    downscaled = UploadArchive(str(tmp_path), mode='downscaled', max_width=200)
+    path = downscaled.archive('wide.png', make_image(width=1000))
+    downscaled.join()
+    assert path.endswith('wide.jpg')
+    with Image.open(path) as img:
+        assert (img.format, img.width) == ('JPEG', 200)
+    assert downscaled.stats()['written'] == 1
+
+    assert UploadArchive(str(tmp_path), mode='off').archive('b.png', make_image()) == ''
+    with pytest.raises(ValueError):
+        UploadArchive(str(tmp_path), mode='zip')
+
+
+def test_failed_writes_are_counted(tmp_path):
+    archive = UploadArchive(str(tmp_path / 'missing'))
+    archive.archive('a.png', make_image())
+    archive.join()
+    assert archive.stats()['failed'] == 1
+    assert not os.path.exists(tmp_path / 'missing')
+
+
+def test_upload_validation(client, upload):
+    assert upload(mpo_image(height=310))['success'] is True
+    response = client.post('/upload', data={'prescription': (io.BytesIO(b'not an image'), 'rx.png')},
+                           content_type='multipart/form-data')
+    assert response.status_code == 400
+    assert response.get_json() == {'error': 'File is not a readable image'}
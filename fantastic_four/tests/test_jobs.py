@@ -0,0 +1,63 @@
+import os
+import time
+
+import pytest
+
+from jobs import OCRJobQueue, QueueFullError
+
+
+def double(x):
+    return {'value': x * 2}
+
+
+def crash(x):
+    os._exit(1)
+
+
+def wait_for(queue, job_id, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = queue.get(job_id)
+        if job['status'] in ('done', 'failed'):
+            return job
+        time.sleep(0.02)
+    raise AssertionError(f'job {job_id} did not finish')
+
+
+@pytest.fixture
+def jobs():
+    queue = OCRJobQueue(max_workers=1, max_pending=2)
+    yield queue
+    queue.shutdown()
+
+
+def test_job_runs_and_on_done_shapes_the_result(jobs):
+    job_id = jobs.submit(double, 21, on_done=lambda result: dict(result, seen=True))
+    job = wait_for(jobs, job_id)
+    assert job['status'] == 'done'
+    assert job['result'] == {'value': 42, 'seen': True}
+    assert jobs.stats()['pending'] == 0
+
+
+def test_unknown_job_is_none(jobs):
+    assert jobs.get('nope') is None
+
+
+def test_full_queue_raises(jobs):
+    jobs.submit(time.sleep, 0.5)
+    jobs.submit(time.sleep, 0.5)
+    with pytest.raises(QueueFullError):
+        jobs.submit(double, 1)
+
+
+def test_dead_worker_fails_its_job_and_the_pool_recovers(jobs):
+    results = []
+    job_id = jobs.submit(crash, 1, on_done=lambda result: results.append(result) or result)
+    job = wait_for(jobs, job_id)
+    assert job['status'] == 'failed'
+    assert results == [{'error': 'OCR worker process died'}]
+
+    # The broken pool is replaced, so later jobs still run
+    job = wait_for(jobs, jobs.submit(double, 2))
+    assert job['status'] == 'done'
+    assert job['result'] == {'value': 4}
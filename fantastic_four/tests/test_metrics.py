@@ -0,0 +1,56 @@
+import metrics
+from metrics import Counter, Histogram, Registry
+
+
+def test_counter_render():
+    counter = Counter('rx_things_total', 'Things', ['kind'])
+    counter.inc(kind='a')
+    counter.inc(2, kind='a')
+    counter.inc(kind='quote"d')
+    assert counter.render() == [
+        '# HELP rx_things_total Things',
+        '# TYPE rx_things_total counter',
+        'rx_things_total{kind="a"} 3',
+        'rx_things_total{kind="quote\\"d"} 1'
+    ]
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram('rx_seconds', 'Latency', buckets=(0.1, 1))
+    for value in (0.05, 0.1, 0.5, 3):
+        histogram.observe(value)
+    assert histogram.render()[2:] == [
+        'rx_seconds_bucket{le="0.1"} 2',
+        'rx_seconds_bucket{le="1"} 3',
+        'rx_seconds_bucket{le="+Inf"} 4',
+        'rx_seconds_sum 3.65',
+        'rx_seconds_count 4'
+    ]
+
+
+def test_gauge_is_read_at_render_time():
+    registry = Registry()
+    value = [1]
+    registry.gauge('rx_level', 'Level', lambda: value[0])
+    value[0] = 5
+    assert registry.render().endswith('rx_level 5\n')
+
+
+def test_stages_go_to_the_enclosing_collector():
+    with metrics.collect() as timings:
+        with metrics.stage('ocr'):
+            pass
+        metrics.record([('parse', 0.25)])
+    assert [name for name, _ in timings] == ['ocr', 'parse']
+    assert metrics.server_timing([('ocr', 0.1), ('parse', 0.002), ('ocr', 0.05)]) == 'ocr;dur=150.0, parse;dur=2.0'
+
+
+def test_requests_are_counted_and_timed(app_module, client, upload, monkeypatch):
+    upload()
+    monkeypatch.setitem(app_module.app.config, 'SERVER_TIMING', True)
+    response = client.get('/prescriptions')
+    assert 'total;dur=' in response.headers['Server-Timing']
+    text = client.get('/metrics').get_data(as_text=True)
+    for stage in ('validate_upload', 'schedule', 'store'):
+        assert f'rx_stage_seconds_count{{stage="{stage}"}}' in text
+    assert 'rx_request_seconds_count{method="POST",endpoint="/upload",status="200"}' in text
@@ -0,0 +1,73 @@
+import pytest
+
+import ocr_backends
+
+
+@pytest.fixture
+def settings():
+    """Restore the module's backend settings after a test reconfigures them"""
+    saved = dict(ocr_backends._settings)
+    yield
+    ocr_backends.configure(**saved)
+
+
+def test_parse_tesseract_config():
+    assert ocr_backends.parse_tesseract_config('--oem 1 --psm 6') == {'psm': 6, 'oem': 1}
+    assert ocr_backends.parse_tesseract_config('') == {'psm': 3, 'oem': 3}
+    assert ocr_backends.parse_tesseract_config(None) == {'psm': 3, 'oem': 3}
+
+
+def test_mean_confidence_ignores_non_word_boxes():
+    assert ocr_backends.mean_confidence(['-1', '90', 70, '-1']) == 80
+    assert ocr_backends.mean_confidence(['-1']) == 0.0
+
+
+def test_data_to_text_rebuilds_lines_and_paragraphs():
+    data = {
+        'text': ['', 'Tab', 'Paracetamol', '', 'Twice', 'daily', '', 'Rx'],
+        'block_num': [1, 1, 1, 1, 1, 1, 2, 2],
+        'par_num': [1, 1, 1, 1, 1, 1, 1, 1],
+        'line_num': [0, 1, 1, 2, 2, 2, 0, 1]
+    }
+    assert ocr_backends.data_to_text(data) == 'Tab Paracetamol\nTwice daily\n\nRx'
+
+
+def test_tesserocr_backends_fall_back_without_tesserocr(monkeypatch):
+    monkeypatch.setattr(ocr_backends, 'tesserocr', None)
+    for name in ('auto', 'tesserocr', 'tesserocr-pool', 'pytesseract'):
+        backend = ocr_backends.create_backend(name, nice=5)
+        assert backend.name == 'pytesseract'
+        assert backend.nice == 5
+
+
+def test_auto_prefers_the_engine_pool(monkeypatch):
+    monkeypatch.setattr(ocr_backends, 'tesserocr', object())
+    assert ocr_backends.create_backend('auto', workers=3).size == 3
+    assert ocr_backends.create_backend('auto', workers=0).name == 'tesserocr'
+
+
+def test_backend_is_reused_until_reconfigured(settings):
+    ocr_backends.configure('pytesseract', nice=3)
+    backend = ocr_backends.get_backend()
+    assert ocr_backends.get_backend() is backend
+    assert backend.nice == 3
+
+    ocr_backends.configure('pytesseract', nice=7)
+    assert ocr_backends.get_backend() is not backend
+    assert ocr_backends.get_backend().nice == 7
+
+
+def test_warm_up_runs_once_per_process(app_module, monkeypatch):
+    calls = []
+
+    class Backend:
+        name = 'fake'
+
+        def warm_up(self):
+            calls.append(1)
+
+    monkeypatch.setattr(app_module.ocr_backends, 'get_backend', Backend)
+    monkeypatch.setattr(app_module, '_warm_up_pid', None)
+    app_module.warm_up_ocr()
+    app_module.warm_up_ocr()
+    assert calls == [1]
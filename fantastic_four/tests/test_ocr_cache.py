@@ -0,0 +1,62 @@
+import os
+
+from ocr_cache import OCRCache
+
+
+def test_key_depends_on_image_and_params():
+    key = OCRCache.make_key(b'image', {'psm': 6})
+    assert key == OCRCache.make_key(b'image', {'psm': 6})
+    assert key != OCRCache.make_key(b'image', {'psm': 4})
+    assert key != OCRCache.make_key(b'other', {'psm': 6})
+
+
+def test_memory_and_disk_hits(tmp_path):
+    cache = OCRCache(str(tmp_path))
+    assert cache.get('aa1') is None
+    cache.put('aa1', 'text')
+    assert cache.get('aa1') == 'text'
+
+    # A new instance (another worker, or after a restart) reads the disk tier
+    fresh = OCRCache(str(tmp_path))
+    assert fresh.get('aa1') == 'text'
+    stats = fresh.stats()
+    assert (stats['memory_hits'], stats['disk_hits']) == (0, 1)
+    assert fresh.get('aa1') == 'text'
+    assert fresh.stats()['memory_hits'] == 1
+
+
+def test_memory_tier_is_bounded(tmp_path):
+    cache = OCRCache(str(tmp_path), max_memory_bytes=10)
+    cache.put('aa1', 'x' * 6)
+    cache.put('aa2', 'y' * 6)
+    assert list(cache._memory) == ['aa2']
+    assert cache.stats()['memory_bytes'] == 6
+    assert cache.get('aa1') == 'x' * 6   # Evicted from memory, still on disk
+
+
+def test_overwrite_keeps_disk_total_exact(tmp_path):
+    cache = OCRCache(str(tmp_path))
+    cache.put('aa1', 'x' * 100)
+    cache.put('aa2', 'y' * 10)
+    for _ in range(5):
+        cache.put('aa1', 'z' * 100)
+    assert cache.stats()['disk_bytes'] == 110 == cache._scan_disk_bytes()
+
+
+def test_disk_eviction_keeps_recent_entries(tmp_path):
+    cache = OCRCache(str(tmp_path), max_disk_bytes=250)
+    for i in range(5):
+        cache.put(f'k{i:02d}', str(i) * 100)
+        os.utime(cache._path(f'k{i:02d}'), (i, i))
+    assert cache.stats()['disk_bytes'] <= 250
+    assert os.path.exists(cache._path('k04'))
+    assert not os.path.exists(cache._path('k00'))
+
+
+def test_disk_errors_do_not_fail_put(tmp_path, caplog):
+    cache = OCRCache(str(tmp_path))
+    blocker = tmp_path / 'bl'
+    blocker.write_text('a file where the key directory should be')
+    cache.put('bl1', 'text')
+    assert cache.get('bl1') == 'text'   # Still served from memory
+    assert 'Could not write OCR cache entry' in caplog.text
@@ -0,0 +1,51 @@
+import io
+
+import pytest
+from PIL import Image
+
+import preprocessing
+from benchmarks.synthetic import generate
+
+
+@pytest.fixture(scope='module')
+def samples():
+    return list(generate(4, 3))
+
+
+def test_compat_mode_matches_the_legacy_pipeline(samples):
+    for sample in samples:
+        legacy = preprocessing.preprocess_image_legacy(io.BytesIO(sample['image']))
+        compat = preprocessing.preprocess_image(io.BytesIO(sample['image']), compat=True)
+        assert compat.size == legacy.size
+        assert compat.tobytes() == legacy.tobytes()
+
+
+@pytest.mark.parametrize('mean', [0, 37, 128, 201, 255])
+def test_threshold_lut_matches_contrast_then_threshold(mean):
+    gradient = Image.new('L', (256, 1))
+    gradient.putdata(range(256))
+    # ImageEnhance.Contrast blends the image against a flat image of its mean
+    flat = Image.new('L', (256, 1), mean)
+    blended = Image.blend(flat, gradient, preprocessing.CONTRAST_FACTOR)
+    expected = [0 if x < preprocessing.THRESHOLD else 255 for x in blended.tobytes()]
+    assert preprocessing.threshold_lut(mean) == expected
+
+
+def test_fast_path_clamps_width():
+    small = Image.new('RGB', (400, 300), 'white')
+    wide = Image.new('RGB', (6000, 1000), 'white')
+    for img, width in ((small, preprocessing.TARGET_WIDTH), (wide, preprocessing.MAX_WIDTH)):
+        buf = io.BytesIO()
+        img.save(buf, 'PNG')
+        result = preprocessing.preprocess_image(io.BytesIO(buf.getvalue()))
+        assert result.mode == '1'
+        assert result.width <= max(width, preprocessing.MAX_WIDTH)
+        assert result.width >= min(width, preprocessing.TARGET_WIDTH)
+
+
+def test_otsu_splits_a_two_tone_image():
+    img = Image.new('L', (100, 10), 40)
+    img.paste(200, (50, 0, 100, 10))
+    threshold = preprocessing.otsu_threshold(img)
+    assert 40 < threshold <= 200
+    assert sorted(set(preprocessing.binarize_otsu(img).convert('L').tobytes())) == [0, 255]
@@ -0,0 +1,42 @@
+import pytest
+
+import prescription_parser
+from benchmarks.parser_bench import check_golden, load_corpus
+from conftest import OCR_TEXT
+
+
+def test_corpus_matches_the_golden_output():
+    texts, golden = load_corpus()
+    assert texts
+    assert check_golden(texts, golden) == []
+
+
+def test_numbered_medicines():
+    medicines = prescription_parser.parse_prescription_text(OCR_TEXT)['medicines']
+    assert [(m['name'], m['dosage'], m['frequency'], m['duration']) for m in medicines] == [
+        ('Tab Paracetamol', '500mg', 'Twice daily', '5 days'),
+        ('Cap Omeprazole', '20mg', 'Once daily', '7 days')
+    ]
+
+
+def test_patient_and_date():
+    data = prescription_parser.parse_prescription_text(OCR_TEXT)
+    assert (data['patient_name'], data['patient_age'], data['date']) == ('Ravi Kumar', '42', '01/02/2025')
+
+
+def test_default_date_when_the_text_has_none():
+    text = OCR_TEXT.replace('Date: 01/02/2025\n', '')
+    assert prescription_parser.parse_prescription_text(text, default_date='2025-03-04')['date'] == '2025-03-04'
+
+
+@pytest.mark.parametrize('frequency, timing', [
+    ('Once daily', ['09:00']),
+    ('Twice daily', ['09:00', '21:00']),
+    ('1-0-1', ['09:00', '21:00']),
+])
+def test_timing_from_frequency(frequency, timing):
+    assert prescription_parser.parse_timing_from_frequency(frequency) == timing
+
+
+def test_frequency_abbreviations():
+    assert prescription_parser.extract_frequency_from_text('take BD after food') == 'BD'
@@ -0,0 +1,103 @@
+import threading
+
+import pytest
+from PIL import Image, ImageDraw
+
+import regions
+
+
+def text_line(draw, left, top, right, height=14):
+    """Glyph-sized marks, so the line reads as text rather than an image"""
+    for x in range(left, right, 16):
+        draw.rectangle((x, top, x + 4, top + height), fill=0)
+
+
+def page(lines, size=(800, 1200), columns=False):
+    img = Image.new('L', size, 255)
+    draw = ImageDraw.Draw(img)
+    for top in lines:
+        if columns:
+            text_line(draw, 40, top, 300)
+            text_line(draw, 500, top, 760)
+        else:
+            text_line(draw, 40, top, 600)
+    return img
+
+
+class FakeBackend:
+    """Answers with each crop's size and records which threads did the OCR"""
+
+    def __init__(self):
+        self.threads = set()
+
+    def image_to_string(self, img, config=''):
+        self.threads.add(threading.current_thread().name)
+        return f'{img.size}\n'
+
+
+def test_bands_in_reading_order():
+    boxes = regions.find_regions(page([400, 600, 800]))
+    assert [top for _, top, _, _ in boxes] == sorted(top for _, top, _, _ in boxes)
+    assert len(boxes) == 3
+    for (_, top, _, bottom), line in zip(boxes, [400, 600, 800]):
+        assert top <= line and bottom >= line + 14
+
+
+def test_wide_gutter_splits_columns():
+    boxes = regions.find_regions(page([400], columns=True))
+    assert len(boxes) == 2
+    (left, _, left_end, _), (right, _, _, _) = boxes
+    assert left < left_end < right
+
+
+def test_bands_are_merged_down_to_max_regions():
+    boxes = regions.find_regions(page(range(100, 1100, 50)), max_regions=4)
+    assert len(boxes) == 4
+
+
+def test_rx_only_drops_letterhead_footer_and_images():
+    img = page([400, 460])
+    draw = ImageDraw.Draw(img)
+    text_line(draw, 40, 40, 760)                      # Letterhead
+    draw.rectangle((40, 700, 440, 900), fill=0)      # Logo or stamp
+    text_line(draw, 500, 1130, 760)                   # Signature
+    boxes = regions.find_regions(img, rx_only=True)
+    assert all(top >= 300 and bottom <= 600 for _, top, _, bottom in boxes)
+    assert len(regions.find_regions(img)) > len(boxes)
+
+
+def test_rx_box_spans_the_kept_regions():
+    left, top, right, bottom = regions.rx_box(page([400, 460, 520]))
+    assert top < 400 and bottom > 534 and left < 40 and right > 590
+    assert regions.rx_box(Image.new('L', (100, 100), 255)) is None
+
+
+def test_ocr_regions_stitches_in_reading_order():
+    backend = FakeBackend()
+    img = Image.new('L', (800, 1200), 255)
+    draw = ImageDraw.Draw(img)
+    for top, right in ((300, 600), (600, 200), (900, 400)):   # Distinct widths identify the crops
+        text_line(draw, 40, top, right)
+    text = regions.ocr_regions(img, backend, max_workers=2)
+    expected = [str((r - l, b - t)) for l, t, r, b in regions.find_regions(img)]
+    assert text.splitlines() == expected
+    assert all(name.startswith('region-ocr') for name in backend.threads)
+
+
+def test_single_region_is_ocrd_in_the_calling_thread():
+    backend = FakeBackend()
+    regions.ocr_regions(page([400]), backend)
+    assert backend.threads == {threading.current_thread().name}
+
+
+def test_one_worker_ocrs_regions_inline(monkeypatch):
+    monkeypatch.setattr(regions, 'get_executor', lambda max_workers=None: pytest.fail('no pool with one worker'))
+    backend = FakeBackend()
+    text = regions.ocr_regions(page([400, 600, 800]), backend, max_workers=1)
+    assert len(text.splitlines()) == 3
+    assert backend.threads == {threading.current_thread().name}
+
+
+def test_region_ocr_is_off_by_default(app_module):
+    assert app_module.OCR_REGIONS == 'off'
+    assert app_module.ocr_params()['regions'] == 'off'
@@ -0,0 +1,88 @@
+import queue
+from datetime import datetime, time, timedelta, timezone
+
+import pytest
+
+import reminders
+from reminders import ReminderScheduler
+from schedules import Schedule
+
+
+def prescription(start, time, names=('Paracetamol',)):
+    medicines = [{'name': name, 'dosage': '500mg', 'duration': '3 days', 'timing': [time]} for name in names]
+    return {'schedule': Schedule.from_medicines(medicines, start=start)}
+
+
+def test_reminder_kinds_follow_the_offsets():
+    kinds = reminders.reminder_kinds(dict(reminders.DEFAULT_OFFSETS, reminder1=30))
+    assert kinds[0] == ('due_soon', 'reminder1', -30)
+    assert [kind for kind, _, _ in kinds] == ['due_soon', 'due_soon', 'due_soon', 'due_now', 'overdue']
+
+
+def test_subscribing_schedules_the_horizon_once_per_channel():
+    tomorrow = datetime.now().date() + timedelta(days=1)
+    record = prescription(tomorrow, '09:00')
+    scheduler = ReminderScheduler(lambda prescription_id: record)
+    first = scheduler.subscribe('RX1')
+    second = scheduler.subscribe('RX1')
+    # Five reminders for tomorrow's dose plus the midnight refill
+    assert scheduler.stats() == {'channels': 1, 'subscribers': 2, 'pending_events': 6}
+    custom = scheduler.subscribe('RX1', offsets={'overdue': 30})
+    assert scheduler.stats()['channels'] == 2
+
+    for subscriber in (first, second, custom):
+        scheduler.unsubscribe(subscriber)
+    assert scheduler.stats()['channels'] == 0
+
+
+def test_due_doses_are_pushed_without_the_taken_ones(monkeypatch):
+    # Doses due in the current minute count as on time
+    monkeypatch.setattr(reminders, 'LATE_TOLERANCE', timedelta(minutes=2))
+    now = datetime.now()
+    if now.hour == 23 and now.minute == 59:
+        pytest.skip('the dose would be on another day by the time it fires')
+    record = prescription(now.date(), now.strftime('%H:%M'), names=('Paracetamol', 'Omeprazole'))
+    record['schedule'].mark(f"{now.date().isoformat()}_{now.strftime('%H:%M')}_Omeprazole")
+
+    scheduler = ReminderScheduler(lambda prescription_id: record)
+    subscriber = scheduler.subscribe('RX1')
+    events = []
+    while not any(event['type'] == 'due_now' for event in events):
+        events.append(subscriber.get(timeout=5))
+    event = events[-1]
+    assert (event['prescription_id'], event['time']) == ('RX1', now.strftime('%H:%M'))
+    assert [med['medicine'] for med in event['medications']] == ['Paracetamol']
+
+    scheduler.unsubscribe(subscriber)
+    with pytest.raises(queue.Empty):
+        subscriber.get(timeout=0.1)
+
+
+def test_prescriptions_are_loaded_outside_the_lock():
+    tomorrow = datetime.now().date() + timedelta(days=1)
+    record = prescription(tomorrow, '09:00')
+    held = []
+
+    def load(prescription_id):
+        held.append(scheduler._cond._is_owned())
+        return record
+    scheduler = ReminderScheduler(load)
+    scheduler.subscribe('RX1')
+    assert held and not any(held)
+
+
+def test_dose_times_are_in_the_subscriber_timezone():
+    now = datetime.now(timezone.utc)
+    tz = timezone(timedelta(hours=5, minutes=30))
+    start = now.astimezone(tz).date() + timedelta(days=1)
+    scheduler = ReminderScheduler(lambda prescription_id: prescription(start, '09:00'))
+    scheduler.subscribe('RX1', tz_offset=330)
+    due_now = [entry[0] for entry in scheduler._heap if entry[3] == 'due_now']
+    assert due_now == [datetime.combine(start, time(9), tzinfo=tz)]
+    assert due_now[0].astimezone(timezone.utc).time() == time(3, 30)
+
+
+def test_stream_rejects_a_bad_tz_offset(client, upload):
+    prescription_id = upload()['prescription_id']
+    assert client.get(f'/reminders/{prescription_id}/stream?tz_offset=900').status_code == 400
+    assert client.get(f'/reminders/{prescription_id}/stream?tz_offset=east').status_code == 400
@@ -0,0 +1,73 @@
+import json
+import os
+
+import reprocess
+
+
+def fake_process(path):
+    return {'image': os.path.basename(path), 'ocr': 'cached', 'result': {'size': os.path.getsize(path)}}
+
+
+def archive(folder, names):
+    os.makedirs(folder, exist_ok=True)
+    for name in names:
+        with open(os.path.join(folder, name), 'wb') as f:
+            f.write(name.encode())
+
+
+def result(medicines, **fields):
+    return {'result': dict(fields, medicines=medicines)}
+
+
+def test_only_images_are_listed(tmp_path):
+    archive(str(tmp_path), ['b.jpg', 'a.PNG', 'notes.txt'])
+    os.mkdir(tmp_path / 'c.png')
+    assert reprocess.list_images(str(tmp_path)) == ['a.PNG', 'b.jpg']
+
+
+def test_run_resumes_after_an_interruption(tmp_path):
+    folder, output = str(tmp_path / 'uploads'), str(tmp_path / 'runs' / 'run.ndjson')
+    archive(folder, ['1.png', '2.png', '3.png'])
+    os.makedirs(os.path.dirname(output))
+    with open(output, 'w') as f:
+        f.write(json.dumps(fake_process(os.path.join(folder, '1.png'))) + '\n{"image": "2.p')   # Cut off mid-line
+
+    progress = reprocess.run(folder, output, fake_process, workers=2)
+    assert (progress.processed, progress.done, progress.ocr_cached) == (2, 3, 2)
+    assert sorted(reprocess.load_results(output)) == ['1.png', '2.png', '3.png']
+    with open(output) as f:
+        assert len(f.readlines()) == 3
+
+    assert reprocess.run(folder, output, fake_process).processed == 0
+
+
+def test_diff_record():
+    old = result([{'name': 'Paracetamol', 'dosage': '500mg'}, {'name': 'Cetirizine'}], date='01/02/2025')
+    new = result([{'name': 'paracetamol', 'dosage': '650mg'}], date='01/02/2025', patient_name='Ravi')
+    assert reprocess.diff_record(old, new) == {
+        'patient_name': [None, 'Ravi'],
+        'medicines[cetirizine]': [{'name': 'Cetirizine'}, None],
+        'medicines[paracetamol].dosage': ['500mg', '650mg'],
+        'medicines[paracetamol].name': ['Paracetamol', 'paracetamol']
+    }
+    assert reprocess.diff_record({'error': 'x'}, {'error': 'x'}) == {}
+    assert reprocess.diff_record({'error': 'x'}, new) == {'error': ['x', None]}
+
+
+def test_diff_runs(tmp_path):
+    def write(path, records):
+        with open(path, 'w') as f:
+            for image, record in records.items():
+                f.write(json.dumps(dict(record, image=image)) + '\n')
+
+    previous, current, diff = (str(tmp_path / name) for name in ('a.ndjson', 'b.ndjson', 'b.diff.ndjson'))
+    write(previous, {'1.png': result([], date='1'), '2.png': result([{'name': 'X', 'dosage': '1'}]),
+                     'old.png': result([])})
+    write(current, {'1.png': result([], date='1'), '2.png': result([{'name': 'X', 'dosage': '2'}]),
+                    'new.png': result([])})
+    summary = reprocess.diff_runs(previous, current, diff)
+    assert summary == {'compared': 2, 'unchanged': 1, 'changed': 1, 'only_in_previous': 1, 'only_in_current': 1,
+                       'changed_fields': {'medicines.dosage': 1}}
+    with open(diff) as f:
+        assert [json.loads(line)['image'] for line in f] == ['2.png']
+    assert reprocess.previous_run(str(tmp_path), exclude=current) == previous
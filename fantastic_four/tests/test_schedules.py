@@ -0,0 +1,175 @@
+from datetime import date
+
+import pytest
+
+from schedules import Schedule, dose_id, parse_dose_id, parse_duration_to_days, parse_window
+
+START = date(2025, 1, 1)
+MEDICINES = [
+    {'name': 'Paracetamol', 'dosage': '500mg', 'duration': '5 days', 'timing': ['09:00', '21:00']},
+    {'name': 'Omeprazole', 'dosage': '20mg', 'duration': '2 weeks', 'timing': ['08:00']},
+]
+
+
+@pytest.fixture
+def schedule():
+    return Schedule.from_medicines(MEDICINES, start=START)
+
+
+@pytest.mark.parametrize('duration, days', [('5 days', 5), ('2 weeks', 14), ('1 month', 30), ('as needed', 7)])
+def test_parse_duration(duration, days):
+    assert parse_duration_to_days(duration) == days
+
+
+def test_dose_ids_round_trip():
+    medication_id = dose_id('2025-01-03', '09:00', 'Vitamin_D3')
+    assert parse_dose_id(medication_id) == (date(2025, 1, 3), '09:00', 'Vitamin_D3')
+    assert parse_dose_id('not-a-dose') is None
+    assert parse_dose_id('2025-13-01_09:00_X') is None
+
+
+def test_rules_expand_into_days(schedule):
+    assert schedule.total_doses == 5 * 2 + 14
+    assert schedule.end == date(2025, 1, 14)
+    first = schedule.day(0)
+    assert first['date'] == '2025-01-01'
+    assert [(m['time'], m['medicine']) for m in first['medications']] == [
+        ('08:00', 'Omeprazole'), ('09:00', 'Paracetamol'), ('21:00', 'Paracetamol')
+    ]
+    assert [m['medicine'] for m in schedule.day(5)['medications']] == ['Omeprazole']
+
+
+def test_expand_pages_by_days(schedule):
+    days, next_from = schedule.expand(limit=10)
+    assert len(days) == 10 and next_from == '2025-01-11'
+    days, next_from = schedule.expand(first=date.fromisoformat(next_from), limit=10)
+    assert [d['date'] for d in days] == ['2025-01-11', '2025-01-12', '2025-01-13', '2025-01-14']
+    assert next_from is None
+    days, next_from = schedule.expand()
+    assert (len(days), next_from) == (14, None)
+
+
+def test_doses_are_lazy_and_ordered(schedule):
+    doses = schedule.doses(first=date(2025, 1, 5), last=date(2025, 1, 6))
+    assert next(doses) == ('2025-01-05', schedule.dose('2025-01-05_08:00_Omeprazole'))
+    assert [d['id'] for _, d in doses] == [
+        '2025-01-05_09:00_Paracetamol', '2025-01-05_21:00_Paracetamol', '2025-01-06_08:00_Omeprazole'
+    ]
+
+
+def test_find_maps_ids_to_bits(schedule):
+    assert schedule.find('2025-01-02_21:00_Paracetamol') == (0, 1, 1)
+    assert schedule.find('2025-01-06_09:00_Paracetamol') is None   # Past the rule's 5 days
+    assert schedule.find('2025-01-02_10:00_Paracetamol') is None   # Not one of its times
+    assert schedule.find('2024-12-31_08:00_Omeprazole') is None    # Before the start
+    assert schedule.find('2025-01-02_08:00_Ibuprofen') is None
+
+
+def test_taken_bitmaps_survive_a_round_trip(schedule):
+    schedule.mark('2025-01-02_21:00_Paracetamol')
+    assert schedule.taken[0] == 1 << 3
+    restored = Schedule.from_dict(schedule.to_dict(), ['2025-01-02_21:00_Paracetamol', 'bogus'])
+    assert restored.taken == schedule.taken
+    assert restored.dose('2025-01-02_21:00_Paracetamol')['taken'] is True
+
+
+def test_parse_window():
+    assert parse_window({'from': '2025-01-02', 'limit': '7'}) == (date(2025, 1, 2), None, 7)
+    assert parse_window({}) == (None, None, None)      # No window: the whole course
+    for args in ({'from': 'yesterday'}, {'limit': 'x'}, {'limit': '0'}):
+        with pytest.raises(ValueError):
+            parse_window(args)
+
+
+def test_mark_keeps_the_counters_current(schedule):
+    schedule.mark('2025-01-01_09:00_Paracetamol')
+    schedule.mark('2025-01-01_08:00_Omeprazole')
+    schedule.mark('2025-01-01_08:00_Omeprazole')   # Marking twice counts once
+    schedule.mark('2025-01-02_08:00_Omeprazole')
+    schedule.mark('2025-01-02_08:00_Omeprazole', taken=False)
+    assert schedule.mark('2025-02-01_08:00_Omeprazole') is None
+    assert (schedule.taken_total, schedule.taken_by_day) == (2, {0: 2})
+    assert schedule.day(0)['taken_doses'] == 2
+    stats = schedule.statistics()
+    assert (stats['taken'], stats['missed']) == (2, 22)
+    assert stats['by_medicine']['Paracetamol']['adherence_rate'] == 10.0
+    assert schedule.check_counters() == []
+
+
+def test_check_counters_reports_drift(schedule):
+    schedule.mark('2025-01-01_09:00_Paracetamol')
+    schedule.taken_total += 1
+    schedule.taken_by_day[3] = 1
+    assert schedule.check_counters() == ['taken_total: 2 != 1', 'taken_by_day[3]: 1 != 0']
+
+
+def test_loaded_counters_are_incremental(schedule, monkeypatch):
+    taken = ['2025-01-01_09:00_Paracetamol', '2025-01-03_08:00_Omeprazole']
+    assert Schedule.from_dict(schedule.to_dict(), taken).check_counters() == []
+
+    # A broken per-dose update shows up in a freshly loaded schedule too
+    update = Schedule._set
+
+    def miscount(self, index, offset, slot, taken):
+        update(self, index, offset, slot, taken)
+        self.taken_by_day[offset + 1] = 1
+    monkeypatch.setattr(Schedule, '_set', miscount)
+    assert Schedule.from_dict(schedule.to_dict(), taken).check_counters() == [
+        'taken_by_day[1]: 1 != 0', 'taken_by_day[3]: 1 != 0'
+    ]
+
+
+def test_mark_taken_endpoint_and_cli_check(app_module, client, upload):
+    prescription_id = upload()['prescription_id']
+    runner = app_module.app.test_cli_runner()
+    schedule = client.get(f'/schedule/{prescription_id}').get_json()['schedule']
+    dose = schedule[0]['medications'][0]
+    response = client.post('/mark_taken', json={'prescription_id': prescription_id, 'medication_id': dose['id']})
+    assert response.get_json()['medication']['taken'] is True
+    response = client.post('/mark_taken', json={'prescription_id': prescription_id, 'medication_id': 'x_y_z'})
+    assert response.status_code == 404
+
+    dashboard = client.get(f'/family_dashboard/{prescription_id}').get_json()
+    assert dashboard['statistics']['taken'] == 1
+    assert runner.invoke(args=['check-counters']).exit_code == 0
+
+    # A corrupted counter is reported and fails the command
+    app_module.storage.get_prescription(prescription_id)['schedule'].taken_total += 1
+    try:
+        result = runner.invoke(args=['check-counters'])
+        assert result.exit_code == 1
+        assert f'{prescription_id}: taken_total: 2 != 1' in result.output
+    finally:
+        app_module.storage.get_prescription(prescription_id)['schedule'].taken_total -= 1
+
+
+def test_cli_check_catches_drift_in_a_fresh_load(app_module, client, upload, monkeypatch):
+    prescription_id = upload()['prescription_id']
+    dose = client.get(f'/schedule/{prescription_id}').get_json()['schedule'][0]['medications'][0]
+    client.post('/mark_taken', json={'prescription_id': prescription_id, 'medication_id': dose['id']})
+
+    update = Schedule._set
+
+    def miscount(self, index, offset, slot, taken):
+        update(self, index, offset, slot, taken)
+        self.taken_total += 1
+    monkeypatch.setattr(Schedule, '_set', miscount)
+    monkeypatch.setattr(app_module.storage, '_cache', type(app_module.storage._cache)())
+    result = app_module.app.test_cli_runner().invoke(args=['check-counters'])
+    assert result.exit_code == 1
+    assert f'{prescription_id}: taken_total: 2 != 1' in result.output
+
+
+def test_endpoints_return_the_whole_course_without_a_window(app_module, client):
+    medicines = [{'name': 'Metformin', 'dosage': '500mg', 'duration': '2 months', 'timing': ['08:00']}]
+    app_module.storage.insert_prescription('RX_LONG_COURSE', {
+        'data': {'patient_name': 'Long Course', 'medicines': medicines},
+        'schedule': Schedule.from_medicines(medicines, start=START),
+        'duration_days': 60,
+        'created_at': '2025-01-01T09:00:00'
+    })
+    for url in ('/schedule/RX_LONG_COURSE', '/family_dashboard/RX_LONG_COURSE'):
+        body = client.get(url).get_json()
+        assert (len(body['schedule']), body['next_from']) == (60, None)
+    body = client.get('/schedule/RX_LONG_COURSE?limit=31').get_json()
+    assert (len(body['schedule']), body['next_from']) == (31, '2025-02-01')
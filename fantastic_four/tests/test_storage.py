@@ -0,0 +1,176 @@
+import threading
+from datetime import date
+
+import pytest
+
+from schedules import Schedule
+from storage import PrescriptionExistsError, Storage
+
+MEDICINES = [{'name': 'Paracetamol', 'dosage': '500mg', 'duration': '3 days', 'timing': ['09:00', '21:00']}]
+
+
+def record(patient_name='Ravi Kumar', created_at='2025-01-01T09:00:00', **data):
+    return {
+        'data': dict(data, patient_name=patient_name, medicines=MEDICINES),
+        'schedule': Schedule.from_medicines(MEDICINES, start=date(2025, 1, 1)),
+        'duration_days': 3,
+        'created_at': created_at
+    }
+
+
+@pytest.fixture
+def storage(tmp_path):
+    return Storage(str(tmp_path / 'data' / 'prescriptions.db'))
+
+
+def test_insert_refuses_an_existing_id(storage):
+    storage.insert_prescription('RX1', record())
+    with pytest.raises(PrescriptionExistsError):
+        storage.insert_prescription('RX1', record(patient_name='Someone Else'))
+    assert storage.get_prescription('RX1')['data']['patient_name'] == 'Ravi Kumar'
+
+
+def test_new_prescriptions_start_at_version_1(storage):
+    storage.insert_prescription('RX1', record())
+    assert storage.get_prescription('RX1')['version'] == 1
+    assert storage.get_prescription('missing') is None
+
+
+def test_cache_is_reused_and_bounded(tmp_path):
+    storage = Storage(str(tmp_path / 'rx.db'), cache_entries=2)
+    for prescription_id in ('RX1', 'RX2', 'RX3'):
+        storage.insert_prescription(prescription_id, record())
+    first = storage.get_prescription('RX1')
+    assert storage.get_prescription('RX1') is first
+    storage.get_prescription('RX2')
+    storage.get_prescription('RX1')      # Most recently used again
+    storage.get_prescription('RX3')
+    assert list(storage._cache) == ['RX1', 'RX3']
+
+
+def test_marks_are_logged_and_bump_the_version(storage):
+    storage.insert_prescription('RX1', record())
+    ids = [f'2025-01-0{day}_{time}_Paracetamol' for day in (1, 2, 3) for time in ('09:00', '21:00')]
+    threads = [threading.Thread(target=storage.mark_taken, args=('RX1', i, True, '2025-01-01T10:00:00'))
+               for i in ids]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    storage.mark_taken('RX1', ids[0], False, '2025-01-01T11:00:00')
+
+    logs = storage.get_logs('RX1')
+    assert len(logs) == 6 and logs[ids[0]] == {'taken': False, 'timestamp': '2025-01-01T11:00:00'}
+    loaded = storage.get_prescription('RX1')
+    assert loaded['version'] == 1 + 7
+    assert loaded['schedule'].taken_total == 5
+
+
+def test_marks_update_the_cached_record_without_a_recount(storage, monkeypatch):
+    storage.insert_prescription('RX1', record())
+    cached = storage.get_prescription('RX1')
+    recounts = []
+    recount = Schedule.recount
+    monkeypatch.setattr(Schedule, 'recount', lambda self: recounts.append(self) or recount(self))
+
+    storage.mark_taken('RX1', '2025-01-02_21:00_Paracetamol', True, '2025-01-02T21:05:00')
+    loaded = storage.get_prescription('RX1')
+    assert loaded is cached and recounts == []
+    assert (loaded['version'], loaded['schedule'].taken_total) == (2, 1)
+    assert loaded['schedule'].dose('2025-01-02_21:00_Paracetamol')['taken'] is True
+
+    # A write from another worker leaves the cached copy behind, so it is reloaded
+    storage.conn.execute("UPDATE prescriptions SET version = version + 1 WHERE id = 'RX1'")
+    storage.mark_taken('RX1', '2025-01-03_09:00_Paracetamol', True, '2025-01-03T09:05:00')
+    assert 'RX1' not in storage._cache
+    assert storage.get_prescription('RX1')['schedule'].taken_total == 2
+
+
+def test_patients(storage):
+    storage.save_patient('p1', {'name': 'Ravi Kumar', 'phone_number': '123'})
+    assert storage.get_patient('p1')['phone_number'] == '123'
+    assert storage.get_patient('p2') is None
+
+
+def test_same_second_uploads_get_distinct_ids(app_module):
+    results = []
+
+    def save():
+        data = {'patient_name': 'Ravi Kumar', 'medicines': MEDICINES}
+        results.append(app_module.save_prescription(data, {}, 'rx.png', '20250101_090000')['prescription_id'])
+
+    threads = [threading.Thread(target=save) for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(set(results)) == 10
+    assert all(i.startswith('RX20250101_090000_') for i in results)
+
+
+def test_id_collisions_are_retried(app_module, monkeypatch):
+    suffixes = iter(['dup', 'dup', 'new'])
+    monkeypatch.setattr(app_module.secrets, 'token_hex', lambda n: next(suffixes))
+    data = {'patient_name': 'Ravi Kumar', 'medicines': MEDICINES}
+    first = app_module.save_prescription(dict(data), {}, 'rx.png', '20250101_080000')
+    second = app_module.save_prescription(dict(data), {}, 'rx.png', '20250101_080000')
+    assert (first['prescription_id'], second['prescription_id']) == ('RX20250101_080000_dup', 'RX20250101_080000_new')
+
+
+@pytest.fixture
+def listed(storage):
+    """Seven prescriptions for two patients over three days, two of them created in the same second"""
+    created = ['2025-01-01T09:00:00', '2025-01-01T10:00:00', '2025-01-02T09:00:00', '2025-01-02T09:00:00',
+               '2025-01-03T09:00:00', '2025-01-03T12:00:00', '2025-01-03T18:00:00']
+    for i, created_at in enumerate(created):
+        patient = 'Ravi Kumar' if i % 2 else 'Asha Rao'
+        storage.insert_prescription(f'RX{i}', record(patient_name=patient, created_at=created_at, date='01/01/2025'))
+    return storage
+
+
+def test_cursor_pages_cover_every_row_once(listed):
+    everything, cursor = listed.list_prescriptions()
+    assert cursor is None
+    assert [row['id'] for row in everything] == ['RX6', 'RX5', 'RX4', 'RX3', 'RX2', 'RX1', 'RX0']
+
+    seen, cursor = [], None
+    while True:
+        rows, cursor = listed.list_prescriptions(limit=3, cursor=cursor)
+        seen.extend(row['id'] for row in rows)
+        if cursor is None:
+            break
+    assert seen == [row['id'] for row in everything]
+
+
+def test_page_rows_are_summaries(listed):
+    (row,), _ = listed.list_prescriptions(limit=1)
+    assert row == {
+        'id': 'RX6', 'patient_name': 'Asha Rao', 'patient_id': row['patient_id'], 'date': '01/01/2025',
+        'medicines_count': 1, 'duration_days': 3, 'created_at': '2025-01-03T18:00:00'
+    }
+    assert row['patient_id'].startswith('PT')
+
+
+def test_filters(listed):
+    rows, _ = listed.list_prescriptions(limit=10, patient='ravi kumar')
+    assert [row['id'] for row in rows] == ['RX5', 'RX3', 'RX1']
+    rows, _ = listed.list_prescriptions(limit=10, created_from='2025-01-02', created_to='2025-01-03')
+    assert [row['id'] for row in rows] == ['RX3', 'RX2']
+
+
+@pytest.mark.parametrize('cursor', ['!!!', 'bm90IGpzb24', 'WzEsIDJd'])
+def test_malformed_cursor(listed, cursor):
+    with pytest.raises(ValueError):
+        listed.list_prescriptions(limit=2, cursor=cursor)
+
+
+def test_prescriptions_endpoint_pages(client, upload):
+    for _ in range(3):
+        upload(patient_name='Paging Patient')
+    page = client.get('/prescriptions?patient=paging patient&limit=2').get_json()
+    assert len(page['prescriptions']) == 2 and page['next_cursor']
+    rest = client.get(f"/prescriptions?patient=paging patient&limit=2&cursor={page['next_cursor']}").get_json()
+    assert len(rest['prescriptions']) == 1 and rest['next_cursor'] is None
+    assert client.get('/prescriptions?cursor=bogus').status_code == 400
+    assert client.get('/prescriptions?limit=0').status_code == 400
+    assert isinstance(client.get('/prescriptions').get_json(), list)
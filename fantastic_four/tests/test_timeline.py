@@ -0,0 +1,67 @@
+from datetime import date
+
+import timeline
+from schedules import Schedule
+from storage import patient_key
+
+
+def schedule(start, *medicines):
+    return Schedule.from_medicines([
+        {'name': name, 'dosage': '1', 'duration': duration, 'timing': times} for name, duration, times in medicines
+    ], start=start)
+
+
+A = schedule(date(2025, 1, 1), ('Paracetamol', '3 days', ['09:00', '21:00']))
+B = schedule(date(2025, 1, 2), ('paracetamol ', '3 days', ['09:00']), ('Omeprazole', '2 days', ['08:00']))
+
+
+def test_merge_orders_doses_across_prescriptions():
+    days, next_from = timeline.merge([('A', A), ('B', B)])
+    assert next_from is None
+    assert [day['date'] for day in days] == ['2025-01-01', '2025-01-02', '2025-01-03', '2025-01-04']
+    assert [(d['time'], d['prescription_id']) for d in days[1]['medications']] == [
+        ('08:00', 'B'), ('09:00', 'A'), ('09:00', 'B'), ('21:00', 'A')
+    ]
+
+
+def test_merge_pages_by_days():
+    days, next_from = timeline.merge([('A', A), ('B', B)], limit=2)
+    assert [day['date'] for day in days] == ['2025-01-01', '2025-01-02']
+    assert next_from == '2025-01-03'
+    days, next_from = timeline.merge([('A', A), ('B', B)], first=date(2025, 1, 4))
+    assert [d['prescription_id'] for d in days[0]['medications']] == ['B']
+    assert timeline.merge([]) == ([], None)
+
+
+def test_overlapping_doses_are_flagged():
+    days, _ = timeline.merge([('A', A), ('B', B)], first=date(2025, 1, 2), limit=1)
+    flags = {(d['prescription_id'], d['time']): (d['overlaps_with'], d['duplicate']) for d in days[0]['medications']}
+    assert flags == {
+        ('B', '08:00'): ([], False),
+        ('A', '09:00'): (['B'], True),
+        ('B', '09:00'): (['A'], True),
+        ('A', '21:00'): (['B'], False),
+    }
+
+
+def test_overlapping_rules():
+    assert timeline.overlapping_rules([('A', A), ('B', B)]) == [{
+        'medicine': 'Paracetamol', 'prescriptions': ['A', 'B'], 'from': '2025-01-02', 'to': '2025-01-03',
+        'same_times': ['09:00']
+    }]
+
+
+def test_patient_timeline_endpoint(client, upload):
+    first = upload(patient_name='Timeline Patient', phone_number='555 0100')
+    second = upload(patient_name='timeline  patient', phone_number='5550100')
+    patient_id = first['data']['patient_id']
+    assert patient_id == second['data']['patient_id'] == patient_key({'patient_name': 'Timeline Patient',
+                                                                      'phone_number': '5550100'})
+
+    body = client.get(f'/patient/{patient_id}/timeline?limit=1').get_json()
+    assert [rx['id'] for rx in body['prescriptions']] == [first['prescription_id'], second['prescription_id']]
+    assert all(dose['duplicate'] for dose in body['schedule'][0]['medications'])
+    assert {overlap['medicine'] for overlap in body['overlaps']} == {
+        med['name'] for med in first['data']['medicines']
+    }
+    assert client.get('/patient/nobody/timeline').status_code == 404
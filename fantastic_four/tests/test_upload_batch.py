@@ -0,0 +1,89 @@
+import io
+import json
+import os
+
+import pytest
+
+from conftest import OCR_TEXT, make_image
+from jobs import OCRJobQueue
+
+
+def fake_ocr(image_bytes, rx_only=False):
+    if image_bytes.endswith(b'CRASH'):
+        os._exit(1)
+    return OCR_TEXT
+
+
+@pytest.fixture
+def batch(app_module, client, monkeypatch):
+    """POST /upload_batch through a fresh job queue whose workers run fake_ocr; returns the NDJSON lines"""
+    monkeypatch.setattr(app_module, 'run_ocr', fake_ocr)
+    # Workers fork from here, after the patch
+    jobs = OCRJobQueue(max_workers=1, max_pending=4)
+    monkeypatch.setattr(app_module, 'ocr_jobs', jobs)
+
+    def batch(images, **form):
+        files = [(io.BytesIO(image), f'page{i}.png') for i, image in enumerate(images)]
+        response = client.post('/upload_batch', data=dict(form, files=files), content_type='multipart/form-data')
+        if response.mimetype != 'application/x-ndjson':
+            return response
+        return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    yield batch
+    jobs.shutdown()
+
+
+def images(count, tag):
+    # Distinct images, so the OCR cache never answers for another test's page
+    return [make_image(height=400 + i) + tag.encode() for i in range(count)]
+
+
+def test_separate_prescriptions(batch):
+    lines = batch(images(3, 'separate'))
+    assert lines[-1] == {'done': True, 'prescriptions': 3, 'failed': 0}
+    assert sorted(line['index'] for line in lines[:-1]) == [0, 1, 2]
+    assert len({line['prescription_id'] for line in lines[:-1]}) == 3
+    assert all(len(line['data']['medicines']) == 2 for line in lines[:-1])
+
+
+def test_pages_of_one_prescription(batch):
+    lines = batch(images(2, 'pages'), mode='pages')
+    assert len(lines) == 2
+    assert lines[0]['files'] == ['page0.png', 'page1.png']
+    assert len(lines[0]['data']['image_paths']) == 2
+
+
+def test_groups_mix_both(batch):
+    lines = batch(images(3, 'groups'), group=['a', 'b', 'a'])
+    assert sorted(line['files'] for line in lines[:-1]) == [['page0.png', 'page2.png'], ['page1.png']]
+
+
+def test_a_crashed_page_fails_only_its_prescription(batch):
+    pages = images(2, 'crash')
+    pages[1] += b'CRASH'
+    lines = batch(pages)
+    assert lines[-1] == {'done': True, 'prescriptions': 2, 'failed': 1}
+    failed = [line for line in lines[:-1] if 'error' in line]
+    assert failed[0]['files'] == ['page1.png']
+    assert 'OCR worker process died' in failed[0]['error']
+
+
+def test_a_lost_page_times_out(app_module, batch, monkeypatch):
+    monkeypatch.setitem(app_module.app.config, 'BATCH_PAGE_TIMEOUT', 0.5)
+    monkeypatch.setattr(app_module.ocr_jobs, 'submit', lambda *args, **kwargs: 'lost')   # on_done never runs
+    lines = batch(images(1, 'lost'))
+    assert lines[0]['error'] == 'page0.png: No OCR result within 0.5s'
+    assert lines[-1]['failed'] == 1
+
+
+def test_rejected_batches(app_module, batch):
+    assert batch([]).status_code == 400
+    assert batch(images(1, 'mode'), mode='book').status_code == 400
+    assert batch(images(2, 'groups'), group=['a']).status_code == 400
+    assert batch([b'not an image']).status_code == 400
+    response = batch(images(5, 'full'))     # More pages than the queue can take
+    assert response.status_code == 429
+    assert response.get_json()['reason'] == 'jobs_full'
+
+
+def test_batch_size_is_clamped_to_the_job_queue(app_module):
+    assert app_module.app.config['MAX_BATCH_FILES'] <= app_module.app.config['OCR_JOB_QUEUE_SIZE']
@@ -0,0 +1,114 @@
+import json
+import random
+from collections import defaultdict
+
+import pytest
+
+from vitals import NAN, VitalsStore, format_timestamp, parse_reading, parse_timestamp
+
+T0 = 1_700_000_040   # A whole minute
+
+
+def reading(t, heart_rate, pressure='120/80', **extra):
+    return dict(extra, patientId='P1', timestamp=format_timestamp(t), heartRate=heart_rate, bloodPressure=pressure)
+
+
+def test_timestamps_and_readings():
+    assert parse_timestamp('2023-11-14T22:14:00Z') == parse_timestamp('2023-11-14T22:14:00')
+    assert parse_timestamp('2023-11-14T23:14:00+01:00') == parse_timestamp('2023-11-14T22:14:00Z')
+    t, values = parse_reading({'timestamp': '2023-11-14T22:14:00Z', 'bloodPressure': '120/80'})
+    assert values[1:3] == (120.0, 80.0)
+    assert values[0] != values[0]   # Missing heart rate is NaN
+
+
+def test_ingest_reports_bad_lines():
+    store = VitalsStore()
+    lines = [
+        json.dumps(reading(T0, 70)),
+        '',
+        '{not json',
+        json.dumps({'patientId': 'P2', 'vitals': [reading(T0, 80), reading(T0 + 1, 82)]}),
+        json.dumps({'timestamp': format_timestamp(T0)}),
+    ]
+    accepted, errors = store.ingest(lines)
+    assert accepted == 3
+    assert [number for number, _ in errors] == [3, 5]
+    assert store.stats() == {'patients': 2, 'readings': 3}
+
+
+def test_raw_ring_keeps_the_newest_readings_in_order():
+    store = VitalsStore(raw_capacity=5)
+    times = [T0 + i * 10 for i in range(8)]
+    for t in times[:6] + [times[7], times[6]]:      # The last reading arrives late
+        store.add('P1', t, heart_rate=60)
+    points = store.query('P1', resolution='raw')['points']
+    assert [parse_timestamp(p['timestamp']) for p in points] == times[3:]
+    assert points[0] == {'timestamp': format_timestamp(times[3]), 'heartRate': 60, 'temperature': None,
+                         'bloodPressure': None}
+
+
+def test_rollups_match_the_raw_readings():
+    store = VitalsStore()
+    rng = random.Random(1)
+    minutes = defaultdict(list)
+    for i in range(600):
+        t = T0 + i * 7 - (rng.randint(1, 200) if rng.random() < 0.05 else 0)
+        heart_rate = rng.randint(50, 120)
+        store.add('P1', t, heart_rate=heart_rate, systolic=120, diastolic=80)
+        minutes[t - t % 60].append(heart_rate)
+
+    points = store.query('P1', resolution='minute')['points']
+    assert [parse_timestamp(p['timestamp']) for p in points] == sorted(minutes)
+    for point in points:
+        values = minutes[parse_timestamp(point['timestamp'])]
+        assert point['heart_rate'] == {
+            'count': len(values), 'min': min(values), 'max': max(values), 'mean': round(sum(values) / len(values), 2)
+        }
+        assert point['temperature']['count'] == 0
+
+    hours = store.query('P1', resolution='hour')['points']
+    assert sum(p['heart_rate']['count'] for p in hours) == 600
+
+
+def test_auto_picks_the_finest_level_that_fits():
+    store = VitalsStore()
+    for i in range(3 * 3600 // 5):
+        store.add('P1', T0 + i * 5, heart_rate=70, temperature=NAN)
+    assert store.query('P1', T0, T0 + 600)['resolution'] == 'raw'
+    assert store.query('P1', T0, T0 + 3 * 3600)['resolution'] == 'minute'
+    assert store.query('P1', T0, T0 + 3 * 3600, max_points=10)['resolution'] == 'hour'
+    assert store.query('P2') is None
+
+
+def test_vitals_endpoints(client):
+    body = '\n'.join(json.dumps(dict(reading(T0 + i, 70 + i), patientId='endpoint')) for i in range(3))
+    response = client.post('/vitals', data=body + '\nbad line\n')
+    assert response.get_json()['accepted'] == 3
+    assert response.get_json()['errors'][0]['line'] == 4
+    assert client.post('/vitals', data='bad line\n').status_code == 400
+
+    result = client.get(f'/vitals/endpoint?from={format_timestamp(T0 + 1)}&resolution=raw').get_json()
+    assert [p['heartRate'] for p in result['points']] == [71, 72]
+    assert client.get('/vitals/endpoint?from=yesterday').status_code == 400
+    assert client.get('/vitals/endpoint?resolution=day').status_code == 400
+    assert client.get('/vitals/nobody').status_code == 404
+
+
+@pytest.mark.parametrize('pressure', ['120', '120/x'])
+def test_malformed_pressure_is_rejected(pressure):
+    accepted, errors = VitalsStore().ingest([json.dumps(reading(T0, 70, pressure))])
+    assert (accepted, len(errors)) == (0, 1)
+
+
+@pytest.mark.parametrize('document', [
+    {'patientId': 'P1', 'timestamp': 123},
+    {'patientId': 'P1', 'vitals': [1]},
+])
+def test_wrongly_typed_lines_are_rejected(client, document):
+    accepted, errors = VitalsStore().ingest([json.dumps(reading(T0, 70)), json.dumps(document)])
+    assert accepted == 1
+    assert [number for number, _ in errors] == [2]
+    assert errors[0][1].startswith('TypeError')
+
+    response = client.post('/vitals', data=json.dumps(document))
+    assert response.status_code == 400
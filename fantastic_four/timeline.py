@@ -0,0 +1,99 @@
+"""A patient's doses across all of their prescriptions, merged into one timeline"""
+import heapq
+from datetime import date, timedelta
+from itertools import groupby
+from operator import itemgetter
+
+
+def medicine_key(name):
+    """Medicine names compared across prescriptions (case and spacing ignored)"""
+    return ' '.join(str(name).casefold().split())
+
+
+def _stream(prescription_id, schedule, first, last):
+    for date_str, dose in schedule.doses(first, last):
+        yield date_str, dose['time'], prescription_id, dose
+
+
+def merge(prescriptions, first=None, last=None, limit=None):
+    """
+    Days with doses from every schedule in `prescriptions` ([(prescription id,
+    Schedule)]) between the dates `first` (default: the earliest start) and
+    `last` (inclusive), at most `limit` calendar days (None for no limit).
+    Returns (days, next_from) like Schedule.expand.
+
+    Each schedule yields its doses day by day and the streams are k-way merged
+    by (date, time), so only the days in the window are ever expanded.
+    """
+    if not prescriptions:
+        return [], None
+    end = max(schedule.end for _, schedule in prescriptions)
+    last = end if last is None else min(last, end)
+    first = first or min(schedule.start for _, schedule in prescriptions)
+    stop = last if limit is None else min(last, first + timedelta(days=limit - 1))
+
+    streams = [_stream(prescription_id, schedule, first, stop) for prescription_id, schedule in prescriptions
+               if schedule.start <= stop and schedule.end >= first]
+    days = []
+    for date_str, entries in groupby(heapq.merge(*streams, key=itemgetter(0, 1)), key=itemgetter(0)):
+        medications = []
+        for _, _, prescription_id, dose in entries:
+            dose['prescription_id'] = prescription_id
+            medications.append(dose)
+        flag_overlaps(medications)
+        days.append({
+            'date': date_str,
+            'day': date.fromisoformat(date_str).strftime('%A'),
+            'medications': medications
+        })
+    next_from = (stop + timedelta(days=1)).isoformat() if stop < last else None
+    return days, next_from
+
+
+def flag_overlaps(doses):
+    """
+    Flag one day's doses of a medicine that several prescriptions include:
+    `overlaps_with` lists the other prescriptions, and `duplicate` is set when
+    another prescription has the same medicine at the same time.
+    """
+    by_medicine = {}
+    for dose in doses:
+        by_medicine.setdefault(medicine_key(dose['medicine']), []).append(dose)
+    for same in by_medicine.values():
+        prescriptions = {dose['prescription_id'] for dose in same}
+        at_time = {}
+        for dose in same:
+            at_time.setdefault(dose['time'], set()).add(dose['prescription_id'])
+        for dose in same:
+            dose['overlaps_with'] = sorted(prescriptions - {dose['prescription_id']})
+            dose['duplicate'] = len(at_time[dose['time']]) > 1
+
+
+def overlapping_rules(prescriptions):
+    """
+    Pairs of prescriptions that schedule the same medicine on the same dates:
+    [{'medicine', 'prescriptions', 'from', 'to', 'same_times'}]. Worked out
+    from the rules, so it doesn't depend on the window or schedule length.
+    """
+    rules = {}
+    for prescription_id, schedule in prescriptions:
+        for rule in schedule.rules:
+            if rule['days'] > 0:
+                end = schedule.start + timedelta(days=rule['days'] - 1)
+                rules.setdefault(medicine_key(rule['medicine']), []).append((prescription_id, schedule.start, end, rule))
+
+    overlaps = []
+    for entries in rules.values():
+        for i, (a_id, a_start, a_end, a_rule) in enumerate(entries):
+            for b_id, b_start, b_end, b_rule in entries[i + 1:]:
+                first, last = max(a_start, b_start), min(a_end, b_end)
+                if a_id == b_id or first > last:
+                    continue
+                overlaps.append({
+                    'medicine': a_rule['medicine'],
+                    'prescriptions': [a_id, b_id],
+                    'from': first.isoformat(),
+                    'to': last.isoformat(),
+                    'same_times': sorted(set(a_rule['times']) & set(b_rule['times']))
+                })
+    return overlaps
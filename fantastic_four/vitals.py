@@ -0,0 +1,309 @@
+"""
+Per-patient vitals time series in fixed-size array rings, with 1-minute and
+1-hour rollups kept up to date as readings arrive.
+"""
+import json
+import math
+import threading
+from array import array
+from bisect import bisect_left
+from datetime import datetime, timezone
+
+METRICS = ('heart_rate', 'systolic', 'diastolic', 'temperature')
+STATS = ('count', 'min', 'max', 'sum')
+
+# Readings kept per patient, and rollup buckets per level (1 week of minutes, 1 year of hours)
+RAW_CAPACITY = 4096
+MINUTE_CAPACITY = 7 * 24 * 60
+HOUR_CAPACITY = 365 * 24
+MAX_POINTS = 1000   # A range query uses the finest level that returns at most this many points
+
+NAN = float('nan')
+
+
+class _Ring:
+    """
+    Columns of doubles sorted by their first column (time), holding at most
+    `capacity` rows; appending to a full ring drops the oldest row. Columns
+    grow as rows arrive, so a patient with few readings uses little memory.
+    """
+
+    def __init__(self, columns, capacity):
+        self.capacity = capacity
+        self.names = ('time',) + tuple(columns)
+        self.arrays = [array('d') for _ in self.names]
+        self.columns = dict(zip(self.names, self.arrays))
+        self.size = 0
+        self.start = 0     # Physical index of the oldest row once the ring is full
+        self.last = None   # Newest time
+
+    def __len__(self):
+        return self.size
+
+    def physical(self, i):
+        return (self.start + i) % self.capacity if self.size == self.capacity else i
+
+    def time(self, i):
+        return self.arrays[0][self.physical(i)]
+
+    def bisect(self, t):
+        """First logical index whose time is >= t"""
+        low, high = 0, self.size
+        while low < high:
+            mid = (low + high) // 2
+            if self.time(mid) < t:
+                low = mid + 1
+            else:
+                high = mid
+        return low
+
+    def append(self, row):
+        """Add a row (values in column order) with a time >= every stored time"""
+        if self.size < self.capacity:
+            for column, value in zip(self.arrays, row):
+                column.append(value)
+            self.size += 1
+        else:
+            start = self.start
+            for column, value in zip(self.arrays, row):
+                column[start] = value
+            self.start = (start + 1) % self.capacity
+        self.last = row[0]
+
+    def insert(self, row):
+        """Add a row at its place in time order (slow path for late readings)"""
+        if not self.size or row[0] >= self.last:
+            self.append(row)
+            return
+        if self.size == self.capacity and row[0] < self.time(0):
+            return   # Older than everything kept
+        ordered = [self.rows(name, 0, self.size) for name in self.names]
+        index = bisect_left(ordered[0], row[0])
+        for i, (values, value) in enumerate(zip(ordered, row)):
+            values.insert(index, value)
+            if len(values) > self.capacity:
+                del values[0]
+            self.arrays[i] = array('d', values)
+        self.columns = dict(zip(self.names, self.arrays))
+        self.size = len(self.arrays[0])
+        self.start = 0
+
+    def rows(self, name, first, last):
+        """Values of one column for logical rows [first, last)"""
+        column = self.columns[name]
+        if self.size < self.capacity or self.start == 0:
+            return column[first:last].tolist()
+        if first >= last:
+            return []
+        a, b = self.physical(first), self.physical(last - 1) + 1
+        if a < b:
+            return column[a:b].tolist()
+        return column[a:].tolist() + column[:b].tolist()
+
+
+class _Rollup:
+    """count/min/max/sum per metric in fixed-width time buckets"""
+
+    def __init__(self, seconds, capacity):
+        self.seconds = seconds
+        self.ring = _Ring([f'{metric}_{stat}' for metric in METRICS for stat in STATS], capacity)
+
+    def add(self, t, values):
+        bucket = t - t % self.seconds
+        ring = self.ring
+        if ring.size and ring.last > bucket:
+            # Late reading for an earlier bucket
+            index = ring.bisect(bucket)
+            if index == ring.size or ring.time(index) != bucket:
+                ring.insert(self._bucket(bucket, [NAN] * len(METRICS)))
+                index = ring.bisect(bucket)
+                if index == ring.size or ring.time(index) != bucket:
+                    return   # Too old for this level
+        elif not ring.size or ring.last < bucket:
+            ring.append(self._bucket(bucket, values))
+            return
+        else:
+            index = ring.size - 1
+
+        p = ring.physical(index)
+        arrays = ring.arrays
+        offset = 1
+        for value in values:
+            if value == value:   # NaN: not measured
+                counts = arrays[offset]
+                count = counts[p]
+                counts[p] = count + 1
+                if not count or value < arrays[offset + 1][p]:
+                    arrays[offset + 1][p] = value
+                if not count or value > arrays[offset + 2][p]:
+                    arrays[offset + 2][p] = value
+                arrays[offset + 3][p] += value
+            offset += len(STATS)
+
+    @staticmethod
+    def _bucket(bucket, values):
+        """A bucket row holding just `values`"""
+        row = [bucket]
+        for value in values:
+            row.extend((0.0, 0.0, 0.0, 0.0) if value != value else (1.0, value, value, value))
+        return row
+
+
+class PatientVitals:
+    def __init__(self, raw_capacity=RAW_CAPACITY, minute_capacity=MINUTE_CAPACITY, hour_capacity=HOUR_CAPACITY):
+        self.raw = _Ring(METRICS, raw_capacity)
+        self.levels = {'minute': _Rollup(60, minute_capacity), 'hour': _Rollup(3600, hour_capacity)}
+
+    def add(self, t, values):
+        if self.raw.size and t < self.raw.last:
+            self.raw.insert((t,) + values)
+        else:
+            self.raw.append((t,) + values)
+        for rollup in self.levels.values():
+            rollup.add(t, values)
+
+
+class VitalsStore:
+    """
+    Vitals for every patient, in this process's memory.
+
+    Memory per patient is bounded by the ring capacities (raw readings,
+    1-minute and 1-hour buckets); the rollups are updated on every reading,
+    so range queries never aggregate raw data.
+    """
+
+    def __init__(self, raw_capacity=RAW_CAPACITY, minute_capacity=MINUTE_CAPACITY, hour_capacity=HOUR_CAPACITY):
+        self.capacities = (raw_capacity, minute_capacity, hour_capacity)
+        self._patients = {}
+        self._lock = threading.Lock()
+        self.readings = 0
+
+    def add(self, patient_id, timestamp, heart_rate=NAN, systolic=NAN, diastolic=NAN, temperature=NAN):
+        """Store one reading; `timestamp` is epoch seconds, NaN marks a missing value"""
+        self._add(patient_id, [(timestamp, (heart_rate, systolic, diastolic, temperature))])
+
+    def _add(self, patient_id, readings):
+        with self._lock:
+            patient = self._patients.get(patient_id)
+            if patient is None:
+                patient = self._patients[patient_id] = PatientVitals(*self.capacities)
+            for t, values in readings:
+                patient.add(t, values)
+            self.readings += len(readings)
+
+    def ingest(self, lines):
+        """
+        Store readings from NDJSON lines (bytes or str). A line is either one
+        reading with a patientId, or {"patientId", "vitals": [readings]} as in
+        the sample vitals file. Returns (accepted, [(line number, error)]).
+        """
+        accepted, errors = 0, []
+        for number, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            try:
+                document = json.loads(line)
+                patient_id = str(document['patientId'])
+                readings = document['vitals'] if 'vitals' in document else [document]
+                parsed = [parse_reading(reading) for reading in readings]
+            except (ValueError, KeyError, TypeError) as e:
+                errors.append((number, f'{type(e).__name__}: {e}'))
+                continue
+            self._add(patient_id, parsed)
+            accepted += len(parsed)
+        return accepted, errors
+
+    def query(self, patient_id, start=None, end=None, resolution='auto', max_points=MAX_POINTS):
+        """
+        Readings or rollup buckets with start <= time < end (epoch seconds).
+        `resolution` is 'raw', 'minute', 'hour' or 'auto' (the finest level
+        with at most `max_points` points that still covers `start`).
+        Returns None for an unknown patient.
+        """
+        with self._lock:
+            patient = self._patients.get(patient_id)
+            if patient is None:
+                return None
+            start = -math.inf if start is None else start
+            end = math.inf if end is None else end
+            levels = [('raw', patient.raw)] + [(name, r.ring) for name, r in patient.levels.items()]
+            if resolution == 'auto':
+                resolution = levels[-1][0]
+                for name, ring in levels:
+                    first, last = ring.bisect(start), ring.bisect(end)
+                    covers = len(ring) and (ring.time(0) <= start or len(ring) < ring.capacity)
+                    if last - first <= max_points and covers:
+                        resolution = name
+                        break
+            ring = dict(levels)[resolution]
+            first, last = ring.bisect(start), ring.bisect(end)
+            columns = {name: ring.rows(name, first, last) for name in ring.columns}
+
+        if resolution == 'raw':
+            points = [format_reading(*row) for row in zip(*(columns[name] for name in ('time',) + METRICS))]
+        else:
+            points = [_format_bucket(columns, i) for i in range(len(columns['time']))]
+        return {'patient_id': patient_id, 'resolution': resolution, 'points': points}
+
+    def stats(self):
+        with self._lock:
+            return {'patients': len(self._patients), 'readings': self.readings}
+
+
+def parse_timestamp(value):
+    """ISO 8601 (a trailing Z or no offset means UTC) to epoch seconds"""
+    if not isinstance(value, str):
+        raise TypeError('timestamp must be an ISO 8601 string')
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+def format_timestamp(t):
+    return datetime.fromtimestamp(t, timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def parse_reading(reading):
+    """(epoch seconds, (heart rate, systolic, diastolic, temperature)) from the sample-vitals schema"""
+    if not isinstance(reading, dict):
+        raise TypeError('a reading must be an object')
+    systolic = diastolic = NAN
+    pressure = reading.get('bloodPressure')
+    if pressure:
+        high, _, low = str(pressure).partition('/')
+        systolic, diastolic = float(high), float(low)
+    heart_rate = reading.get('heartRate')
+    temperature = reading.get('temperature')
+    return parse_timestamp(reading['timestamp']), (
+        NAN if heart_rate is None else float(heart_rate),
+        systolic,
+        diastolic,
+        NAN if temperature is None else float(temperature)
+    )
+
+
+def _value(v):
+    if v != v:
+        return None
+    return int(v) if v.is_integer() else v
+
+
+def format_reading(t, heart_rate, systolic, diastolic, temperature):
+    """One raw reading in the sample-vitals schema"""
+    reading = {'timestamp': format_timestamp(t), 'heartRate': _value(heart_rate), 'temperature': _value(temperature)}
+    reading['bloodPressure'] = None if systolic != systolic else f'{_value(systolic)}/{_value(diastolic)}'
+    return reading
+
+
+def _format_bucket(columns, i):
+    bucket = {'timestamp': format_timestamp(columns['time'][i])}
+    for metric in METRICS:
+        count = int(columns[f'{metric}_count'][i])
+        bucket[metric] = {
+            'count': count,
+            'min': _value(columns[f'{metric}_min'][i]) if count else None,
+            'max': _value(columns[f'{metric}_max'][i]) if count else None,
+            'mean': round(columns[f'{metric}_sum'][i] / count, 2) if count else None
+        }
+    return bucket